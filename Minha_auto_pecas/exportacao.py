@@ -0,0 +1,130 @@
+# EXPORTAÇÃO DE PLANILHAS EM FLUXO (CSV E XLSX) - SISTEMA DE AUTOPEÇAS FAMÍLIA
+#
+# Os geradores recebem o cabeçalho e um iterável de linhas e devolvem os bytes do
+# arquivo em partes, à medida que as linhas chegam: nada é montado inteiro em memória.
+# O XLSX é escrito direto no formato Office Open XML (zip + XML) com a biblioteca padrão.
+import csv
+import io
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+# Tamanho aproximado de cada parte entregue à resposta HTTP
+TAMANHO_PARTE = 64 * 1024
+
+# Caracteres de controle não aceitos em XML 1.0 (removidos das células)
+_CARACTERES_INVALIDOS_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def gerar_csv(cabecalho, linhas):
+    """CSV em UTF-8 com BOM (abre com acentos no Excel), entregue em partes de ~64 KB"""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    buffer.write('\ufeff')
+    escritor.writerow(cabecalho)
+    for linha in linhas:
+        escritor.writerow(linha)
+        if buffer.tell() >= TAMANHO_PARTE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+class _SaidaEmPartes:
+    """Destino do zip sem seek: acumula o que o zipfile escreve até a resposta retirar"""
+
+    def __init__(self):
+        self.partes = []
+        self.tamanho = 0
+
+    def write(self, dados):
+        self.partes.append(bytes(dados))
+        self.tamanho += len(dados)
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def retirar(self):
+        dados = b''.join(self.partes)
+        self.partes = []
+        self.tamanho = 0
+        return dados
+
+
+_CONTENT_TYPES_XLSX = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>
+</Types>'''
+
+_RELS_XLSX = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>'''
+
+_WORKBOOK_XLSX = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="{nome}" sheetId="1" r:id="rId1"/></sheets>
+</workbook>'''
+
+_WORKBOOK_RELS_XLSX = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>'''
+
+# Estilo 1 = negrito (cabeçalho)
+_STYLES_XLSX = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>
+<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>
+<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/><xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>
+</styleSheet>'''
+
+_INICIO_PLANILHA_XLSX = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                         '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                         '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" '
+                         'activePane="bottomLeft" state="frozen"/></sheetView></sheetViews><sheetData>')
+_FIM_PLANILHA_XLSX = '</sheetData></worksheet>'
+
+
+def _celula_xlsx(valor, estilo=''):
+    """Célula XML: números como valor numérico, o resto como texto embutido (sem tabela de textos compartilhados)"""
+    if valor is None or valor == '':
+        return '<c/>'
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return f'<c{estilo}><v>{valor!r}</v></c>'
+    texto = escape(_CARACTERES_INVALIDOS_XML.sub('', str(valor)))
+    return f'<c t="inlineStr"{estilo}><is><t xml:space="preserve">{texto}</t></is></c>'
+
+
+def gerar_xlsx(cabecalho, linhas, nome_planilha='Planilha'):
+    """XLSX de uma planilha escrito em fluxo: o zip sai em partes enquanto as linhas são lidas"""
+    saida = _SaidaEmPartes()
+    with zipfile.ZipFile(saida, 'w', zipfile.ZIP_DEFLATED) as arquivo:
+        arquivo.writestr('[Content_Types].xml', _CONTENT_TYPES_XLSX)
+        arquivo.writestr('_rels/.rels', _RELS_XLSX)
+        arquivo.writestr('xl/workbook.xml', _WORKBOOK_XLSX.format(nome=escape(nome_planilha[:31])))
+        arquivo.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS_XLSX)
+        arquivo.writestr('xl/styles.xml', _STYLES_XLSX)
+        yield saida.retirar()
+
+        # force_zip64: o tamanho da planilha não é conhecido antes de terminar
+        with arquivo.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as planilha:
+            planilha.write(_INICIO_PLANILHA_XLSX.encode('utf-8'))
+            planilha.write(('<row>' + ''.join(_celula_xlsx(titulo, ' s="1"') for titulo in cabecalho)
+                            + '</row>').encode('utf-8'))
+            for linha in linhas:
+                planilha.write(('<row>' + ''.join(_celula_xlsx(valor) for valor in linha)
+                                + '</row>').encode('utf-8'))
+                if saida.tamanho >= TAMANHO_PARTE:
+                    yield saida.retirar()
+            planilha.write(_FIM_PLANILHA_XLSX.encode('utf-8'))
+    yield saida.retirar()
@@ -1,12 +1,36 @@
 # LOGICA DE BANCO DE DADOS - SISTEMA DE AUTOPEÇAS FAMÍLIA
 import sqlite3
 import os
-from datetime import datetime, date
+import re
+import sys
+import io
+import copy
+import base64
+import json
+import time
+import queue
+import bisect
+import threading
+import hashlib
+import zipfile
+import multiprocessing
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from contextlib import contextmanager
+from datetime import datetime, date, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
 
+try:
+    from .migracoes import aplicar_migracoes, SQL_RECONSTRUIR_RESUMO_VENDAS
+except ImportError:
+    from migracoes import aplicar_migracoes, SQL_RECONSTRUIR_RESUMO_VENDAS
+
 # Caminho do banco de dados
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'autopecas.db')
 
+# Conexões ociosas mantidas por thread (workers/threads do gunicorn)
+POOL_MAX_OCIOSAS_POR_THREAD = 4
+
 # Configurações SQLite para melhor performance e reduzir locks
 def configure_sqlite_connection(conn):
     """Configura a conexão SQLite para melhor performance"""
@@ -16,399 +40,160 @@ def configure_sqlite_connection(conn):
     conn.execute("PRAGMA temp_store=MEMORY")  # Usa memoria para tabelas temporárias
     conn.execute("PRAGMA busy_timeout=30000")  # 30 segundos de timeout para locks
 
+class ConexaoPool(sqlite3.Connection):
+    """Conexão SQLite que volta para o pool quando close() é chamado"""
+
+    def close(self):
+        _pool.devolver(self)
+
+    def fechar_definitivamente(self):
+        sqlite3.Connection.close(self)
+
+class PoolConexoes:
+    """
+    Pool de conexões SQLite por thread.
+
+    Cada thread mantém uma pilha de conexões já configuradas (PRAGMAs aplicados
+    uma única vez na criação). Checkouts aninhados recebem conexões distintas,
+    e conexões herdadas de outro processo (fork do gunicorn) são descartadas.
+    """
+
+    def __init__(self, max_ociosas=POOL_MAX_OCIOSAS_POR_THREAD):
+        self.max_ociosas = max_ociosas
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._stats = {
+            'criadas': 0,
+            'reutilizadas': 0,
+            'devolvidas': 0,
+            'descartadas': 0,
+            'em_uso': 0,
+            'ociosas': 0,
+        }
+
+    def _contar(self, **deltas):
+        with self._lock:
+            for chave, delta in deltas.items():
+                self._stats[chave] += delta
+
+    def _ociosas_da_thread(self):
+        if self._pid != os.getpid():
+            # Processo filho (fork): conexões e contadores do pai não valem aqui
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self._local = threading.local()
+                    for chave in self._stats:
+                        self._stats[chave] = 0
+        ociosas = getattr(self._local, 'ociosas', None)
+        if ociosas is None:
+            ociosas = self._local.ociosas = []
+        return ociosas
+
+    def obter(self, timeout=30.0):
+        """Retira uma conexão do pool (ou cria uma nova já configurada)"""
+        ociosas = self._ociosas_da_thread()
+        while ociosas:
+            caminho, conn = ociosas.pop()
+            self._contar(ociosas=-1)
+            if caminho == DB_PATH:
+                conn._caminho_pool = caminho
+                conn._em_uso = True
+                self._contar(reutilizadas=1, em_uso=1)
+                return conn
+            conn.fechar_definitivamente()
+            self._contar(descartadas=1)
+
+        conn = sqlite3.connect(DB_PATH, timeout=timeout, factory=ConexaoPool)
+        configure_sqlite_connection(conn)
+        conn._caminho_pool = DB_PATH
+        conn._em_uso = True
+        self._contar(criadas=1, em_uso=1)
+        return conn
+
+    def devolver(self, conn):
+        """Devolve a conexão ao pool, descartando transações não confirmadas"""
+        if not getattr(conn, '_em_uso', False):
+            return
+        conn._em_uso = False
+        self._contar(em_uso=-1)
+
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = None
+        except sqlite3.Error:
+            conn.fechar_definitivamente()
+            self._contar(descartadas=1)
+            return
+
+        ociosas = self._ociosas_da_thread()
+        if conn._caminho_pool != DB_PATH or len(ociosas) >= self.max_ociosas:
+            conn.fechar_definitivamente()
+            self._contar(descartadas=1)
+            return
+
+        ociosas.append((conn._caminho_pool, conn))
+        self._contar(devolvidas=1, ociosas=1)
+
+    def estatisticas(self):
+        """Retorna os contadores do pool neste processo"""
+        self._ociosas_da_thread()
+        with self._lock:
+            stats = dict(self._stats)
+        total_checkouts = stats['criadas'] + stats['reutilizadas']
+        stats['pid'] = self._pid
+        stats['taxa_reuso'] = (stats['reutilizadas'] / total_checkouts) if total_checkouts else 0
+        return stats
+
+_pool = PoolConexoes()
+
 def get_db_connection(timeout=30.0):
-    """Cria uma conexão configurada com o banco"""
-    conn = sqlite3.connect(DB_PATH, timeout=timeout)
-    configure_sqlite_connection(conn)
-    return conn
+    """Obtém uma conexão configurada do pool (close() devolve ao pool)"""
+    return _pool.obter(timeout)
 
-def init_db():
-    """Inicializa o banco de dados criando todas as tabelas necessárias"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Tabela de usuários com permissões
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS usuarios (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            nome_completo TEXT NOT NULL,
-            email TEXT NOT NULL,
-            ativo BOOLEAN DEFAULT 1,
-            permissao_vendas BOOLEAN DEFAULT 1,
-            permissao_estoque BOOLEAN DEFAULT 1,
-            permissao_clientes BOOLEAN DEFAULT 1,
-            permissao_financeiro BOOLEAN DEFAULT 0,
-            permissao_caixa BOOLEAN DEFAULT 0,
-            permissao_relatorios BOOLEAN DEFAULT 0,
-            permissao_admin BOOLEAN DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            created_by INTEGER,
-            FOREIGN KEY (created_by) REFERENCES usuarios (id)
-        )
-    ''')
-    
-    # Verificar e adicionar colunas se não existirem (para compatibilidade com DB existente)
-    try:
-        cursor.execute("ALTER TABLE usuarios ADD COLUMN nome_completo TEXT DEFAULT ''")
-    except:
-        pass
-    try:
-        cursor.execute("ALTER TABLE usuarios ADD COLUMN ativo BOOLEAN DEFAULT 1")
-    except:
-        pass
-    try:
-        cursor.execute("ALTER TABLE usuarios ADD COLUMN permissao_vendas BOOLEAN DEFAULT 1")
-    except:
-        pass
-    try:
-        cursor.execute("ALTER TABLE usuarios ADD COLUMN permissao_estoque BOOLEAN DEFAULT 1")
-    except:
-        pass
-    try:
-        cursor.execute("ALTER TABLE usuarios ADD COLUMN permissao_clientes BOOLEAN DEFAULT 1")
-    except:
-        pass
-    try:
-        cursor.execute("ALTER TABLE usuarios ADD COLUMN permissao_financeiro BOOLEAN DEFAULT 0")
-    except:
-        pass
-    try:
-        cursor.execute("ALTER TABLE usuarios ADD COLUMN permissao_caixa BOOLEAN DEFAULT 0")
-    except:
-        pass
-    try:
-        cursor.execute("ALTER TABLE usuarios ADD COLUMN permissao_relatorios BOOLEAN DEFAULT 0")
-    except:
-        pass
-    try:
-        cursor.execute("ALTER TABLE usuarios ADD COLUMN permissao_admin BOOLEAN DEFAULT 0")
-    except:
-        pass
-    try:
-        cursor.execute("ALTER TABLE usuarios ADD COLUMN created_by INTEGER")
-    except:
-        pass
-    try:
-        cursor.execute("ALTER TABLE usuarios ADD COLUMN permissao_contas_pagar BOOLEAN DEFAULT 0")
-    except:
-        pass
-    try:
-        cursor.execute("ALTER TABLE usuarios ADD COLUMN permissao_contas_receber BOOLEAN DEFAULT 0")
-    except:
-        pass
-    
-    # Tabela de clientes
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS clientes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nome TEXT NOT NULL,
-            telefone TEXT,
-            email TEXT,
-            cpf_cnpj TEXT,
-            endereco TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Tabela de produtos
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS produtos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nome TEXT NOT NULL,
-            preco REAL NOT NULL,
-            estoque INTEGER DEFAULT 0,
-            estoque_minimo INTEGER DEFAULT 5,
-            codigo_barras TEXT UNIQUE,
-            descricao TEXT,
-            categoria TEXT,
-            ativo BOOLEAN DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Adicionar colunas para dados da NFe se não existirem
-    try:
-        cursor.execute("ALTER TABLE produtos ADD COLUMN ncm TEXT")
-    except:
-        pass
-    try:
-        cursor.execute("ALTER TABLE produtos ADD COLUMN unidade TEXT DEFAULT 'UN'")
-    except:
-        pass
-    
-    # Adicionar colunas para gestão comercial
-    try:
-        cursor.execute("ALTER TABLE produtos ADD COLUMN codigo_fornecedor TEXT")
-    except:
-        pass
-    try:
-        cursor.execute("ALTER TABLE produtos ADD COLUMN preco_custo REAL DEFAULT 0")
-    except:
-        pass
-    try:
-        cursor.execute("ALTER TABLE produtos ADD COLUMN margem_lucro REAL DEFAULT 0")
-    except:
-        pass
-    try:
-        cursor.execute("ALTER TABLE produtos ADD COLUMN fornecedor_id INTEGER")
-    except:
-        pass
-    
-    # Adicionar coluna para foto do produto se não existir
-    try:
-        cursor.execute("ALTER TABLE produtos ADD COLUMN foto_url TEXT")
-    except:
-        pass
-    
-    # Adicionar coluna para marca do produto se não existir
-    try:
-        cursor.execute("ALTER TABLE produtos ADD COLUMN marca TEXT")
-    except:
-        pass
-    
-    # Adicionar coluna para fornecedor na tabela contas_pagar se não existir
-    try:
-        cursor.execute("ALTER TABLE contas_pagar ADD COLUMN fornecedor_id INTEGER")
-    except:
-        pass
-    
-    # Tabela de vendas
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS vendas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            cliente_id INTEGER,
-            total REAL NOT NULL,
-            forma_pagamento TEXT NOT NULL,
-            desconto REAL DEFAULT 0,
-            observacoes TEXT,
-            data_venda TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            usuario_id INTEGER,
-            FOREIGN KEY (cliente_id) REFERENCES clientes (id),
-            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
-        )
-    ''')
-    
-    # Tabela de itens de venda
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS itens_venda (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            venda_id INTEGER NOT NULL,
-            produto_id INTEGER NOT NULL,
-            quantidade INTEGER NOT NULL,
-            preco_unitario REAL NOT NULL,
-            subtotal REAL NOT NULL,
-            FOREIGN KEY (venda_id) REFERENCES vendas (id),
-            FOREIGN KEY (produto_id) REFERENCES produtos (id)
-        )
-    ''')
-    
-    # Tabela de contas a pagar
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS contas_pagar (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            descricao TEXT NOT NULL,
-            valor REAL NOT NULL,
-            data_vencimento DATE NOT NULL,
-            data_pagamento DATE,
-            status TEXT DEFAULT 'pendente',
-            categoria TEXT,
-            observacoes TEXT,
-            fornecedor_id INTEGER,
-            lancamento_financeiro_id INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (fornecedor_id) REFERENCES fornecedores (id),
-            FOREIGN KEY (lancamento_financeiro_id) REFERENCES lancamentos_financeiros (id)
-        )
-    ''')
-    
-    # Tabela de contas a receber
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS contas_receber (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            descricao TEXT NOT NULL,
-            valor REAL NOT NULL,
-            data_vencimento DATE NOT NULL,
-            data_recebimento DATE,
-            status TEXT DEFAULT 'pendente',
-            cliente_id INTEGER,
-            venda_id INTEGER,
-            observacoes TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (cliente_id) REFERENCES clientes (id),
-            FOREIGN KEY (venda_id) REFERENCES vendas (id)
-        )
-    ''')
-    
-    # Tabela de orçamentos
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS orcamentos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            numero_orcamento TEXT UNIQUE NOT NULL,
-            cliente_id INTEGER,
-            total REAL NOT NULL DEFAULT 0,
-            desconto REAL DEFAULT 0,
-            observacoes TEXT,
-            status TEXT DEFAULT 'pendente',
-            data_validade DATE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            usuario_id INTEGER,
-            FOREIGN KEY (cliente_id) REFERENCES clientes (id),
-            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
-        )
-    ''')
-    
-    # Tabela de itens de orçamento
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS itens_orcamento (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            orcamento_id INTEGER NOT NULL,
-            produto_id INTEGER NOT NULL,
-            quantidade INTEGER NOT NULL,
-            preco_unitario REAL NOT NULL,
-            subtotal REAL NOT NULL,
-            FOREIGN KEY (orcamento_id) REFERENCES orcamentos (id),
-            FOREIGN KEY (produto_id) REFERENCES produtos (id)
-        )
-    ''')
-    
-    # Tabela de caixa - movimentações financeiras
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS caixa_movimentacoes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            tipo TEXT NOT NULL, -- 'entrada', 'saida'
-            categoria TEXT NOT NULL, -- 'venda', 'conta_paga', 'conta_recebida', 'despesa', 'receita'
-            descricao TEXT NOT NULL,
-            valor REAL NOT NULL,
-            data_movimentacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            usuario_id INTEGER NOT NULL,
-            venda_id INTEGER, -- Link com venda se aplicável
-            conta_pagar_id INTEGER, -- Link com conta a pagar se aplicável
-            conta_receber_id INTEGER, -- Link com conta a receber se aplicável
-            observacoes TEXT,
-            FOREIGN KEY (usuario_id) REFERENCES usuarios (id),
-            FOREIGN KEY (venda_id) REFERENCES vendas (id),
-            FOREIGN KEY (conta_pagar_id) REFERENCES contas_pagar (id),
-            FOREIGN KEY (conta_receber_id) REFERENCES contas_receber (id)
-        )
-    ''')
-    
-    # Tabela de abertura/fechamento de caixa
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS caixa_sessoes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            data_abertura TIMESTAMP NOT NULL,
-            data_fechamento TIMESTAMP,
-            saldo_inicial REAL NOT NULL DEFAULT 0,
-            saldo_final REAL,
-            total_entradas REAL DEFAULT 0,
-            total_saidas REAL DEFAULT 0,
-            usuario_abertura INTEGER NOT NULL,
-            usuario_fechamento INTEGER,
-            status TEXT DEFAULT 'aberto', -- 'aberto', 'fechado'
-            observacoes_abertura TEXT,
-            observacoes_fechamento TEXT,
-            FOREIGN KEY (usuario_abertura) REFERENCES usuarios (id),
-            FOREIGN KEY (usuario_fechamento) REFERENCES usuarios (id)
-        )
-    ''')
-    
-    # Tabela de lançamentos financeiros - adicionar colunas de referência
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS lancamentos_financeiros (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            tipo TEXT NOT NULL, -- 'receita', 'despesa'
-            categoria TEXT NOT NULL, -- 'combustivel', 'energia', 'telefone', 'aluguel', etc
-            descricao TEXT NOT NULL,
-            valor REAL NOT NULL,
-            data_lancamento DATE NOT NULL,
-            data_vencimento DATE,
-            data_pagamento DATE,
-            status TEXT DEFAULT 'pendente', -- 'pendente', 'pago', 'cancelado'
-            forma_pagamento TEXT,
-            numero_documento TEXT,
-            fornecedor_cliente TEXT,
-            usuario_id INTEGER NOT NULL,
-            observacoes TEXT,
-            conta_pagar_id INTEGER,
-            conta_receber_id INTEGER,
-            FOREIGN KEY (usuario_id) REFERENCES usuarios (id),
-            FOREIGN KEY (conta_pagar_id) REFERENCES contas_pagar (id),
-            FOREIGN KEY (conta_receber_id) REFERENCES contas_receber (id)
-        )
-    ''')
-    
-    # Tabela de fornecedores
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS fornecedores (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nome TEXT NOT NULL,
-            cnpj TEXT UNIQUE,
-            telefone TEXT,
-            email TEXT,
-            endereco TEXT,
-            cidade TEXT,
-            estado TEXT,
-            cep TEXT,
-            contato_pessoa TEXT,
-            observacoes TEXT,
-            ativo BOOLEAN DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Tabela de configurações da empresa
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS configuracoes_empresa (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nome_empresa TEXT NOT NULL DEFAULT 'FG AUTO PEÇAS',
-            cnpj TEXT,
-            endereco TEXT DEFAULT 'Rua Exemplo, 123 - Centro',
-            cidade TEXT,
-            estado TEXT,
-            cep TEXT,
-            telefone TEXT DEFAULT '(00) 0000-0000',
-            email TEXT DEFAULT 'contato@fgautopecas.com.br',
-            website TEXT,
-            logo_path TEXT DEFAULT 'logo.jpg',
-            observacoes TEXT,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Inserir configuração padrão se não existir
-    cursor.execute("SELECT COUNT(*) FROM configuracoes_empresa")
-    if cursor.fetchone()[0] == 0:
-        cursor.execute('''
-            INSERT INTO configuracoes_empresa (nome_empresa, endereco, telefone, email)
-            VALUES (?, ?, ?, ?)
-        ''', ('FG AUTO PEÇAS', 'Rua Exemplo, 123 - Centro', '(00) 0000-0000', 'contato@fgautopecas.com.br'))
-    
-    # Adicionar colunas para sincronização financeira se não existirem
-    try:
-        cursor.execute("ALTER TABLE contas_pagar ADD COLUMN fornecedor_id INTEGER")
-    except:
-        pass
-    try:
-        cursor.execute("ALTER TABLE contas_pagar ADD COLUMN lancamento_financeiro_id INTEGER")
-    except:
-        pass
+@contextmanager
+def conexao(timeout=30.0):
+    """Checkout de conexão do pool como context manager
+
+    Uso:
+        with conexao() as conn:
+            conn.execute(...)
+            conn.commit()
+    """
+    conn = get_db_connection(timeout)
     try:
-        cursor.execute("ALTER TABLE lancamentos_financeiros ADD COLUMN conta_pagar_id INTEGER")
-    except:
-        pass
+        yield conn
+    finally:
+        conn.close()
+
+def obter_estatisticas_pool():
+    """Retorna estatísticas de uso do pool de conexões"""
+    return _pool.estatisticas()
+
+# Datas/horas são gravadas no horário local ('YYYY-MM-DD HH:MM:SS'), o mesmo fuso de
+# date.today(); as colunas dia_venda/dia_movimentacao derivam o dia comercial delas
+def agora_local():
+    """Data e hora local no formato gravado no banco"""
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def hoje_local():
+    """Dia comercial atual (YYYY-MM-DD, horário local)"""
+    return date.today().isoformat()
+
+def init_db():
+    """Inicializa o banco de dados aplicando as migrações de esquema pendentes"""
+    conn = get_db_connection()
     try:
-        cursor.execute("ALTER TABLE lancamentos_financeiros ADD COLUMN conta_receber_id INTEGER")
-    except:
-        pass
-    
-    conn.commit()
-    conn.close()
+        aplicar_migracoes(conn)
+    finally:
+        conn.close()
+    gerar_fechamentos_pendentes()
 
 def criar_usuario_admin():
     """Cria um usuário administrador padrão se não existir"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute("SELECT COUNT(*) FROM usuarios WHERE username = 'admin'")
@@ -444,7 +229,7 @@ def criar_usuario_admin():
 
 def popular_dados_exemplo():
     """Popula o banco com dados de exemplo se estiver vazio"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     # Verificar se já existem produtos
@@ -551,6 +336,8 @@ def popular_dados_exemplo():
                 
                 # Atualizar total da venda
                 cursor.execute("UPDATE vendas SET total = ? WHERE id = ?", (total_venda, venda_id))
+            
+            _reconstruir_resumo_vendas(cursor)
         
         conn.commit()
         print("Dados de exemplo adicionados com sucesso!")
@@ -560,7 +347,7 @@ def popular_dados_exemplo():
 # FUNÇÕES DE USUÁRIOS
 def verificar_usuario(username, password):
     """Verifica se o usuário e senha estão corretos e se o usuário está ativo"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute("SELECT id, password_hash, ativo FROM usuarios WHERE username = ?", (username,))
@@ -577,8 +364,16 @@ def verificar_usuario(username, password):
     return None
 
 def buscar_usuario_por_id(user_id):
-    """Busca um usuário pelo ID"""
-    conn = sqlite3.connect(DB_PATH)
+    """Busca um usuário pelo ID (consultado a cada requisição, por isso em cache)"""
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    return _cache_usuarios.obter(user_id, lambda: _carregar_usuario_por_id(user_id))
+
+def _carregar_usuario_por_id(user_id):
+    """Lê um usuário do banco pelo ID"""
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -612,7 +407,7 @@ def buscar_usuario_por_id(user_id):
 
 def buscar_usuario_por_email(email):
     """Busca um usuário pelo email"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -643,7 +438,7 @@ def buscar_usuario_por_email(email):
 
 def atualizar_senha_usuario(user_id, nova_senha):
     """Atualiza a senha de um usuário"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     password_hash = generate_password_hash(nova_senha)
@@ -654,6 +449,7 @@ def atualizar_senha_usuario(user_id, nova_senha):
     conn.commit()
     success = cursor.rowcount > 0
     conn.close()
+    _cache_usuarios.invalidar([int(user_id)])
     
     return success
 
@@ -672,7 +468,7 @@ def criar_usuario(username, password, nome_completo, email, permissoes=None, cre
             'contas_receber': False
         }
     
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
@@ -718,46 +514,69 @@ def criar_usuario(username, password, nome_completo, email, permissoes=None, cre
     finally:
         conn.close()
 
+COLUNAS_USUARIO = '''id, username, nome_completo, email, ativo,
+               permissao_vendas, permissao_estoque, permissao_clientes,
+               permissao_financeiro, permissao_caixa, permissao_relatorios, permissao_admin,
+               permissao_contas_pagar, permissao_contas_receber, created_at'''
+
+def _usuario_de_linha(row):
+    """Converte uma linha com COLUNAS_USUARIO em dicionário"""
+    return {
+        'id': row[0],
+        'username': row[1],
+        'nome_completo': row[2] or '',
+        'email': row[3],
+        'ativo': row[4],
+        'permissao_vendas': row[5],
+        'permissao_estoque': row[6],
+        'permissao_clientes': row[7],
+        'permissao_financeiro': row[8],
+        'permissao_caixa': row[9],
+        'permissao_relatorios': row[10],
+        'permissao_admin': row[11],
+        'permissao_contas_pagar': row[12],
+        'permissao_contas_receber': row[13],
+        'created_at': row[14]
+    }
+
 def listar_usuarios():
     """Lista todos os usuários do sistema"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT id, username, nome_completo, email, ativo,
-               permissao_vendas, permissao_estoque, permissao_clientes,
-               permissao_financeiro, permissao_caixa, permissao_relatorios, permissao_admin,
-               permissao_contas_pagar, permissao_contas_receber, created_at
+    cursor.execute(f'''
+        SELECT {COLUNAS_USUARIO}
         FROM usuarios
         ORDER BY nome_completo
     ''')
-    
-    usuarios = []
-    for row in cursor.fetchall():
-        usuarios.append({
-            'id': row[0],
-            'username': row[1],
-            'nome_completo': row[2] or '',
-            'email': row[3],
-            'ativo': row[4],
-            'permissao_vendas': row[5],
-            'permissao_estoque': row[6],
-            'permissao_clientes': row[7],
-            'permissao_financeiro': row[8],
-            'permissao_caixa': row[9],
-            'permissao_relatorios': row[10],
-            'permissao_admin': row[11],
-            'permissao_contas_pagar': row[12] if len(row) > 12 else False,
-            'permissao_contas_receber': row[13] if len(row) > 13 else False,
-            'created_at': row[14] if len(row) > 14 else row[12]
-        })
+    usuarios = [_usuario_de_linha(row) for row in cursor.fetchall()]
     
     conn.close()
     return usuarios
 
+def _padrao_prefixo_like(termo):
+    """Padrão LIKE 'termo%' com os curingas do próprio termo escapados (ESCAPE '\\')"""
+    return termo.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+def buscar_usuarios(termo, limite=10):
+    """Usuários ativos cujo nome completo ou login começa pelo termo (seletor de vendedor)"""
+    termo = (termo or '').strip()
+    padrao = _padrao_prefixo_like(termo)
+    with conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT {COLUNAS_USUARIO}
+            FROM usuarios
+            WHERE ativo = 1
+            AND (nome_completo LIKE ? ESCAPE '\\' OR username LIKE ? ESCAPE '\\')
+            ORDER BY COALESCE(nome_completo, username)
+            LIMIT ?
+        ''', (padrao, padrao, limite))
+        return [_usuario_de_linha(row) for row in cursor.fetchall()]
+
 def editar_usuario(user_id, nome_completo=None, email=None, permissoes=None, ativo=None):
     """Edita um usuário existente"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
@@ -794,6 +613,7 @@ def editar_usuario(user_id, nome_completo=None, email=None, permissoes=None, ati
         
         cursor.execute(query, params)
         conn.commit()
+        _cache_usuarios.invalidar([int(user_id)])
         
         if cursor.rowcount > 0:
             return True, "Usuário atualizado com sucesso"
@@ -807,12 +627,13 @@ def editar_usuario(user_id, nome_completo=None, email=None, permissoes=None, ati
 
 def deletar_usuario(user_id):
     """Deleta um usuário (marca como inativo)"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
         cursor.execute("UPDATE usuarios SET ativo = 0 WHERE id = ?", (user_id,))
         conn.commit()
+        _cache_usuarios.invalidar([int(user_id)])
         
         if cursor.rowcount > 0:
             return True, "Usuário desativado com sucesso"
@@ -826,39 +647,277 @@ def deletar_usuario(user_id):
 
 def verificar_permissao(user_id, permissao):
     """Verifica se um usuário tem uma permissão específica"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute(f"SELECT permissao_{permissao}, permissao_admin FROM usuarios WHERE id = ? AND ativo = 1", (user_id,))
-    result = cursor.fetchone()
-    conn.close()
+    usuario = buscar_usuario_por_id(user_id)
     
-    if result:
+    if usuario and usuario['ativo']:
         # Admin tem todas as permissões
-        return result[1] or result[0]
+        return usuario['permissao_admin'] or usuario.get(f'permissao_{permissao}', False)
     return False
 
+# EVENTOS EM TEMPO REAL (SSE)
+# As escritas de venda/caixa gravam um evento em eventos_tempo_real na própria transação;
+# uma única thread por processo lê os eventos novos e repassa a todos os navegadores conectados
+EVENTOS_INTERVALO_LEITURA = 1.0
+EVENTOS_POR_LEITURA = 200
+EVENTOS_FILA_MAXIMA = 500
+
+def _publicar_evento(cursor, tipo, dados):
+    """Grava um evento em tempo real na transação corrente (só é entregue se a transação for confirmada)"""
+    cursor.execute(
+        "INSERT INTO eventos_tempo_real (tipo, dados, criado_em) VALUES (?, ?, ?)",
+        (tipo, json.dumps(dados, ensure_ascii=False, default=str), agora_local())
+    )
+
+class CentralEventos:
+    """Distribui os eventos gravados no banco às conexões SSE do processo com uma só leitura por intervalo"""
+
+    def __init__(self, intervalo=EVENTOS_INTERVALO_LEITURA):
+        self._lock = threading.Lock()
+        self._intervalo = intervalo
+        self._assinantes = set()
+        self._thread = None
+        self._pid = None
+        self._ultima_seq = 0
+        self._stats = {'leituras': 0, 'eventos': 0, 'descartados': 0}
+
+    def _ler(self, conn, depois_de, limite=EVENTOS_POR_LEITURA):
+        linhas = conn.execute('''
+            SELECT seq, tipo, dados FROM eventos_tempo_real
+            WHERE seq > ? ORDER BY seq LIMIT ?
+        ''', (depois_de, limite)).fetchall()
+        return [(seq, tipo, json.loads(dados)) for seq, tipo, dados in linhas]
+
+    def assinar(self, ultimo_id=None):
+        """Registra uma fila de eventos; retorna (fila, eventos perdidos desde ultimo_id)"""
+        fila = queue.Queue(maxsize=EVENTOS_FILA_MAXIMA)
+        with conexao() as conn:
+            if ultimo_id is None:
+                pendentes = []
+            else:
+                # Reconexão (Last-Event-ID): reenvia o que foi gravado enquanto o navegador estava fora
+                pendentes = self._ler(conn, ultimo_id)
+            with self._lock:
+                if self._pid != os.getpid() or self._thread is None or not self._thread.is_alive():
+                    self._ultima_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM eventos_tempo_real").fetchone()[0]
+                    self._pid = os.getpid()
+                    self._assinantes = set()
+                    self._thread = threading.Thread(target=self._executar, name='central-eventos', daemon=True)
+                    self._thread.start()
+                self._assinantes.add(fila)
+        return fila, pendentes
+
+    def cancelar(self, fila):
+        with self._lock:
+            self._assinantes.discard(fila)
+
+    def _executar(self):
+        """Lê os eventos novos enquanto houver assinantes; encerra quando o último sai"""
+        while True:
+            time.sleep(self._intervalo)
+            with self._lock:
+                if not self._assinantes:
+                    self._thread = None
+                    return
+                ultima_seq = self._ultima_seq
+            try:
+                with conexao() as conn:
+                    eventos = self._ler(conn, ultima_seq)
+            except Exception as e:
+                print(f"Erro ao ler eventos em tempo real: {e}")
+                continue
+
+            with self._lock:
+                self._stats['leituras'] += 1
+                if not eventos:
+                    continue
+                self._ultima_seq = eventos[-1][0]
+                self._stats['eventos'] += len(eventos)
+                for fila in list(self._assinantes):
+                    for evento in eventos:
+                        try:
+                            fila.put_nowait(evento)
+                        except queue.Full:
+                            # Navegador parado: desliga a conexão (o EventSource reconecta com Last-Event-ID)
+                            self._assinantes.discard(fila)
+                            self._encerrar(fila)
+                            self._stats['descartados'] += 1
+                            break
+
+    @staticmethod
+    def _encerrar(fila):
+        """Esvazia a fila e deixa só o sinal de fim (None) para a conexão SSE"""
+        try:
+            while True:
+                fila.get_nowait()
+        except queue.Empty:
+            pass
+        fila.put_nowait(None)
+
+    def estatisticas(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['assinantes'] = len(self._assinantes)
+            stats['ultima_seq'] = self._ultima_seq
+            return stats
+
+_central_eventos = CentralEventos()
+
+def acompanhar_eventos(ultimo_id=None, duracao=300, intervalo_pulso=15):
+    """Gerador de eventos (seq, tipo, dados) para uma conexão SSE; None sinaliza um pulso de keep-alive
+
+    Termina após `duracao` segundos para não prender um worker indefinidamente;
+    o navegador reconecta sozinho informando o último ID recebido.
+    """
+    fila, pendentes = _central_eventos.assinar(ultimo_id)
+    ultima_enviada = ultimo_id or 0
+    try:
+        for evento in pendentes:
+            ultima_enviada = evento[0]
+            yield evento
+        fim = time.monotonic() + duracao
+        while time.monotonic() < fim:
+            try:
+                evento = fila.get(timeout=min(intervalo_pulso, max(fim - time.monotonic(), 0.1)))
+            except queue.Empty:
+                yield None
+                continue
+            if evento is None:
+                return
+            # A leitura da reconexão e a thread central podem entregar o mesmo evento
+            if evento[0] <= ultima_enviada:
+                continue
+            ultima_enviada = evento[0]
+            yield evento
+    finally:
+        _central_eventos.cancelar(fila)
+
+def obter_estatisticas_eventos():
+    """Estatísticas da central de eventos em tempo real deste processo"""
+    return _central_eventos.estatisticas()
+
+# Cada terminal (PDV) tem no máximo uma sessão de caixa aberta; sem terminal informado, usa-se o padrão
+TERMINAL_PADRAO = 'principal'
+
+def _normalizar_terminal(terminal):
+    """Nome do terminal sem espaços nas pontas; vazio vira o terminal padrão"""
+    terminal = (terminal or '').strip()
+    return terminal[:40] if terminal else TERMINAL_PADRAO
+
+_COLUNAS_RESUMO_CAIXA = '''
+    id, saldo_inicial, saldo_atual, total_entradas, total_saidas, total_movimentacoes,
+    data_abertura, usuario_abertura, observacoes_abertura, terminal
+'''
+
+def _linha_resumo_caixa(sessao):
+    """Converte a linha de caixa_sessoes lida com _COLUNAS_RESUMO_CAIXA em dicionário"""
+    return {
+        'caixa_id': sessao[0],
+        'saldo_inicial': sessao[1],
+        'saldo_atual': sessao[2],
+        'total_entradas': sessao[3],
+        'total_saidas': sessao[4],
+        'total_movimentacoes': sessao[5],
+        'data_abertura': sessao[6],
+        'usuario_abertura': sessao[7],
+        'observacoes': sessao[8],
+        'terminal': sessao[9]
+    }
+
+def _resumo_caixa_aberto(cursor, terminal=TERMINAL_PADRAO):
+    """Saldo e totais da sessão aberta do terminal (None se o caixa dele estiver fechado) - leitura de uma linha"""
+    cursor.execute(f'''
+        SELECT {_COLUNAS_RESUMO_CAIXA}
+        FROM caixa_sessoes
+        WHERE status = 'aberto' AND terminal = ?
+    ''', (_normalizar_terminal(terminal),))
+    sessao = cursor.fetchone()
+    return _linha_resumo_caixa(sessao) if sessao else None
+
+def _resumo_sessao_caixa(cursor, sessao_id):
+    """Saldo e totais de uma sessão de caixa pelo id"""
+    cursor.execute(f'SELECT {_COLUNAS_RESUMO_CAIXA} FROM caixa_sessoes WHERE id = ?', (sessao_id,))
+    sessao = cursor.fetchone()
+    return _linha_resumo_caixa(sessao) if sessao else None
+
+def _publicar_movimentacoes_caixa(cursor, movimentacoes):
+    """Publica as movimentações (tuplas tipo, categoria, descricao, valor, data, ..., sessao_id) com o saldo da sessão de cada uma"""
+    resumos = {}
+    for movimentacao in movimentacoes:
+        tipo, categoria, descricao, valor, data_movimentacao = movimentacao[:5]
+        sessao_id = movimentacao[-1]
+        if sessao_id not in resumos:
+            resumos[sessao_id] = _resumo_sessao_caixa(cursor, sessao_id)
+        resumo = resumos[sessao_id]
+        _publicar_evento(cursor, 'caixa', {
+            'acao': 'movimentacao',
+            'terminal': resumo['terminal'] if resumo else None,
+            'tipo': tipo,
+            'categoria': categoria,
+            'descricao': descricao,
+            'valor': valor,
+            'data_movimentacao': data_movimentacao,
+            'resumo': resumo
+        })
+
+def obter_resumo_caixas():
+    """Visão consolidada dos caixas abertos: uma linha por terminal e os totais somados"""
+    with conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT {_COLUNAS_RESUMO_CAIXA}
+            FROM caixa_sessoes
+            WHERE status = 'aberto'
+            ORDER BY terminal
+        ''')
+        caixas = [_linha_resumo_caixa(linha) for linha in cursor.fetchall()]
+    return {
+        'caixas': caixas,
+        'quantidade': len(caixas),
+        'saldo_atual': sum(c['saldo_atual'] or 0 for c in caixas),
+        'total_entradas': sum(c['total_entradas'] or 0 for c in caixas),
+        'total_saidas': sum(c['total_saidas'] or 0 for c in caixas),
+        'total_movimentacoes': sum(c['total_movimentacoes'] or 0 for c in caixas)
+    }
+
 # FUNÇÕES DE CAIXA
-def abrir_caixa(usuario_id, saldo_inicial=0, observacoes=""):
-    """Abre uma nova sessão de caixa"""
-    conn = sqlite3.connect(DB_PATH)
+def abrir_caixa(usuario_id, saldo_inicial=0, observacoes="", terminal=TERMINAL_PADRAO):
+    """Abre uma nova sessão de caixa no terminal"""
+    terminal = _normalizar_terminal(terminal)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
-        # Verificar se já existe caixa aberto
-        cursor.execute("SELECT COUNT(*) FROM caixa_sessoes WHERE status = 'aberto'")
-        if cursor.fetchone()[0] > 0:
-            return False, "Já existe um caixa aberto. Feche o caixa atual antes de abrir um novo."
+        # Verificar se já existe caixa aberto neste terminal (outros terminais podem estar abertos)
+        cursor.execute("SELECT 1 FROM caixa_sessoes WHERE status = 'aberto' AND terminal = ?", (terminal,))
+        if cursor.fetchone():
+            return False, f"Já existe um caixa aberto no terminal {terminal}. Feche-o antes de abrir um novo."
         
-        cursor.execute('''
-            INSERT INTO caixa_sessoes (
-                data_abertura, saldo_inicial, usuario_abertura, observacoes_abertura
-            )
-            VALUES (?, ?, ?, ?)
-        ''', (datetime.now(), saldo_inicial, usuario_id, observacoes))
+        # O índice único parcial (terminal, status aberto) barra duas aberturas simultâneas no mesmo terminal
+        try:
+            cursor.execute('''
+                INSERT INTO caixa_sessoes (
+                    data_abertura, saldo_inicial, usuario_abertura, observacoes_abertura,
+                    total_entradas, total_saidas, total_movimentacoes, saldo_atual, terminal
+                )
+                VALUES (?, ?, ?, ?, 0, 0, 0, ?, ?)
+            ''', (agora_local(), saldo_inicial, usuario_id, observacoes, saldo_inicial, terminal))
+        except sqlite3.IntegrityError:
+            return False, f"Já existe um caixa aberto no terminal {terminal}. Feche-o antes de abrir um novo."
         
         sessao_id = cursor.lastrowid
+        _publicar_evento(cursor, 'caixa', {
+            'acao': 'aberto',
+            'terminal': terminal,
+            'caixa_id': sessao_id,
+            'saldo_inicial': saldo_inicial
+        })
         conn.commit()
+        
+        # Vendas feitas com o caixa fechado entram assim que ele abre
+        try:
+            processar_eventos_caixa()
+        except Exception as e:
+            print(f"Aviso: Não foi possível lançar as vendas pendentes no caixa: {e}")
         return True, f"Caixa aberto com sucesso. Sessão: {sessao_id}"
         
     except Exception as e:
@@ -866,36 +925,26 @@ def abrir_caixa(usuario_id, saldo_inicial=0, observacoes=""):
     finally:
         conn.close()
 
-def fechar_caixa(usuario_id, observacoes=""):
-    """Fecha a sessão de caixa atual"""
-    conn = sqlite3.connect(DB_PATH)
+def fechar_caixa(usuario_id, observacoes="", terminal=TERMINAL_PADRAO):
+    """Fecha a sessão de caixa aberta do terminal"""
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
-        # Buscar caixa aberto
-        cursor.execute("SELECT id, saldo_inicial FROM caixa_sessoes WHERE status = 'aberto'")
-        caixa = cursor.fetchone()
+        # Lock de escrita antes de ler os totais: nenhuma movimentação entra entre a leitura e o retrato
+        cursor.execute("BEGIN IMMEDIATE")
         
-        if not caixa:
-            return False, "Não há caixa aberto para fechar."
-        
-        caixa_id, saldo_inicial = caixa
+        # Buscar caixa aberto (os totais já estão acumulados na sessão)
+        caixa = _resumo_caixa_aberto(cursor, terminal)
         
-        # Calcular totais de entradas e saídas
-        cursor.execute('''
-            SELECT 
-                COALESCE(SUM(CASE WHEN tipo = 'entrada' THEN valor ELSE 0 END), 0) as total_entradas,
-                COALESCE(SUM(CASE WHEN tipo = 'saida' THEN valor ELSE 0 END), 0) as total_saidas
-            FROM caixa_movimentacoes 
-            WHERE data_movimentacao >= (
-                SELECT data_abertura FROM caixa_sessoes WHERE id = ?
-            )
-        ''', (caixa_id,))
+        if not caixa:
+            conn.rollback()
+            return False, "Não há caixa aberto para fechar neste terminal."
         
-        totais = cursor.fetchone()
-        total_entradas = totais[0] if totais else 0
-        total_saidas = totais[1] if totais else 0
-        saldo_final = saldo_inicial + total_entradas - total_saidas
+        caixa_id = caixa['caixa_id']
+        total_entradas = caixa['total_entradas']
+        total_saidas = caixa['total_saidas']
+        saldo_final = caixa['saldo_atual']
         
         # Fechar caixa
         cursor.execute('''
@@ -908,7 +957,16 @@ def fechar_caixa(usuario_id, observacoes=""):
                 observacoes_fechamento = ?,
                 status = 'fechado'
             WHERE id = ?
-        ''', (datetime.now(), saldo_final, total_entradas, total_saidas, usuario_id, observacoes, caixa_id))
+        ''', (agora_local(), saldo_final, total_entradas, total_saidas, usuario_id, observacoes, caixa_id))
+        _gravar_fechamento_caixa(cursor, caixa_id)
+        _publicar_evento(cursor, 'caixa', {
+            'acao': 'fechado',
+            'terminal': caixa['terminal'],
+            'caixa_id': caixa_id,
+            'saldo_final': saldo_final,
+            'total_entradas': total_entradas,
+            'total_saidas': total_saidas
+        })
         
         conn.commit()
         return True, f"Caixa fechado com sucesso. Saldo final: R$ {saldo_final:,.2f}"
@@ -918,24 +976,32 @@ def fechar_caixa(usuario_id, observacoes=""):
     finally:
         conn.close()
 
-def registrar_movimentacao_caixa(tipo, categoria, descricao, valor, usuario_id, venda_id=None, conta_pagar_id=None, conta_receber_id=None, observacoes=""):
-    """Registra uma movimentação no caixa"""
-    conn = sqlite3.connect(DB_PATH)
+def registrar_movimentacao_caixa(tipo, categoria, descricao, valor, usuario_id, venda_id=None, conta_pagar_id=None, conta_receber_id=None, observacoes="", terminal=TERMINAL_PADRAO):
+    """Registra uma movimentação no caixa do terminal"""
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
-        # Verificar se há caixa aberto
-        cursor.execute("SELECT COUNT(*) FROM caixa_sessoes WHERE status = 'aberto'")
-        if cursor.fetchone()[0] == 0:
+        # Lock de escrita antes de ler a sessão: um fechamento não se intercala entre a leitura e o INSERT
+        cursor.execute("BEGIN IMMEDIATE")
+        
+        # Verificar se há caixa aberto neste terminal
+        cursor.execute("SELECT id FROM caixa_sessoes WHERE status = 'aberto' AND terminal = ?", (_normalizar_terminal(terminal),))
+        sessao = cursor.fetchone()
+        if not sessao:
+            conn.rollback()
             return False, "Não há caixa aberto. Abra o caixa antes de registrar movimentações."
         
+        # Os totais da sessão são atualizados pelo trigger do INSERT, no mesmo comando
+        data_movimentacao = agora_local()
         cursor.execute('''
             INSERT INTO caixa_movimentacoes (
-                tipo, categoria, descricao, valor, usuario_id, 
-                venda_id, conta_pagar_id, conta_receber_id, observacoes
+                tipo, categoria, descricao, valor, data_movimentacao, usuario_id, 
+                venda_id, conta_pagar_id, conta_receber_id, observacoes, sessao_id
             )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (tipo, categoria, descricao, valor, usuario_id, venda_id, conta_pagar_id, conta_receber_id, observacoes))
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (tipo, categoria, descricao, valor, data_movimentacao, usuario_id, venda_id, conta_pagar_id, conta_receber_id, observacoes, sessao[0]))
+        _publicar_movimentacoes_caixa(cursor, [(tipo, categoria, descricao, valor, data_movimentacao, sessao[0])])
         
         conn.commit()
         return True, "Movimentação registrada com sucesso"
@@ -945,85 +1011,45 @@ def registrar_movimentacao_caixa(tipo, categoria, descricao, valor, usuario_id,
     finally:
         conn.close()
 
-def obter_status_caixa():
-    """Obtém o status atual do caixa"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT id, data_abertura, saldo_inicial, usuario_abertura, observacoes_abertura
-        FROM caixa_sessoes 
-        WHERE status = 'aberto'
-        ORDER BY data_abertura DESC
-        LIMIT 1
-    ''')
-    
-    caixa_aberto = cursor.fetchone()
-    
-    if not caixa_aberto:
-        conn.close()
-        return None
-    
-    caixa_id, data_abertura, saldo_inicial, usuario_abertura, observacoes = caixa_aberto
-    
-    # Buscar nome do usuário
-    cursor.execute("SELECT nome_completo, username FROM usuarios WHERE id = ?", (usuario_abertura,))
-    usuario = cursor.fetchone()
-    nome_usuario = usuario[0] if usuario and usuario[0] else usuario[1] if usuario else "Usuário desconhecido"
-    
-    # Calcular movimentações do dia
-    cursor.execute('''
-        SELECT 
-            COALESCE(SUM(CASE WHEN tipo = 'entrada' THEN valor ELSE 0 END), 0) as total_entradas,
-            COALESCE(SUM(CASE WHEN tipo = 'saida' THEN valor ELSE 0 END), 0) as total_saidas,
-            COUNT(*) as total_movimentacoes
-        FROM caixa_movimentacoes 
-        WHERE data_movimentacao >= ?
-    ''', (data_abertura,))
-    
-    movimentacoes = cursor.fetchone()
-    total_entradas = movimentacoes[0] if movimentacoes else 0
-    total_saidas = movimentacoes[1] if movimentacoes else 0
-    total_movimentacoes = movimentacoes[2] if movimentacoes else 0
-    saldo_atual = saldo_inicial + total_entradas - total_saidas
-    
-    conn.close()
+def obter_status_caixa(terminal=TERMINAL_PADRAO):
+    """Obtém o status atual do caixa do terminal (totais correntes mantidos na própria sessão)"""
+    with conexao() as conn:
+        cursor = conn.cursor()
+        status = _resumo_caixa_aberto(cursor, terminal)
+        if not status:
+            return None
+        
+        # Buscar nome do usuário
+        cursor.execute("SELECT nome_completo, username FROM usuarios WHERE id = ?", (status['usuario_abertura'],))
+        usuario = cursor.fetchone()
     
-    return {
-        'caixa_id': caixa_id,
-        'data_abertura': data_abertura,
-        'saldo_inicial': saldo_inicial,
-        'saldo_atual': saldo_atual,
-        'total_entradas': total_entradas,
-        'total_saidas': total_saidas,
-        'total_movimentacoes': total_movimentacoes,
-        'usuario_abertura': nome_usuario,
-        'observacoes': observacoes
-    }
+    status['usuario_abertura'] = usuario[0] if usuario and usuario[0] else usuario[1] if usuario else "Usuário desconhecido"
+    return status
 
-def listar_movimentacoes_caixa(limit=50):
-    """Lista as movimentações do caixa atual"""
-    conn = sqlite3.connect(DB_PATH)
+def listar_movimentacoes_caixa(limit=50, terminal=TERMINAL_PADRAO):
+    """Lista as movimentações do caixa aberto do terminal"""
+    conn = get_db_connection()
     cursor = conn.cursor()
     
-    # Buscar data de abertura do caixa atual
-    cursor.execute("SELECT data_abertura FROM caixa_sessoes WHERE status = 'aberto' ORDER BY data_abertura DESC LIMIT 1")
+    # Buscar o caixa atual do terminal
+    cursor.execute("SELECT id FROM caixa_sessoes WHERE status = 'aberto' AND terminal = ?", (_normalizar_terminal(terminal),))
     caixa_aberto = cursor.fetchone()
     
     if not caixa_aberto:
         conn.close()
         return []
     
-    data_abertura = caixa_aberto[0]
-    
+    # Movimentações da sessão pelo índice de sessao_id (id crescente acompanha a data)
     cursor.execute('''
-        SELECT cm.*, u.nome_completo, u.username
+        SELECT cm.id, cm.tipo, cm.categoria, cm.descricao, cm.valor, cm.data_movimentacao,
+               cm.usuario_id, cm.venda_id, cm.conta_pagar_id, cm.conta_receber_id, cm.observacoes,
+               u.nome_completo, u.username
         FROM caixa_movimentacoes cm
         JOIN usuarios u ON cm.usuario_id = u.id
-        WHERE cm.data_movimentacao >= ?
-        ORDER BY cm.data_movimentacao DESC
+        WHERE cm.sessao_id = ?
+        ORDER BY cm.id DESC
         LIMIT ?
-    ''', (data_abertura, limit))
+    ''', (caixa_aberto[0], limit))
     
     movimentacoes = []
     for row in cursor.fetchall():
@@ -1045,9 +1071,222 @@ def listar_movimentacoes_caixa(limit=50):
     conn.close()
     return movimentacoes
 
+# FECHAMENTOS DE CAIXA (retratos imutáveis das sessões fechadas)
+# Ordem dos campos de cada movimentação serializada em caixa_fechamentos.movimentacoes
+CAMPOS_MOVIMENTACAO_FECHAMENTO = (
+    'id', 'tipo', 'categoria', 'descricao', 'valor', 'data_movimentacao', 'usuario_id', 'venda_id', 'forma_pagamento'
+)
+
+def _somar_total_fechamento(totais, chave, tipo, valor):
+    """Acumula entradas/saídas/quantidade de uma movimentação no grupo informado"""
+    total = totais.setdefault(chave, {'entradas': 0.0, 'saidas': 0.0, 'quantidade': 0})
+    total['entradas' if tipo == 'entrada' else 'saidas'] += valor or 0
+    total['quantidade'] += 1
+
+def _gravar_fechamento_caixa(cursor, sessao_id):
+    """Grava o retrato da sessão fechada: totais por categoria, forma de pagamento e usuário e as movimentações compactadas"""
+    cursor.execute('''
+        SELECT terminal, data_abertura, COALESCE(data_fechamento, data_abertura),
+               usuario_abertura, usuario_fechamento, saldo_inicial
+        FROM caixa_sessoes WHERE id = ? AND status = 'fechado'
+    ''', (sessao_id,))
+    sessao = cursor.fetchone()
+    if not sessao:
+        return False
+
+    cursor.execute('''
+        SELECT cm.id, cm.tipo, cm.categoria, cm.descricao, cm.valor, cm.data_movimentacao, cm.usuario_id,
+               cm.venda_id, v.forma_pagamento, COALESCE(u.nome_completo, u.username)
+        FROM caixa_movimentacoes cm
+        LEFT JOIN vendas v ON v.id = cm.venda_id
+        LEFT JOIN usuarios u ON u.id = cm.usuario_id
+        WHERE cm.sessao_id = ?
+        ORDER BY cm.id
+    ''', (sessao_id,))
+
+    por_categoria, por_forma, por_usuario = {}, {}, {}
+    movimentacoes = []
+    entradas = saidas = 0.0
+    for row in cursor.fetchall():
+        tipo, categoria, valor, forma_pagamento = row[1], row[2], row[4] or 0, row[8] or 'sem venda'
+        if tipo == 'entrada':
+            entradas += valor
+        else:
+            saidas += valor
+        _somar_total_fechamento(por_categoria, categoria or 'sem categoria', tipo, valor)
+        _somar_total_fechamento(por_forma, forma_pagamento, tipo, valor)
+        _somar_total_fechamento(por_usuario, row[9] or f'Usuário {row[6]}', tipo, valor)
+        movimentacoes.append(row[:9])
+
+    def compacto(dados):
+        return json.dumps(dados, ensure_ascii=False, separators=(',', ':'))
+
+    # ON CONFLICT DO NOTHING: o retrato de uma sessão é gravado uma única vez
+    cursor.execute('''
+        INSERT INTO caixa_fechamentos (
+            sessao_id, terminal, data_abertura, data_fechamento, usuario_abertura, usuario_fechamento,
+            saldo_inicial, saldo_final, total_entradas, total_saidas, total_movimentacoes,
+            totais_categoria, totais_forma_pagamento, totais_usuario, movimentacoes, gerado_em
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (sessao_id) DO NOTHING
+    ''', (sessao_id, sessao[0], sessao[1], sessao[2], sessao[3], sessao[4],
+          sessao[5], sessao[5] + entradas - saidas, entradas, saidas, len(movimentacoes),
+          compacto(por_categoria), compacto(por_forma), compacto(por_usuario), compacto(movimentacoes),
+          agora_local()))
+    return True
+
+def gerar_fechamentos_pendentes():
+    """Gera os retratos das sessões fechadas que ainda não têm um (bancos anteriores aos fechamentos)"""
+    with conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT s.id FROM caixa_sessoes s
+            WHERE s.status = 'fechado'
+            AND NOT EXISTS (SELECT 1 FROM caixa_fechamentos f WHERE f.sessao_id = s.id)
+        ''')
+        pendentes = [row[0] for row in cursor.fetchall()]
+        if not pendentes:
+            return 0
+
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            for sessao_id in pendentes:
+                _gravar_fechamento_caixa(cursor, sessao_id)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return len(pendentes)
+
+_COLUNAS_FECHAMENTO = '''
+    sessao_id, terminal, data_abertura, data_fechamento, usuario_abertura, usuario_fechamento,
+    saldo_inicial, saldo_final, total_entradas, total_saidas, total_movimentacoes
+'''
+
+def _linha_fechamento_caixa(row):
+    """Converte a linha de caixa_fechamentos lida com _COLUNAS_FECHAMENTO em dicionário"""
+    return {
+        'sessao_id': row[0],
+        'terminal': row[1],
+        'data_abertura': row[2],
+        'data_fechamento': row[3],
+        'usuario_abertura': row[4],
+        'usuario_fechamento': row[5],
+        'saldo_inicial': row[6],
+        'saldo_final': row[7],
+        'total_entradas': row[8],
+        'total_saidas': row[9],
+        'total_movimentacoes': row[10]
+    }
+
+def obter_fechamento_caixa(sessao_id):
+    """Relatório completo de uma sessão fechada, lido do seu retrato (sem varrer caixa_movimentacoes)"""
+    with conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT {_COLUNAS_FECHAMENTO}, totais_categoria, totais_forma_pagamento, totais_usuario, movimentacoes
+            FROM caixa_fechamentos WHERE sessao_id = ?
+        ''', (sessao_id,))
+        row = cursor.fetchone()
+
+    if not row:
+        return None
+    fechamento = _linha_fechamento_caixa(row)
+    fechamento['por_categoria'] = json.loads(row[11])
+    fechamento['por_forma_pagamento'] = json.loads(row[12])
+    fechamento['por_usuario'] = json.loads(row[13])
+    fechamento['movimentacoes'] = [dict(zip(CAMPOS_MOVIMENTACAO_FECHAMENTO, mov)) for mov in json.loads(row[14])]
+    return fechamento
+
+def listar_fechamentos_caixa(data_inicio=None, data_fim=None, terminal=None, limit=100):
+    """Lista as sessões fechadas no período (apenas os totais, sem desserializar as movimentações)"""
+    filtros = []
+    params = []
+    if data_inicio:
+        filtros.append('dia_fechamento >= ?')
+        params.append(data_inicio)
+    if data_fim:
+        filtros.append('dia_fechamento <= ?')
+        params.append(data_fim)
+    if terminal:
+        filtros.append('terminal = ?')
+        params.append(terminal)
+    where = f"WHERE {' AND '.join(filtros)}" if filtros else ''
+
+    with conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT {_COLUNAS_FECHAMENTO}
+            FROM caixa_fechamentos {where}
+            ORDER BY data_fechamento DESC
+            LIMIT ?
+        ''', params + [limit])
+        return [_linha_fechamento_caixa(row) for row in cursor.fetchall()]
+
+def obter_conciliacao_caixa_mes(ano, mes):
+    """Conciliação mensal do caixa a partir dos retratos: uma linha por sessão, totais agrupados e divergências"""
+    inicio = date(ano, mes, 1)
+    fim = (inicio + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    periodo = (inicio.isoformat(), fim.isoformat())
+
+    with conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT {_COLUNAS_FECHAMENTO}
+            FROM caixa_fechamentos
+            WHERE dia_fechamento BETWEEN ? AND ?
+            ORDER BY data_fechamento
+        ''', periodo)
+        sessoes = [_linha_fechamento_caixa(row) for row in cursor.fetchall()]
+
+        # Soma os grupos já totalizados em cada retrato (json_each lê só a linha da sessão)
+        agrupados = {}
+        for coluna, chave in (('totais_categoria', 'por_categoria'),
+                              ('totais_forma_pagamento', 'por_forma_pagamento'),
+                              ('totais_usuario', 'por_usuario')):
+            cursor.execute(f'''
+                SELECT g.key,
+                       SUM(json_extract(g.value, '$.entradas')),
+                       SUM(json_extract(g.value, '$.saidas')),
+                       SUM(json_extract(g.value, '$.quantidade'))
+                FROM caixa_fechamentos f, json_each(f.{coluna}) g
+                WHERE f.dia_fechamento BETWEEN ? AND ?
+                GROUP BY g.key
+                ORDER BY g.key
+            ''', periodo)
+            agrupados[chave] = {
+                row[0]: {'entradas': row[1], 'saidas': row[2], 'quantidade': row[3]}
+                for row in cursor.fetchall()
+            }
+
+        # Saldo gravado na sessão x saldo do retrato (leitura pela chave de cada sessão)
+        cursor.execute('''
+            SELECT f.sessao_id, f.terminal, s.saldo_final, f.saldo_final
+            FROM caixa_fechamentos f
+            JOIN caixa_sessoes s ON s.id = f.sessao_id
+            WHERE f.dia_fechamento BETWEEN ? AND ?
+            AND abs(COALESCE(s.saldo_final, 0) - f.saldo_final) > 0.005
+        ''', periodo)
+        divergencias = [
+            {'sessao_id': row[0], 'terminal': row[1], 'saldo_sessao': row[2], 'saldo_movimentacoes': row[3]}
+            for row in cursor.fetchall()
+        ]
+
+    return {
+        'periodo': {'inicio': periodo[0], 'fim': periodo[1]},
+        'sessoes': sessoes,
+        'quantidade_sessoes': len(sessoes),
+        'total_entradas': sum(s['total_entradas'] for s in sessoes),
+        'total_saidas': sum(s['total_saidas'] for s in sessoes),
+        'total_movimentacoes': sum(s['total_movimentacoes'] for s in sessoes),
+        **agrupados,
+        'divergencias': divergencias
+    }
+
 def criar_lancamento_financeiro(tipo, categoria, descricao, valor, data_lancamento, usuario_id, data_vencimento=None, fornecedor_cliente="", numero_documento="", observacoes="", auto_criar_conta=True):
     """Cria um lançamento financeiro (receita ou despesa) e automaticamente cria a conta correspondente"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
@@ -1144,7 +1383,7 @@ def criar_lancamento_financeiro(tipo, categoria, descricao, valor, data_lancamen
 
 def listar_lancamentos_financeiros(tipo=None, status='pendente'):
     """Lista lançamentos financeiros"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     query = '''
@@ -1198,34 +1437,63 @@ def listar_lancamentos_financeiros(tipo=None, status='pendente'):
     return lancamentos
 
 # FUNÇÕES DE CLIENTES
+COLUNAS_CLIENTE = 'id, nome, telefone, email, cpf_cnpj, endereco'
+
+def _cliente_de_linha(row):
+    """Converte uma linha com COLUNAS_CLIENTE em dicionário"""
+    return {
+        'id': row[0],
+        'nome': row[1],
+        'telefone': row[2],
+        'email': row[3],
+        'cpf_cnpj': row[4],
+        'endereco': row[5]
+    }
+
 def listar_clientes():
     """Lista todos os clientes"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT id, nome, telefone, email, cpf_cnpj, endereco
+    cursor.execute(f'''
+        SELECT {COLUNAS_CLIENTE}
         FROM clientes
         ORDER BY nome
     ''')
-    
-    clientes = []
-    for row in cursor.fetchall():
-        clientes.append({
-            'id': row[0],
-            'nome': row[1],
-            'telefone': row[2],
-            'email': row[3],
-            'cpf_cnpj': row[4],
-            'endereco': row[5]
-        })
+    clientes = [_cliente_de_linha(row) for row in cursor.fetchall()]
     
     conn.close()
     return clientes
 
+def buscar_clientes(termo, limite=10):
+    """Clientes cujo nome, CPF/CNPJ ou telefone começa pelo termo (busca por prefixo, resolvida nos índices)"""
+    termo = (termo or '').strip()
+    if not termo:
+        return []
+    digitos = re.sub(r'\D', '', termo)
+
+    # Cada ramo lê só o início do seu índice; a união ordena no máximo 3 x limite linhas
+    ramos = ["SELECT id FROM (SELECT id FROM clientes WHERE nome LIKE ? ESCAPE '\\' ORDER BY nome COLLATE NOCASE LIMIT ?)"]
+    params = [_padrao_prefixo_like(termo), limite]
+    if len(digitos) >= 2:
+        for coluna in ('documento_digitos', 'telefone_digitos'):
+            ramos.append(f"SELECT id FROM (SELECT id FROM clientes WHERE {coluna} GLOB ? ORDER BY {coluna} LIMIT ?)")
+            params.extend([digitos + '*', limite])
+
+    with conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT {COLUNAS_CLIENTE}
+            FROM clientes
+            WHERE id IN ({' UNION '.join(ramos)})
+            ORDER BY nome COLLATE NOCASE
+            LIMIT ?
+        ''', params + [limite])
+        return [_cliente_de_linha(row) for row in cursor.fetchall()]
+
 def adicionar_cliente(nome, telefone=None, email=None, cpf_cnpj=None, endereco=None):
     """Adiciona um novo cliente"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -1240,7 +1508,7 @@ def adicionar_cliente(nome, telefone=None, email=None, cpf_cnpj=None, endereco=N
 
 def editar_cliente(id, nome, telefone=None, email=None, cpf_cnpj=None, endereco=None):
     """Edita um cliente existente"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -1254,7 +1522,7 @@ def editar_cliente(id, nome, telefone=None, email=None, cpf_cnpj=None, endereco=
 
 def deletar_cliente(id):
     """Deleta um cliente"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute("DELETE FROM clientes WHERE id = ?", (id,))
@@ -1262,119 +1530,468 @@ def deletar_cliente(id):
     conn.close()
 
 # FUNÇÕES DE PRODUTOS
+# Colunas de produto na ordem esperada por _produto_de_linha
+COLUNAS_PRODUTO = '''p.id, p.nome, p.preco, p.estoque, p.estoque_minimo, p.codigo_barras, p.descricao,
+               p.categoria, p.ativo, p.codigo_fornecedor, p.preco_custo, p.margem_lucro, p.ncm,
+               p.unidade, p.foto_url, p.marca'''
+
+# Pesos do bm25 por coluna do índice: nome, descricao, marca, codigo_barras, codigo_fornecedor, categoria
+PESOS_BUSCA_PRODUTOS = (10.0, 1.0, 3.0, 8.0, 8.0, 2.0)
+
+def _produto_de_linha(row):
+    """Converte uma linha com COLUNAS_PRODUTO em dicionário"""
+    return {
+        'id': row[0],
+        'nome': row[1],
+        'preco': row[2],
+        'estoque': row[3],
+        'estoque_minimo': row[4],
+        'codigo_barras': row[5],
+        'descricao': row[6],
+        'categoria': row[7],
+        'ativo': row[8],
+        'codigo_fornecedor': row[9],
+        'preco_custo': row[10] or 0,
+        'margem_lucro': row[11] or 0,
+        'ncm': row[12],
+        'unidade': row[13] or 'UN',
+        'foto_url': row[14],
+        'marca': row[15]
+    }
+
+# CACHE DO CATÁLOGO DE PRODUTOS
+class CacheCatalogo:
+    """
+    Catálogo de produtos ativos em memória, compartilhado pelas threads do processo.
+
+    Guarda cada produto como tupla (ordem de COLUNAS_PRODUTO) com mapas por ID,
+    código de barras e código do fornecedor normalizado. As funções de escrita
+    atualizam os produtos alterados (recarregar) ou descartam tudo (invalidar);
+    alterações feitas por outros workers chegam via validar_caches().
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._registros = None   # {id: linha}
+        self._ordem = []         # [(nome, id)] na ordem de ORDER BY nome
+        self._por_barras = {}    # codigo_barras -> id
+        self._por_codigo = {}    # codigo_fornecedor normalizado -> {ids}
+        self._carregado_em = 0
+        self._stats = {
+            'acertos': 0,
+            'falhas': 0,
+            'cargas_completas': 0,
+            'atualizacoes_parciais': 0,
+            'invalidacoes': 0,
+        }
+
+    def _indexar(self, row):
+        self._registros[row[0]] = row
+        bisect.insort(self._ordem, (row[1], row[0]))
+        if row[5]:
+            self._por_barras[row[5]] = row[0]
+        codigo = normalizar_codigo(row[9])
+        if codigo:
+            self._por_codigo.setdefault(codigo, set()).add(row[0])
+
+    def _desindexar(self, produto_id):
+        row = self._registros.pop(produto_id, None)
+        if row is None:
+            return
+        posicao = bisect.bisect_left(self._ordem, (row[1], row[0]))
+        if posicao < len(self._ordem) and self._ordem[posicao] == (row[1], row[0]):
+            del self._ordem[posicao]
+        if row[5] and self._por_barras.get(row[5]) == produto_id:
+            del self._por_barras[row[5]]
+        codigo = normalizar_codigo(row[9])
+        ids = self._por_codigo.get(codigo)
+        if ids:
+            ids.discard(produto_id)
+            if not ids:
+                del self._por_codigo[codigo]
+
+    def _carregar(self):
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT {COLUNAS_PRODUTO} FROM produtos p WHERE p.ativo = 1")
+            linhas = cursor.fetchall()
+        finally:
+            conn.close()
+
+        self._registros = {}
+        self._ordem = []
+        self._por_barras = {}
+        self._por_codigo = {}
+        for row in linhas:
+            self._registros[row[0]] = row
+            if row[5]:
+                self._por_barras[row[5]] = row[0]
+            codigo = normalizar_codigo(row[9])
+            if codigo:
+                self._por_codigo.setdefault(codigo, set()).add(row[0])
+        self._ordem = sorted((row[1], row[0]) for row in linhas)
+        self._carregado_em = time.monotonic()
+        self._stats['cargas_completas'] += 1
+
+    def _garantir_carregado(self):
+        if self._registros is None:
+            self._stats['falhas'] += 1
+            self._carregar()
+        else:
+            self._stats['acertos'] += 1
+
+    def listar(self):
+        """Todos os produtos ativos ordenados por nome"""
+        with self._lock:
+            self._garantir_carregado()
+            return [_produto_de_linha(self._registros[produto_id]) for _, produto_id in self._ordem]
+
+    def obter(self, produto_id):
+        """Produto ativo pelo ID (ou None)"""
+        with self._lock:
+            self._garantir_carregado()
+            row = self._registros.get(produto_id)
+            return _produto_de_linha(row) if row else None
+
+    def _id_por_codigo(self, codigo):
+        if codigo.isdecimal() and int(codigo) in self._registros:
+            return int(codigo)
+        if codigo in self._por_barras:
+            return self._por_barras[codigo]
+        ids = self._por_codigo.get(normalizar_codigo(codigo))
+        return min(ids) if ids else None
+
+    def buscar_por_codigos(self, codigos):
+        """Resolve códigos (ID, código de barras ou do fornecedor) em produtos: {codigo: produto ou None}"""
+        with self._lock:
+            self._garantir_carregado()
+            resultado = {}
+            for codigo in codigos:
+                produto_id = self._id_por_codigo(codigo)
+                resultado[codigo] = _produto_de_linha(self._registros[produto_id]) if produto_id else None
+            return resultado
+
+    def recarregar(self, ids):
+        """Relê do banco apenas os produtos informados (após escrita confirmada)"""
+        ids = sorted({int(produto_id) for produto_id in ids if produto_id is not None})
+        if not ids:
+            return
+        with self._lock:
+            if self._registros is None:
+                return
+            linhas = {}
+            conn = get_db_connection()
+            try:
+                cursor = conn.cursor()
+                for inicio in range(0, len(ids), LOTE_PARAMETROS_IN):
+                    lote = ids[inicio:inicio + LOTE_PARAMETROS_IN]
+                    cursor.execute(f'''
+                        SELECT {COLUNAS_PRODUTO} FROM produtos p
+                        WHERE p.id IN ({', '.join('?' * len(lote))}) AND p.ativo = 1
+                    ''', lote)
+                    linhas.update((row[0], row) for row in cursor.fetchall())
+            finally:
+                conn.close()
+            for produto_id in ids:
+                self._desindexar(produto_id)
+                if produto_id in linhas:
+                    self._indexar(linhas[produto_id])
+            self._stats['atualizacoes_parciais'] += 1
+
+    def invalidar(self):
+        """Descarta o cache inteiro (próxima leitura recarrega do banco)"""
+        with self._lock:
+            self._registros = None
+            self._ordem = []
+            self._por_barras = {}
+            self._por_codigo = {}
+            self._stats['invalidacoes'] += 1
+
+    def estatisticas(self):
+        """Contadores de uso e tamanho aproximado do cache"""
+        with self._lock:
+            stats = dict(self._stats)
+            registros = self._registros or {}
+            consultas = stats['acertos'] + stats['falhas']
+            stats['produtos'] = len(registros)
+            stats['codigos_barras'] = len(self._por_barras)
+            stats['codigos_fornecedor'] = len(self._por_codigo)
+            stats['taxa_acerto'] = (stats['acertos'] / consultas) if consultas else 0
+            stats['idade_segundos'] = round(time.monotonic() - self._carregado_em, 1) if self._registros is not None else None
+            stats['memoria_aprox_bytes'] = sum(
+                sys.getsizeof(row) + sum(sys.getsizeof(valor) for valor in row)
+                for row in registros.values()
+            ) + sys.getsizeof(registros) + sys.getsizeof(self._ordem) + sys.getsizeof(self._por_barras) + sys.getsizeof(self._por_codigo)
+            return stats
+
+_cache_catalogo = CacheCatalogo()
+
+def invalidar_cache_catalogo():
+    """Descarta o cache do catálogo (usar após alterações em massa de produtos)"""
+    _cache_catalogo.invalidar()
+
+class CacheRegistros:
+    """Cache chave -> valor por processo (usuários, configurações), invalidado pelo registro de alterações"""
+
+    def __init__(self, ttl=None):
+        self._lock = threading.Lock()
+        self._dados = {}
+        self._expira_em = {}
+        # ttl (segundos) limita a idade de valores que dependem também do relógio (ex.: "hoje")
+        self._ttl = ttl
+        self._geracao = 0
+        self._stats = {'acertos': 0, 'falhas': 0, 'invalidacoes': 0}
+
+    def obter(self, chave, carregar):
+        """Retorna o valor em cache ou chama carregar() e guarda o resultado"""
+        with self._lock:
+            if chave in self._dados and (self._ttl is None or self._expira_em[chave] > time.monotonic()):
+                self._stats['acertos'] += 1
+                return copy.copy(self._dados[chave])
+            self._stats['falhas'] += 1
+            geracao = self._geracao
+
+        valor = carregar()
+
+        with self._lock:
+            # Não guarda um valor lido antes de uma invalidação concorrente
+            if geracao == self._geracao:
+                self._dados[chave] = valor
+                if self._ttl is not None:
+                    self._expira_em[chave] = time.monotonic() + self._ttl
+        return copy.copy(valor)
+
+    def invalidar(self, chaves=None):
+        """Remove as chaves informadas (ou tudo, se None)"""
+        with self._lock:
+            self._geracao += 1
+            self._stats['invalidacoes'] += 1
+            if chaves is None:
+                self._dados.clear()
+                self._expira_em.clear()
+            else:
+                for chave in chaves:
+                    self._dados.pop(chave, None)
+                    self._expira_em.pop(chave, None)
+
+    def estatisticas(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['registros'] = len(self._dados)
+            return stats
+
+# Painéis do dashboard: recalculados após qualquer escrita nas tabelas que eles resumem (ou após o TTL)
+DASHBOARD_CACHE_TTL = 60
+
+_cache_usuarios = CacheRegistros()
+_cache_configuracoes = CacheRegistros()
+_cache_dashboard = CacheRegistros(ttl=DASHBOARD_CACHE_TTL)
+
+# COERÊNCIA DOS CACHES ENTRE WORKERS
+# Triggers gravam cada alteração das tabelas em cache na tabela alteracoes (seq crescente).
+# Cada processo guarda o último seq visto e, a cada requisição, lê só o que mudou depois dele.
+ALTERACOES_LIMITE_POR_VALIDACAO = 500
+
+_coerencia = {'ultima_seq': None, 'validacoes': 0, 'alteracoes_aplicadas': 0, 'invalidacoes_totais': 0}
+_lock_coerencia = threading.Lock()
+
+# tabela -> funções chamadas com os IDs alterados (None = descartar tudo)
+_OUVINTES_ALTERACOES = {
+    'produtos': [lambda ids: _cache_catalogo.invalidar() if ids is None else _cache_catalogo.recarregar(ids)],
+    'usuarios': [_cache_usuarios.invalidar],
+    'configuracoes_empresa': [lambda ids: _cache_configuracoes.invalidar()],
+}
+for _tabela in ('produtos', 'clientes', 'fornecedores', 'vendas', 'contas_pagar', 'contas_receber'):
+    _OUVINTES_ALTERACOES.setdefault(_tabela, []).append(lambda ids: _cache_dashboard.invalidar())
+
+def registrar_ouvinte_alteracoes(tabela, funcao):
+    """Registra uma função chamada com os IDs alterados em uma tabela (None = tudo mudou)"""
+    _OUVINTES_ALTERACOES.setdefault(tabela, []).append(funcao)
+
+def _notificar_alteracoes(alteracoes):
+    """Repassa {tabela: ids} aos ouvintes; None invalida todos os caches"""
+    for tabela, ouvintes in _OUVINTES_ALTERACOES.items():
+        if alteracoes is None:
+            ids = None
+        elif tabela in alteracoes:
+            ids = alteracoes[tabela]
+        else:
+            continue
+        for ouvinte in ouvintes:
+            ouvinte(ids)
+
+def validar_caches():
+    """Confere o registro de alterações com uma consulta e atualiza os caches afetados"""
+    with _lock_coerencia:
+        _coerencia['validacoes'] += 1
+        ultima_seq = _coerencia['ultima_seq']
+        conn = get_db_connection()
+        try:
+            if ultima_seq is None:
+                # Primeira validação do processo: marca o ponto de partida
+                linhas = None
+                _coerencia['ultima_seq'] = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM alteracoes").fetchone()[0]
+            else:
+                linhas = conn.execute('''
+                    SELECT seq, tabela, registro_id FROM alteracoes
+                    WHERE seq > ? ORDER BY seq LIMIT ?
+                ''', (ultima_seq, ALTERACOES_LIMITE_POR_VALIDACAO + 1)).fetchall()
+                if not linhas:
+                    return
+                if linhas[0][0] != ultima_seq + 1 or len(linhas) > ALTERACOES_LIMITE_POR_VALIDACAO:
+                    # Registro já podado ou alterações demais: mais barato descartar tudo
+                    linhas = None
+                    _coerencia['ultima_seq'] = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM alteracoes").fetchone()[0]
+                else:
+                    _coerencia['ultima_seq'] = linhas[-1][0]
+        finally:
+            conn.close()
+
+        if linhas is None:
+            _coerencia['invalidacoes_totais'] += 1
+            _notificar_alteracoes(None)
+            return
+
+        alteracoes = {}
+        for _, tabela, registro_id in linhas:
+            alteracoes.setdefault(tabela, set()).add(registro_id)
+        _coerencia['alteracoes_aplicadas'] += len(linhas)
+        _notificar_alteracoes(alteracoes)
+
+def obter_estatisticas_caches():
+    """Estatísticas de todos os caches do processo e da coerência entre workers"""
+    with _lock_coerencia:
+        coerencia = dict(_coerencia)
+    return {
+        'catalogo': _cache_catalogo.estatisticas(),
+        'usuarios': _cache_usuarios.estatisticas(),
+        'configuracoes': _cache_configuracoes.estatisticas(),
+        'dashboard': _cache_dashboard.estatisticas(),
+        'coerencia': coerencia,
+    }
+
 def listar_produtos():
     """Lista todos os produtos ativos"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT id, nome, preco, estoque, estoque_minimo, codigo_barras, descricao, categoria, ativo, 
-               codigo_fornecedor, preco_custo, margem_lucro, ncm, unidade, foto_url, marca
-        FROM produtos
-        WHERE ativo = 1
-        ORDER BY nome
-    ''')
+    return _cache_catalogo.listar()
+
+def _montar_consulta_fts(termo):
+    """Transforma o texto digitado em uma consulta FTS5 de prefixos (todos os termos obrigatórios)"""
+    tokens = re.findall(r'\w+', termo.lower())
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+def pesquisar_produtos(termo, categoria=None, limite=50):
+    """Busca produtos ativos pelo índice FTS5 (nome, descrição, marca, códigos e categoria), ordenados por relevância"""
+    termo = (termo or '').strip()
+    if categoria == 'todas':
+        categoria = None
     
-    produtos = []
-    for row in cursor.fetchall():
-        produtos.append({
-            'id': row[0],
-            'nome': row[1],
-            'preco': row[2],
-            'estoque': row[3],
-            'estoque_minimo': row[4],
-            'codigo_barras': row[5],
-            'descricao': row[6],
-            'categoria': row[7],
-            'ativo': row[8],
-            'codigo_fornecedor': row[9],
-            'preco_custo': row[10] or 0,
-            'margem_lucro': row[11] or 0,
-            'ncm': row[12],
-            'unidade': row[13] or 'UN',
-            'foto_url': row[14],
-            'marca': row[15]
-        })
+    conn = get_db_connection()
+    cursor = conn.cursor()
     
-    conn.close()
-    return produtos
+    try:
+        filtro_categoria = " AND p.categoria = ?" if categoria else ""
+        params_categoria = [categoria] if categoria else []
+        
+        if not termo:
+            cursor.execute(f'''
+                SELECT {COLUNAS_PRODUTO}
+                FROM produtos p
+                WHERE p.ativo = 1{filtro_categoria}
+                ORDER BY p.nome
+                LIMIT ?
+            ''', params_categoria + [limite])
+            return [_produto_de_linha(row) for row in cursor.fetchall()]
+        
+        produtos = []
+        
+        # ID digitado diretamente tem prioridade sobre os resultados do índice
+        if termo.isdecimal():
+            cursor.execute(f'''
+                SELECT {COLUNAS_PRODUTO}
+                FROM produtos p
+                WHERE p.id = ? AND p.ativo = 1{filtro_categoria}
+            ''', [int(termo)] + params_categoria)
+            produtos.extend(_produto_de_linha(row) for row in cursor.fetchall())
+        
+        consulta = _montar_consulta_fts(termo)
+        if not consulta:
+            return produtos
+        
+        try:
+            cursor.execute(f'''
+                SELECT {COLUNAS_PRODUTO}
+                FROM produtos_fts
+                JOIN produtos p ON p.id = produtos_fts.rowid
+                WHERE produtos_fts MATCH ? AND p.ativo = 1{filtro_categoria}
+                ORDER BY bm25(produtos_fts, {', '.join(str(peso) for peso in PESOS_BUSCA_PRODUTOS)})
+                LIMIT ?
+            ''', [consulta] + params_categoria + [limite])
+        except sqlite3.OperationalError as e:
+            # SQLite sem FTS5 (índice não criado pela migração): busca por LIKE
+            print(f"Aviso: busca FTS indisponível ({e}), usando LIKE")
+            padrao = f'%{termo}%'
+            cursor.execute(f'''
+                SELECT {COLUNAS_PRODUTO}
+                FROM produtos p
+                WHERE p.ativo = 1{filtro_categoria} AND (
+                    p.nome LIKE ? OR p.descricao LIKE ? OR p.marca LIKE ? OR
+                    p.codigo_barras LIKE ? OR p.codigo_fornecedor LIKE ? OR p.categoria LIKE ?
+                )
+                ORDER BY p.nome
+                LIMIT ?
+            ''', params_categoria + [padrao] * 6 + [limite])
+        
+        ids_encontrados = {produto['id'] for produto in produtos}
+        for row in cursor.fetchall():
+            if row[0] not in ids_encontrados:
+                produtos.append(_produto_de_linha(row))
+        
+        return produtos[:limite]
+    finally:
+        conn.close()
 
 def buscar_produto(termo_busca):
     """Busca produto por nome, código de barras, código do fornecedor, marca ou ID"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT id, nome, preco, estoque, codigo_barras, codigo_fornecedor, preco_custo, margem_lucro, categoria, marca
-        FROM produtos
-        WHERE ativo = 1 AND (
-            nome LIKE ? OR 
-            codigo_barras = ? OR 
-            codigo_fornecedor LIKE ? OR
-            marca LIKE ? OR
-            CAST(id AS TEXT) = ?
-        )
-        LIMIT 10
-    ''', (f'%{termo_busca}%', termo_busca, f'%{termo_busca}%', f'%{termo_busca}%', termo_busca))
-    
-    produtos = []
-    for row in cursor.fetchall():
-        produtos.append({
-            'id': row[0],
-            'nome': row[1],
-            'preco': row[2],
-            'estoque': row[3],
-            'codigo_barras': row[4],
-            'codigo_fornecedor': row[5],
-            'preco_custo': row[6] or 0,
-            'margem_lucro': row[7] or 0,
-            'categoria': row[8],
-            'marca': row[9]
-        })
-    
-    conn.close()
-    return produtos
+    return pesquisar_produtos(termo_busca, limite=10)
+
+# Caracteres ignorados na comparação de códigos de fornecedor (mesma regra da coluna codigo_fornecedor_norm)
+_TABELA_NORMALIZACAO_CODIGO = str.maketrans('', '', ' -./_')
+
+# Limite de parâmetros por consulta IN (SQLITE_MAX_VARIABLE_NUMBER antigo é 999)
+LOTE_PARAMETROS_IN = 500
+
+def normalizar_codigo(codigo):
+    """Normaliza um código de fornecedor para comparação (maiúsculo, sem espaços e pontuação)"""
+    if codigo is None:
+        return None
+    return str(codigo).translate(_TABELA_NORMALIZACAO_CODIGO).upper()
+
+def buscar_produto_por_codigo(codigo):
+    """Busca exata de produto ativo por ID, código de barras ou código do fornecedor normalizado"""
+    codigo = str(codigo or '').strip()
+    if not codigo:
+        return None
+    return _cache_catalogo.buscar_por_codigos([codigo])[codigo]
+
+def buscar_produtos_por_codigos(codigos):
+    """Busca em lote (vários códigos lidos de uma vez); retorna {codigo: produto ou None}"""
+    codigos = [str(c).strip() for c in codigos if c is not None and str(c).strip()]
+    if not codigos:
+        return {}
+    return _cache_catalogo.buscar_por_codigos(codigos)
 
 def obter_produto_por_id(produto_id):
     """Obtém um produto específico pelo ID"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT id, nome, preco, estoque, estoque_minimo, codigo_barras, descricao, categoria, ativo, 
-               codigo_fornecedor, preco_custo, margem_lucro, ncm, unidade, foto_url, marca
-        FROM produtos
-        WHERE id = ? AND ativo = 1
-    ''', (produto_id,))
-    
-    row = cursor.fetchone()
-    conn.close()
-    
-    if row:
-        return {
-            'id': row[0],
-            'nome': row[1],
-            'preco': row[2],
-            'estoque': row[3],
-            'estoque_minimo': row[4],
-            'codigo_barras': row[5],
-            'descricao': row[6],
-            'categoria': row[7],
-            'ativo': row[8],
-            'codigo_fornecedor': row[9],
-            'preco_custo': row[10] or 0,
-            'margem_lucro': row[11] or 0,
-            'ncm': row[12],
-            'unidade': row[13] or 'UN',
-            'foto_url': row[14],
-            'marca': row[15]
-        }
-    return None
+    try:
+        return _cache_catalogo.obter(int(produto_id))
+    except (TypeError, ValueError):
+        return None
 
 def adicionar_produto(nome, preco, estoque=0, estoque_minimo=5, codigo_barras=None, descricao=None, categoria=None, 
                      codigo_fornecedor=None, preco_custo=0, margem_lucro=0, foto_url=None, marca=None):
     """Adiciona um novo produto"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     # Calcular preço de venda baseado no custo e margem se fornecidos
@@ -1393,12 +2010,13 @@ def adicionar_produto(nome, preco, estoque=0, estoque_minimo=5, codigo_barras=No
     produto_id = cursor.lastrowid
     conn.commit()
     conn.close()
+    _cache_catalogo.recarregar([produto_id])
     return produto_id
 
 def editar_produto(id, nome, preco, estoque, estoque_minimo=5, codigo_barras=None, descricao=None, categoria=None,
                   codigo_fornecedor=None, preco_custo=0, margem_lucro=0, foto_url=None, marca=None):
     """Edita um produto existente"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     # Calcular preço de venda baseado no custo e margem se fornecidos
@@ -1417,19 +2035,21 @@ def editar_produto(id, nome, preco, estoque, estoque_minimo=5, codigo_barras=Non
     
     conn.commit()
     conn.close()
+    _cache_catalogo.recarregar([id])
 
 def deletar_produto(id):
     """Marca um produto como inativo"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute("UPDATE produtos SET ativo = 0 WHERE id = ?", (id,))
     conn.commit()
     conn.close()
+    _cache_catalogo.recarregar([id])
 
 def deletar_todos_os_produtos():
     """Marca todos os produtos como inativos - FUNÇÃO DE TESTE"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
@@ -1441,6 +2061,7 @@ def deletar_todos_os_produtos():
         total_deletados = cursor.fetchone()[0]
         
         conn.commit()
+        _cache_catalogo.invalidar()
         print(f"✓ {total_deletados} produtos marcados como inativos")
         return total_deletados
         
@@ -1453,7 +2074,7 @@ def deletar_todos_os_produtos():
 
 def limpar_completamente_produtos():
     """Remove completamente todos os produtos do banco - CUIDADO!"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
@@ -1467,6 +2088,7 @@ def limpar_completamente_produtos():
         cursor.execute("DELETE FROM sqlite_sequence WHERE name='produtos'")
         
         conn.commit()
+        _cache_catalogo.invalidar()
         print("✓ Todos os produtos removidos completamente do banco")
         
     except Exception as e:
@@ -1489,83 +2111,269 @@ def atualizar_estoque(produto_id, quantidade):
     
     conn.commit()
     conn.close()
+    _cache_catalogo.recarregar([produto_id])
 
 # FUNÇÕES DE VENDAS
-def registrar_venda(cliente_id, itens, forma_pagamento, desconto=0, observacoes=None, usuario_id=None):
-    """Registra uma nova venda com seus itens"""
+def _verificar_estoque_itens(cursor, itens):
+    """Confere existência e estoque de todos os produtos da venda com uma consulta (quantidades somadas por produto)"""
+    quantidades = {}
+    for item in itens:
+        quantidades[item['produto_id']] = quantidades.get(item['produto_id'], 0) + item['quantidade']
+    
+    produtos = {}
+    ids = list(quantidades)
+    for inicio in range(0, len(ids), LOTE_PARAMETROS_IN):
+        lote = ids[inicio:inicio + LOTE_PARAMETROS_IN]
+        cursor.execute(f"SELECT id, nome, estoque FROM produtos WHERE id IN ({', '.join('?' * len(lote))})", lote)
+        produtos.update((row[0], row) for row in cursor.fetchall())
+    
+    for produto_id, quantidade in quantidades.items():
+        if produto_id not in produtos:
+            raise Exception(f"Produto com ID {produto_id} não encontrado")
+        _, nome_produto, estoque_atual = produtos[produto_id]
+        if estoque_atual < quantidade:
+            raise Exception(f"Estoque insuficiente para {nome_produto}. Disponível: {estoque_atual}, solicitado: {quantidade}")
+    
+    return quantidades
+
+def _inserir_itens_e_baixar_estoque(cursor, venda_id, itens, quantidades):
+    """Grava os itens da venda e baixa o estoque; a baixa só acontece se ainda houver saldo
+
+    O subtotal é sempre calculado aqui (o enviado pelo navegador é ignorado), como o total da venda.
+    """
+    cursor.executemany('''
+        INSERT INTO itens_venda (venda_id, produto_id, quantidade, preco_unitario, subtotal)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [
+        (venda_id, item['produto_id'], item['quantidade'], item['preco_unitario'],
+         item['quantidade'] * item['preco_unitario'])
+        for item in itens
+    ])
+    
+    if not quantidades:
+        return
+    
+    cursor.executemany('''
+        UPDATE produtos 
+        SET estoque = estoque - ? 
+        WHERE id = ? AND estoque >= ?
+    ''', [(quantidade, produto_id, quantidade) for produto_id, quantidade in quantidades.items()])
+    
+    # rowcount soma as linhas de todas as execuções: cada produto precisa ter sido baixado
+    if cursor.rowcount != len(quantidades):
+        raise Exception("Estoque insuficiente: o estoque foi alterado durante a venda, tente novamente")
+
+def _acumular_resumo_diario(cursor, data_venda, forma_pagamento, usuario_id, total, desconto, itens_vendidos, sinal=1):
+    """Soma (sinal=1) ou subtrai (sinal=-1) uma venda do resumo diário, na transação da própria venda"""
+    chave = ((data_venda or '')[:10], forma_pagamento or '', usuario_id or 0)
+    total = total or 0
+    desconto = desconto or 0
+    cursor.execute('''
+        INSERT INTO vendas_resumo_diario (
+            dia, forma_pagamento, usuario_id, quantidade_vendas,
+            valor_bruto, valor_desconto, valor_total, itens_vendidos
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (dia, forma_pagamento, usuario_id) DO UPDATE SET
+            quantidade_vendas = quantidade_vendas + excluded.quantidade_vendas,
+            valor_bruto = valor_bruto + excluded.valor_bruto,
+            valor_desconto = valor_desconto + excluded.valor_desconto,
+            valor_total = valor_total + excluded.valor_total,
+            itens_vendidos = itens_vendidos + excluded.itens_vendidos
+    ''', chave + (sinal, sinal * (total + desconto), sinal * desconto, sinal * total, sinal * (itens_vendidos or 0)))
+    if sinal < 0:
+        cursor.execute('''
+            DELETE FROM vendas_resumo_diario
+            WHERE dia = ? AND forma_pagamento = ? AND usuario_id = ? AND quantidade_vendas <= 0
+        ''', chave)
+
+def _reconstruir_resumo_vendas(cursor, data_inicio=None, data_fim=None):
+    """Recalcula o resumo diário (todo ou só o período) a partir das vendas"""
+    filtro = ''
+    params = []
+    if data_inicio:
+        filtro += " AND {coluna} >= ?"
+        params.append(data_inicio)
+    if data_fim:
+        filtro += " AND {coluna} <= ?"
+        params.append(data_fim)
+    cursor.execute("DELETE FROM vendas_resumo_diario WHERE 1=1" + filtro.format(coluna='dia'), params)
+    cursor.execute(SQL_RECONSTRUIR_RESUMO_VENDAS + filtro.format(coluna='v.dia_venda') + " GROUP BY 1, 2, 3", params)
+
+def reconstruir_resumo_vendas(data_inicio=None, data_fim=None):
+    """Reconstrói o resumo diário de vendas (todo ou só o período); retorna (sucesso, mensagem)"""
+    with conexao() as conn:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            _reconstruir_resumo_vendas(cursor, data_inicio, data_fim)
+            cursor.execute("SELECT COUNT(*) FROM vendas_resumo_diario")
+            linhas = cursor.fetchone()[0]
+            conn.commit()
+            return True, f"Resumo diário reconstruído ({linhas} linhas)"
+        except Exception as e:
+            conn.rollback()
+            return False, f"Erro ao reconstruir resumo de vendas: {str(e)}"
+
+def obter_resumo_vendas(data_inicio=None, data_fim=None, agrupar_por=None):
+    """Totais de vendas do período lidos do resumo diário (agrupar_por: None, 'dia', 'forma_pagamento' ou 'usuario_id')"""
+    if agrupar_por not in (None, 'dia', 'forma_pagamento', 'usuario_id'):
+        raise ValueError(f"Agrupamento inválido: {agrupar_por}")
+    
+    query = '''
+        SELECT {coluna}
+               COALESCE(SUM(quantidade_vendas), 0), COALESCE(SUM(valor_bruto), 0),
+               COALESCE(SUM(valor_desconto), 0), COALESCE(SUM(valor_total), 0),
+               COALESCE(SUM(itens_vendidos), 0)
+        FROM vendas_resumo_diario
+        WHERE 1=1
+    '''.format(coluna=f"{agrupar_por}," if agrupar_por else '')
+    params = []
+    if data_inicio:
+        query += " AND dia >= ?"
+        params.append(data_inicio)
+    if data_fim:
+        query += " AND dia <= ?"
+        params.append(data_fim)
+    if agrupar_por:
+        query += f" GROUP BY {agrupar_por} ORDER BY {agrupar_por}"
+    
+    with conexao() as conn:
+        linhas = conn.execute(query, params).fetchall()
+    
+    def _totais(valores):
+        quantidade, bruto, desconto, total, itens = valores
+        return {
+            'quantidade_vendas': quantidade,
+            'valor_bruto': bruto,
+            'valor_desconto': desconto,
+            'valor_total': total,
+            'itens_vendidos': itens,
+            'ticket_medio': total / quantidade if quantidade else 0
+        }
+    
+    if not agrupar_por:
+        return _totais(linhas[0])
+    return [dict(_totais(linha[1:]), **{agrupar_por: linha[0]}) for linha in linhas]
+
+def _publicar_venda(cursor, venda_id, cliente_id, total, forma_pagamento, data_venda, itens_vendidos):
+    """Publica o evento de venda nova para os painéis conectados (dashboard, caixa)"""
+    cliente_nome = "Cliente Avulso"
+    if cliente_id:
+        cursor.execute("SELECT nome FROM clientes WHERE id = ?", (cliente_id,))
+        cliente_result = cursor.fetchone()
+        if cliente_result:
+            cliente_nome = cliente_result[0]
+    _publicar_evento(cursor, 'venda', {
+        'id': venda_id,
+        'cliente': cliente_nome,
+        'total': total,
+        'forma_pagamento': forma_pagamento,
+        'data_venda': data_venda,
+        'itens_vendidos': itens_vendidos
+    })
+
+# Chaves de idempotência das vendas valem por este tempo (cobre os reenvios do PDV)
+IDEMPOTENCIA_TTL_HORAS = 24
+# Intervalo mínimo entre duas limpezas das chaves vencidas feitas por este processo
+IDEMPOTENCIA_INTERVALO_LIMPEZA = 3600
+
+_ultima_limpeza_idempotencia = [0.0]
+
+def _limpar_chaves_idempotencia_vencidas(cursor, forcar=False):
+    """Apaga as chaves de idempotência mais antigas que o TTL (no máximo uma vez por intervalo)"""
+    agora = time.monotonic()
+    if not forcar and agora - _ultima_limpeza_idempotencia[0] < IDEMPOTENCIA_INTERVALO_LIMPEZA:
+        return 0
+    _ultima_limpeza_idempotencia[0] = agora
+    limite = (datetime.now() - timedelta(hours=IDEMPOTENCIA_TTL_HORAS)).strftime('%Y-%m-%d %H:%M:%S')
+    cursor.execute("DELETE FROM vendas_idempotencia WHERE criada_em < ?", (limite,))
+    return cursor.rowcount
+
+def limpar_chaves_idempotencia():
+    """Remove as chaves de idempotência de vendas vencidas; retorna quantas foram apagadas"""
+    with conexao() as conn:
+        removidas = _limpar_chaves_idempotencia_vencidas(conn.cursor(), forcar=True)
+        conn.commit()
+    return removidas
+
+def buscar_venda_por_chave_idempotencia(chave):
+    """Retorna o ID da venda já registrada com esta chave de idempotência (None se não houver ou se foi excluída)"""
+    if not chave:
+        return None
+    with conexao() as conn:
+        row = conn.execute('''
+            SELECT k.venda_id FROM vendas_idempotencia k
+            JOIN vendas v ON v.id = k.venda_id
+            WHERE k.chave = ?
+        ''', (chave,)).fetchone()
+    return row[0] if row else None
+
+def registrar_venda(cliente_id, itens, forma_pagamento, desconto=0, observacoes=None, usuario_id=None,
+                    chave_idempotencia=None, terminal=TERMINAL_PADRAO):
+    """Registra uma nova venda com seus itens (um reenvio com a mesma chave de idempotência devolve a venda original)"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
-        # Verificar estoque antes de processar a venda
-        for item in itens:
-            cursor.execute('SELECT nome, estoque FROM produtos WHERE id = ?', (item['produto_id'],))
-            produto = cursor.fetchone()
-            
-            if not produto:
-                raise Exception(f"Produto com ID {item['produto_id']} não encontrado")
-            
-            nome_produto, estoque_atual = produto
-            if estoque_atual < item['quantidade']:
-                raise Exception(f"Estoque insuficiente para {nome_produto}. Disponível: {estoque_atual}, solicitado: {item['quantidade']}")
+        # Reserva a escrita já no início: verificação e baixa de estoque não podem se intercalar
+        # com outra venda (evita vender a mesma última unidade duas vezes)
+        cursor.execute("BEGIN IMMEDIATE")
+        
+        if chave_idempotencia:
+            # Conferida dentro do lock: dois reenvios simultâneos não passam juntos por aqui
+            cursor.execute('''
+                SELECT k.venda_id, v.id FROM vendas_idempotencia k
+                LEFT JOIN vendas v ON v.id = k.venda_id
+                WHERE k.chave = ?
+            ''', (chave_idempotencia,))
+            existente = cursor.fetchone()
+            if existente and existente[1] is not None:
+                conn.rollback()
+                return existente[0]
+            if existente:
+                # Chave de uma venda que já foi excluída: vale como chave nova
+                cursor.execute("DELETE FROM vendas_idempotencia WHERE chave = ?", (chave_idempotencia,))
+            _limpar_chaves_idempotencia_vencidas(cursor)
+        
+        quantidades = _verificar_estoque_itens(cursor, itens)
         
         # Calcula o total
         total = sum(item['quantidade'] * item['preco_unitario'] for item in itens) - desconto
         
         # Insere a venda
+        data_venda = agora_local()
         cursor.execute('''
-            INSERT INTO vendas (cliente_id, total, forma_pagamento, desconto, observacoes, usuario_id)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (cliente_id, total, forma_pagamento, desconto, observacoes, usuario_id))
+            INSERT INTO vendas (cliente_id, total, forma_pagamento, desconto, observacoes, data_venda, usuario_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (cliente_id, total, forma_pagamento, desconto, observacoes, data_venda, usuario_id))
         
         venda_id = cursor.lastrowid
         
-        # Insere os itens da venda
-        for item in itens:
-            cursor.execute('''
-                INSERT INTO itens_venda (venda_id, produto_id, quantidade, preco_unitario, subtotal)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (venda_id, item['produto_id'], item['quantidade'], 
-                  item['preco_unitario'], item['quantidade'] * item['preco_unitario']))
-            
-            # Atualiza o estoque diretamente na mesma transação
-            cursor.execute('''
-                UPDATE produtos 
-                SET estoque = estoque - ? 
-                WHERE id = ?
-            ''', (item['quantidade'], item['produto_id']))
+        # Insere os itens e baixa o estoque na mesma transação
+        _inserir_itens_e_baixar_estoque(cursor, venda_id, itens, quantidades)
+        _acumular_resumo_diario(cursor, data_venda, forma_pagamento, usuario_id, total, desconto,
+                                sum(quantidades.values()))
+        _publicar_venda(cursor, venda_id, cliente_id, total, forma_pagamento, data_venda, sum(quantidades.values()))
         
         # Se for venda a prazo, cria conta a receber
-        if forma_pagamento == 'prazo':
-            cursor.execute('''
-                INSERT INTO contas_receber (descricao, valor, data_vencimento, cliente_id, venda_id)
-                VALUES (?, ?, DATE('now', '+30 days'), ?, ?)
-            ''', (f'Venda #{venda_id}', total, cliente_id, venda_id))
-        else:
-            # Se não for a prazo, registrar entrada no caixa (se houver caixa aberto)
-            try:
-                # Verificar se há caixa aberto
-                cursor.execute("SELECT COUNT(*) FROM caixa_sessoes WHERE status = 'aberto'")
-                if cursor.fetchone()[0] > 0:
-                    # Registrar movimentação de entrada no caixa
-                    cliente_nome = "Cliente Avulso"
-                    if cliente_id:
-                        cursor.execute("SELECT nome FROM clientes WHERE id = ?", (cliente_id,))
-                        cliente_result = cursor.fetchone()
-                        if cliente_result:
-                            cliente_nome = cliente_result[0]
-                    
-                    cursor.execute('''
-                        INSERT INTO caixa_movimentacoes (
-                            tipo, categoria, descricao, valor, usuario_id, venda_id
-                        )
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', ('entrada', 'venda', f'Venda #{venda_id} - {cliente_nome}', total, usuario_id, venda_id))
-            except Exception as e:
-                # Se der erro no caixa, não afeta a venda
-                print(f"Aviso: Não foi possível registrar no caixa: {e}")
+        if forma_pagamento == 'prazo':
+            cursor.execute('''
+                INSERT INTO contas_receber (descricao, valor, data_vencimento, cliente_id, venda_id)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (f'Venda #{venda_id}', total, (date.today() + timedelta(days=30)).isoformat(), cliente_id, venda_id))
+        else:
+            # Se não for a prazo, registra o evento de entrada no caixa do terminal na mesma transação
+            _registrar_evento_caixa(cursor, venda_id, terminal)
+        
+        if chave_idempotencia:
+            cursor.execute('''
+                INSERT INTO vendas_idempotencia (chave, venda_id, usuario_id, criada_em)
+                VALUES (?, ?, ?, ?)
+            ''', (chave_idempotencia, venda_id, usuario_id, agora_local()))
         
         conn.commit()
+        _cache_catalogo.recarregar(item['produto_id'] for item in itens)
         return venda_id
         
     except Exception as e:
@@ -1576,7 +2384,7 @@ def registrar_venda(cliente_id, itens, forma_pagamento, desconto=0, observacoes=
 
 def listar_vendas(limit=50):
     """Lista as vendas mais recentes"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -1602,7 +2410,7 @@ def listar_vendas(limit=50):
 
 def obter_venda_por_id(venda_id):
     """Obtém os detalhes completos de uma venda específica"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
@@ -1679,7 +2487,7 @@ def obter_venda_por_id(venda_id):
 
 def limpar_sincronizacoes_incorretas():
     """Remove movimentações de caixa de vendas que não são do dia atual"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
@@ -1691,9 +2499,9 @@ def limpar_sincronizacoes_incorretas():
             SELECT cm.id, cm.venda_id, v.data_venda, cm.valor
             FROM caixa_movimentacoes cm
             JOIN vendas v ON cm.venda_id = v.id
-            WHERE cm.categoria = 'venda'
-            AND SUBSTR(v.data_venda, 1, 10) != ?
-            AND DATE(cm.data_movimentacao) = ?
+            WHERE cm.dia_movimentacao = ?
+            AND cm.categoria = 'venda'
+            AND v.dia_venda != ?
         ''', (hoje, hoje))
         
         movimentacoes_incorretas = cursor.fetchall()
@@ -1717,157 +2525,222 @@ def limpar_sincronizacoes_incorretas():
     finally:
         conn.close()
 
-def sincronizar_vendas_com_caixa():
-    """Sincroniza vendas existentes do dia atual com o caixa (caso não tenham sido registradas)"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+# Outbox do caixa: registrar_venda grava um evento na mesma transação da venda e tenta lançá-lo
+# na hora; o que ficar pendente (caixa fechado, erro) é lançado pelo reconciliador em segundo plano
+RECONCILIADOR_CAIXA_INTERVALO = 30
+EVENTOS_CAIXA_POR_LOTE = 500
+
+_reconciliador_caixa = {'thread': None, 'parar': None, 'intervalo': RECONCILIADOR_CAIXA_INTERVALO, 'pid': None}
+
+def _lancar_eventos_caixa(cursor, evento_ids=None, limite=EVENTOS_CAIXA_POR_LOTE):
+    """Lança no caixa os eventos pendentes (todos ou só os informados); retorna a contagem por resultado"""
+    hoje = hoje_local()
+    filtro = ''
+    parametros = []
+    if evento_ids is not None:
+        filtro = f"AND e.id IN ({', '.join('?' * len(evento_ids))})"
+        parametros = list(evento_ids)
+    cursor.execute(f'''
+        SELECT e.id, v.id, v.total, v.usuario_id, v.dia_venda, c.nome,
+               EXISTS (SELECT 1 FROM caixa_movimentacoes cm WHERE cm.venda_id = e.venda_id),
+               COALESCE(e.terminal, ?)
+        FROM caixa_eventos e
+        LEFT JOIN vendas v ON v.id = e.venda_id
+        LEFT JOIN clientes c ON c.id = v.cliente_id
+        WHERE e.processado_em IS NULL {filtro}
+        ORDER BY e.id
+        LIMIT ?
+    ''', [TERMINAL_PADRAO] + parametros + [limite])
+    eventos = cursor.fetchall()
+    
+    contagem = {'lancados': 0, 'descartados': 0, 'pendentes': 0}
+    if not eventos:
+        return contagem
+    
+    # Cada evento vai para a sessão aberta do seu terminal (uma consulta para o lote inteiro)
+    cursor.execute("SELECT terminal, id FROM caixa_sessoes WHERE status = 'aberto'")
+    sessoes = dict(cursor.fetchall())
     
+    agora = agora_local()
+    movimentacoes = []
+    concluidos = []
+    for evento_id, venda_id, total, usuario_id, dia_venda, cliente_nome, ja_lancada, terminal in eventos:
+        if venda_id is None or dia_venda != hoje:
+            # Venda excluída ou de outro dia: não entra no caixa de hoje
+            concluidos.append((agora, 'descartado', evento_id))
+            contagem['descartados'] += 1
+        elif ja_lancada:
+            concluidos.append((agora, 'lancado', evento_id))
+            contagem['lancados'] += 1
+        elif terminal in sessoes:
+            movimentacoes.append(('entrada', 'venda', f'Venda #{venda_id} - {cliente_nome or "Cliente Avulso"}',
+                                  total, agora, usuario_id, venda_id, sessoes[terminal]))
+            concluidos.append((agora, 'lancado', evento_id))
+            contagem['lancados'] += 1
+        else:
+            # Fica pendente até o caixa do terminal ser aberto (ou o dia virar)
+            contagem['pendentes'] += 1
+    
+    cursor.executemany('''
+        INSERT INTO caixa_movimentacoes (
+            tipo, categoria, descricao, valor, data_movimentacao, usuario_id, venda_id, sessao_id
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', movimentacoes)
+    cursor.executemany("UPDATE caixa_eventos SET processado_em = ?, resultado = ? WHERE id = ?", concluidos)
+    _publicar_movimentacoes_caixa(cursor, movimentacoes)
+    return contagem
+
+def _registrar_evento_caixa(cursor, venda_id, terminal=TERMINAL_PADRAO):
+    """Grava o evento de caixa da venda (na transação da venda) e tenta lançá-lo imediatamente"""
+    cursor.execute("INSERT INTO caixa_eventos (venda_id, criado_em, terminal) VALUES (?, ?, ?)",
+                   (venda_id, agora_local(), _normalizar_terminal(terminal)))
+    evento_id = cursor.lastrowid
+    
+    # Savepoint: uma falha no lançamento não desfaz a venda, o evento apenas continua pendente
+    cursor.execute("SAVEPOINT lancamento_caixa")
     try:
-        # Verificar se há caixa aberto
-        cursor.execute("SELECT COUNT(*) FROM caixa_sessoes WHERE status = 'aberto'")
-        if cursor.fetchone()[0] == 0:
-            conn.close()
-            return False, "Não há caixa aberto"
-        
-        # Usar data específica do dia atual
-        from datetime import date
-        hoje = date.today().strftime('%Y-%m-%d')
-        
-        # Buscar vendas especificamente do dia atual que não estão no caixa
-        cursor.execute('''
-            SELECT v.id, v.cliente_id, v.total, v.forma_pagamento, v.usuario_id, v.data_venda
-            FROM vendas v
-            WHERE SUBSTR(v.data_venda, 1, 10) = ?
-            AND v.forma_pagamento != 'prazo'
-            AND NOT EXISTS (
-                SELECT 1 FROM caixa_movimentacoes cm 
-                WHERE cm.venda_id = v.id
-            )
-        ''', (hoje,))
-        
-        vendas_nao_sincronizadas = cursor.fetchall()
-        
-        print(f"DEBUG SYNC: Sincronizando vendas do dia {hoje}")
-        print(f"DEBUG SYNC: Encontradas {len(vendas_nao_sincronizadas)} vendas para sincronizar")
-        
-        vendas_sincronizadas = 0
-        
-        for venda in vendas_nao_sincronizadas:
-            venda_id, cliente_id, total, forma_pagamento, usuario_id, data_venda = venda
-            
-            # Verificar novamente se a venda é realmente de hoje
-            data_venda_formatada = data_venda[:10] if data_venda else ''
-            if data_venda_formatada != hoje:
-                print(f"DEBUG SYNC: Venda #{venda_id} ignorada - Data: {data_venda_formatada} ≠ {hoje}")
-                continue
-            
-            # Buscar nome do cliente
-            cliente_nome = "Cliente Avulso"
-            if cliente_id:
-                cursor.execute("SELECT nome FROM clientes WHERE id = ?", (cliente_id,))
-                cliente_result = cursor.fetchone()
-                if cliente_result:
-                    cliente_nome = cliente_result[0]
-            
-            # Registrar no caixa
-            cursor.execute('''
-                INSERT INTO caixa_movimentacoes (
-                    tipo, categoria, descricao, valor, usuario_id, venda_id
-                )
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', ('entrada', 'venda', f'Venda #{venda_id} - {cliente_nome}', total, usuario_id, venda_id))
+        _lancar_eventos_caixa(cursor, [evento_id])
+        cursor.execute("RELEASE lancamento_caixa")
+    except Exception as e:
+        cursor.execute("ROLLBACK TO lancamento_caixa")
+        cursor.execute("RELEASE lancamento_caixa")
+        print(f"Aviso: Não foi possível registrar no caixa: {e}")
+
+def processar_eventos_caixa(limite=EVENTOS_CAIXA_POR_LOTE):
+    """Lança no caixa os eventos de venda pendentes; só pega o lock de escrita se houver pendências"""
+    with conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM caixa_eventos WHERE processado_em IS NULL LIMIT 1")
+        if cursor.fetchone() is None:
+            return {'lancados': 0, 'descartados': 0, 'pendentes': 0}
+        
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            contagem = _lancar_eventos_caixa(cursor, limite=limite)
+            conn.commit()
+            return contagem
+        except Exception:
+            conn.rollback()
+            raise
+
+def _executar_reconciliador_caixa(parar, intervalo):
+    """Laço do reconciliador: processa os eventos pendentes a cada intervalo"""
+    while not parar.wait(intervalo):
+        try:
+            processar_eventos_caixa()
+        except Exception as e:
+            print(f"Erro no reconciliador do caixa: {e}")
+
+def iniciar_reconciliador_caixa(intervalo=RECONCILIADOR_CAIXA_INTERVALO):
+    """Inicia (uma vez por processo) a thread que lança no caixa os eventos de venda pendentes"""
+    atual = _reconciliador_caixa['thread']
+    if atual is not None and atual.is_alive() and _reconciliador_caixa['pid'] == os.getpid():
+        return False
+    
+    parar = threading.Event()
+    thread = threading.Thread(target=_executar_reconciliador_caixa, args=(parar, intervalo),
+                              name='reconciliador-caixa', daemon=True)
+    _reconciliador_caixa.update(thread=thread, parar=parar, intervalo=intervalo, pid=os.getpid())
+    thread.start()
+    return True
+
+def parar_reconciliador_caixa():
+    """Interrompe a thread do reconciliador do caixa"""
+    if _reconciliador_caixa['parar'] is not None:
+        _reconciliador_caixa['parar'].set()
+    _reconciliador_caixa['thread'] = None
+
+def _reiniciar_reconciliador_apos_fork():
+    """Threads não sobrevivem ao fork: o processo filho (worker) inicia o seu próprio reconciliador"""
+    if _reconciliador_caixa['thread'] is not None:
+        _reconciliador_caixa['thread'] = None
+        iniciar_reconciliador_caixa(_reconciliador_caixa['intervalo'])
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reiniciar_reconciliador_apos_fork)
+
+def sincronizar_vendas_com_caixa(terminal=TERMINAL_PADRAO):
+    """Reparo manual: enfileira no terminal as vendas à vista de hoje sem lançamento no caixa e processa os eventos pendentes"""
+    terminal = _normalizar_terminal(terminal)
+    try:
+        with conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1 FROM caixa_sessoes WHERE status = 'aberto' AND terminal = ?", (terminal,))
+            if cursor.fetchone() is None:
+                return False, "Não há caixa aberto neste terminal"
             
-            vendas_sincronizadas += 1
-            print(f"DEBUG SYNC: ✓ Venda #{venda_id} sincronizada - R$ {total}")
-        
-        conn.commit()
-        print(f"DEBUG SYNC: Total sincronizado: {vendas_sincronizadas} vendas de {hoje}")
-        return True, f"Sincronizadas {vendas_sincronizadas} vendas do dia atual"
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute('''
+                    INSERT INTO caixa_eventos (venda_id, criado_em, terminal)
+                    SELECT v.id, ?, ? FROM vendas v
+                    WHERE v.dia_venda = ?
+                    AND v.forma_pagamento != 'prazo'
+                    AND NOT EXISTS (SELECT 1 FROM caixa_movimentacoes cm WHERE cm.venda_id = v.id)
+                    AND NOT EXISTS (
+                        SELECT 1 FROM caixa_eventos e
+                        WHERE e.venda_id = v.id AND e.processado_em IS NULL
+                    )
+                ''', (agora_local(), terminal, hoje_local()))
+                contagem = _lancar_eventos_caixa(cursor)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        
+        return True, f"Sincronizadas {contagem['lancados']} vendas do dia atual"
         
     except Exception as e:
-        print(f"DEBUG SYNC: Erro ao sincronizar: {str(e)}")
         return False, f"Erro ao sincronizar: {str(e)}"
-    finally:
-        conn.close()
 
 def obter_vendas_do_dia():
     """Obtém as vendas do dia atual"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Limpar sincronizações incorretas primeiro
-    limpar_sincronizacoes_incorretas()
-    
-    # Sincronizar vendas do dia atual com o caixa
-    sincronizar_vendas_com_caixa()
-    
-    # Usar data específica do dia atual
-    from datetime import date
-    hoje = date.today().strftime('%Y-%m-%d')
-    
-    print(f"DEBUG VENDAS: Buscando vendas para {hoje}")
-    
-    # Buscar vendas especificamente do dia atual usando SUBSTR para garantir precisão
-    cursor.execute('''
-        SELECT v.id, c.nome, v.total, v.forma_pagamento, v.data_venda,
-               COALESCE(SUM(iv.quantidade), 0) as total_itens,
-               u.nome_completo as funcionario_nome, u.username as funcionario_username,
-               v.usuario_id
-        FROM vendas v
-        LEFT JOIN clientes c ON v.cliente_id = c.id
-        LEFT JOIN itens_venda iv ON v.id = iv.venda_id
-        LEFT JOIN usuarios u ON v.usuario_id = u.id
-        WHERE SUBSTR(v.data_venda, 1, 10) = ?
-        GROUP BY v.id, c.nome, v.total, v.forma_pagamento, v.data_venda, u.nome_completo, u.username, v.usuario_id
-        ORDER BY v.data_venda DESC
-    ''', (hoje,))
-    
-    vendas_encontradas = cursor.fetchall()
+    with conexao() as conn:
+        # Buscar vendas do dia atual pelo dia comercial (coluna indexada)
+        vendas_encontradas = conn.execute('''
+            SELECT v.id, c.nome, v.total, v.forma_pagamento, v.data_venda,
+                   COALESCE(SUM(iv.quantidade), 0) as total_itens,
+                   u.nome_completo as funcionario_nome, u.username as funcionario_username,
+                   v.usuario_id
+            FROM vendas v
+            LEFT JOIN clientes c ON v.cliente_id = c.id
+            LEFT JOIN itens_venda iv ON v.id = iv.venda_id
+            LEFT JOIN usuarios u ON v.usuario_id = u.id
+            WHERE v.dia_venda = ?
+            GROUP BY v.id, c.nome, v.total, v.forma_pagamento, v.data_venda, u.nome_completo, u.username, v.usuario_id
+            ORDER BY v.data_venda DESC
+        ''', (hoje_local(),)).fetchall()
     
     vendas = []
     total_valor = 0
     total_itens = 0
-    
-    print(f"DEBUG VENDAS: Vendas encontradas para {hoje}:")
     for row in vendas_encontradas:
-        # Verificar se a data da venda realmente corresponde ao dia atual
-        data_venda = row[4][:10] if row[4] else ''
-        
-        if data_venda == hoje:
-            venda = {
-                'id': row[0],
-                'cliente': row[1] or 'Cliente Avulso',
-                'total': row[2],
-                'forma_pagamento': row[3],
-                'data_venda': row[4],
-                'total_itens': row[5] or 0,
-                'funcionario_nome': row[6] or 'Sem funcionário',
-                'funcionario_username': row[7] or '',
-                'usuario_id': row[8]
-            }
-            vendas.append(venda)
-            total_valor += row[2]
-            total_itens += row[5] or 0
-            print(f"  ✓ Venda #{row[0]}: R$ {row[2]}, Data: {row[4]}, Itens: {row[5]}, Funcionário: {row[6] or 'N/A'}")
-        else:
-            print(f"  ✗ Venda #{row[0]} ignorada - Data: {data_venda} ≠ {hoje}")
+        vendas.append({
+            'id': row[0],
+            'cliente': row[1] or 'Cliente Avulso',
+            'total': row[2],
+            'forma_pagamento': row[3],
+            'data_venda': row[4],
+            'total_itens': row[5] or 0,
+            'funcionario_nome': row[6] or 'Sem funcionário',
+            'funcionario_username': row[7] or '',
+            'usuario_id': row[8]
+        })
+        total_valor += row[2]
+        total_itens += row[5] or 0
     
-    resultado = {
+    return {
         'vendas': vendas,
         'total_vendas': len(vendas),
         'valor_total': total_valor,
         'itens_vendidos': total_itens
     }
-    
-    print(f"DEBUG VENDAS: Resultado final para {hoje}: {resultado}")
-    
-    conn.close()
-    return resultado
 
 # FUNÇÕES DE CONTAS A PAGAR
 def listar_contas_pagar_hoje():
     """Lista contas a pagar com vencimento hoje"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -1875,9 +2748,9 @@ def listar_contas_pagar_hoje():
                f.nome as fornecedor_nome
         FROM contas_pagar cp
         LEFT JOIN fornecedores f ON cp.fornecedor_id = f.id
-        WHERE date(cp.data_vencimento) = date('now') AND cp.status = 'pendente'
+        WHERE cp.status = 'pendente' AND cp.data_vencimento = ?
         ORDER BY cp.valor DESC
-    ''')
+    ''', (hoje_local(),))
     
     contas = []
     for row in cursor.fetchall():
@@ -1897,34 +2770,41 @@ def listar_contas_pagar_hoje():
 
 def listar_contas_pagar_por_periodo(filtro='todos', data_inicio=None, data_fim=None, status='pendente'):
     """Lista contas a pagar com filtros de período"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     base_query = '''
         SELECT cp.id, cp.descricao, cp.valor, cp.data_vencimento, cp.status, cp.categoria, cp.observacoes,
                f.nome as fornecedor_nome,
-               julianday(cp.data_vencimento) - julianday('now') as dias_restantes,
+               julianday(cp.data_vencimento) - julianday(?) as dias_restantes,
                cp.data_pagamento
         FROM contas_pagar cp
         LEFT JOIN fornecedores f ON cp.fornecedor_id = f.id
         WHERE cp.status = ?
     '''
     
-    params = [status]
+    # Vencimentos são datas locais 'YYYY-MM-DD': comparação direta usa o índice (status, data_vencimento)
+    hoje = date.today()
+    params = [hoje.isoformat(), status]
     
     if filtro == 'hoje':
-        base_query += " AND date(cp.data_vencimento) = date('now')"
+        base_query += " AND cp.data_vencimento = ?"
+        params.append(hoje.isoformat())
     elif filtro == 'atrasadas':
-        base_query += " AND date(cp.data_vencimento) < date('now')"
+        base_query += " AND cp.data_vencimento < ?"
+        params.append(hoje.isoformat())
     elif filtro == 'futuras':
-        base_query += " AND date(cp.data_vencimento) > date('now')"
+        base_query += " AND cp.data_vencimento > ?"
+        params.append(hoje.isoformat())
     elif filtro == 'proximos_7_dias':
-        base_query += " AND date(cp.data_vencimento) BETWEEN date('now') AND date('now', '+7 days')"
+        base_query += " AND cp.data_vencimento BETWEEN ? AND ?"
+        params.extend([hoje.isoformat(), (hoje + timedelta(days=7)).isoformat()])
     elif filtro == 'proximos_30_dias':
-        base_query += " AND date(cp.data_vencimento) BETWEEN date('now') AND date('now', '+30 days')"
+        base_query += " AND cp.data_vencimento BETWEEN ? AND ?"
+        params.extend([hoje.isoformat(), (hoje + timedelta(days=30)).isoformat()])
     elif filtro == 'personalizado' and data_inicio and data_fim:
-        base_query += " AND date(cp.data_vencimento) BETWEEN ? AND ?"
-        params.extend([data_inicio, data_fim])
+        base_query += " AND cp.data_vencimento BETWEEN ? AND ?"
+        params.extend([data_inicio[:10], data_fim[:10]])
     
     base_query += " ORDER BY cp.data_vencimento"
     
@@ -1959,7 +2839,7 @@ def listar_contas_pagar_por_periodo(filtro='todos', data_inicio=None, data_fim=N
 
 def adicionar_conta_pagar(descricao, valor, data_vencimento, categoria=None, observacoes=None, fornecedor_id=None, auto_sincronizar=True):
     """Adiciona uma nova conta a pagar"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
@@ -1996,7 +2876,7 @@ def pagar_conta(conta_id, data_pagamento=None):
     if not data_pagamento:
         data_pagamento = date.today().isoformat()
     
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -2011,16 +2891,16 @@ def pagar_conta(conta_id, data_pagamento=None):
 # FUNÇÕES DE CONTAS A RECEBER
 def listar_contas_receber_hoje():
     """Lista contas a receber com vencimento hoje"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
         SELECT cr.id, cr.descricao, cr.valor, cr.data_vencimento, cr.status, c.nome
         FROM contas_receber cr
         LEFT JOIN clientes c ON cr.cliente_id = c.id
-        WHERE date(cr.data_vencimento) = date('now') AND cr.status = 'pendente'
+        WHERE cr.status = 'pendente' AND cr.data_vencimento = ?
         ORDER BY cr.valor DESC
-    ''')
+    ''', (hoje_local(),))
     
     contas = []
     for row in cursor.fetchall():
@@ -2038,33 +2918,40 @@ def listar_contas_receber_hoje():
 
 def listar_contas_receber_por_periodo(filtro='todos', data_inicio=None, data_fim=None, status='pendente'):
     """Lista contas a receber com filtros de período"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     base_query = '''
         SELECT cr.id, cr.descricao, cr.valor, cr.data_vencimento, cr.status, c.nome,
-               julianday(cr.data_vencimento) - julianday('now') as dias_restantes,
+               julianday(cr.data_vencimento) - julianday(?) as dias_restantes,
                cr.data_recebimento
         FROM contas_receber cr
         LEFT JOIN clientes c ON cr.cliente_id = c.id
         WHERE cr.status = ?
     '''
     
-    params = [status]
+    # Vencimentos são datas locais 'YYYY-MM-DD': comparação direta usa o índice (status, data_vencimento)
+    hoje = date.today()
+    params = [hoje.isoformat(), status]
     
     if filtro == 'hoje':
-        base_query += " AND date(cr.data_vencimento) = date('now')"
+        base_query += " AND cr.data_vencimento = ?"
+        params.append(hoje.isoformat())
     elif filtro == 'atrasadas':
-        base_query += " AND date(cr.data_vencimento) < date('now')"
+        base_query += " AND cr.data_vencimento < ?"
+        params.append(hoje.isoformat())
     elif filtro == 'futuras':
-        base_query += " AND date(cr.data_vencimento) > date('now')"
+        base_query += " AND cr.data_vencimento > ?"
+        params.append(hoje.isoformat())
     elif filtro == 'proximos_7_dias':
-        base_query += " AND date(cr.data_vencimento) BETWEEN date('now') AND date('now', '+7 days')"
+        base_query += " AND cr.data_vencimento BETWEEN ? AND ?"
+        params.extend([hoje.isoformat(), (hoje + timedelta(days=7)).isoformat()])
     elif filtro == 'proximos_30_dias':
-        base_query += " AND date(cr.data_vencimento) BETWEEN date('now') AND date('now', '+30 days')"
+        base_query += " AND cr.data_vencimento BETWEEN ? AND ?"
+        params.extend([hoje.isoformat(), (hoje + timedelta(days=30)).isoformat()])
     elif filtro == 'personalizado' and data_inicio and data_fim:
-        base_query += " AND date(cr.data_vencimento) BETWEEN ? AND ?"
-        params.extend([data_inicio, data_fim])
+        base_query += " AND cr.data_vencimento BETWEEN ? AND ?"
+        params.extend([data_inicio[:10], data_fim[:10]])
     
     base_query += " ORDER BY cr.data_vencimento"
     
@@ -2100,7 +2987,7 @@ def receber_conta(conta_id, data_recebimento=None):
     if not data_recebimento:
         data_recebimento = date.today().isoformat()
     
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -2114,7 +3001,7 @@ def receber_conta(conta_id, data_recebimento=None):
 
 def adicionar_conta_receber(descricao, valor, data_vencimento, cliente_id=None, observacoes=None, auto_sincronizar=True):
     """Adiciona uma nova conta a receber"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
@@ -2148,86 +3035,74 @@ def adicionar_conta_receber(descricao, valor, data_vencimento, cliente_id=None,
 
 # FUNÇÕES DE ESTATÍSTICAS
 def obter_estatisticas_dashboard():
-    """Obtém estatísticas para o dashboard"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Total de produtos
-    cursor.execute("SELECT COUNT(*) FROM produtos WHERE ativo = 1")
-    total_produtos = cursor.fetchone()[0]
-    
-    # Total de clientes
-    cursor.execute("SELECT COUNT(*) FROM clientes")
-    total_clientes = cursor.fetchone()[0]
-    
-    # Total de fornecedores
-    cursor.execute("SELECT COUNT(*) FROM fornecedores WHERE ativo = 1")
-    total_fornecedores = cursor.fetchone()[0]
-    
-    # Valor do estoque
-    cursor.execute("SELECT SUM(preco * estoque) FROM produtos WHERE ativo = 1")
-    valor_estoque = cursor.fetchone()[0] or 0
-    
-    # Produtos com estoque baixo
-    cursor.execute("SELECT COUNT(*) FROM produtos WHERE ativo = 1 AND estoque <= estoque_minimo")
-    produtos_estoque_baixo = cursor.fetchone()[0]
-    
-    # Produtos sem estoque
-    cursor.execute("SELECT COUNT(*) FROM produtos WHERE ativo = 1 AND estoque <= 0")
-    produtos_sem_estoque = cursor.fetchone()[0]
-    
-    # Vendas do mês
-    cursor.execute('''
-        SELECT COUNT(*), SUM(total) 
-        FROM vendas 
-        WHERE strftime('%Y-%m', data_venda) = strftime('%Y-%m', 'now')
-    ''')
-    vendas_mes = cursor.fetchone()
-    
-    # Vendas do dia
-    cursor.execute('''
-        SELECT COUNT(*), SUM(total) 
-        FROM vendas 
-        WHERE date(data_venda) = date('now')
-    ''')
-    vendas_dia = cursor.fetchone()
-    
-    # Contas a receber em atraso
-    cursor.execute('''
-        SELECT SUM(valor) 
-        FROM contas_receber 
-        WHERE date(data_vencimento) < date('now') AND status = 'pendente'
-    ''')
-    valor_atraso_receber = cursor.fetchone()[0] or 0
+    """Obtém estatísticas para o dashboard (uma passada agregada por tabela)"""
+    hoje = date.today()
     
-    # Contas a pagar em atraso
-    cursor.execute('''
-        SELECT SUM(valor) 
-        FROM contas_pagar 
-        WHERE date(data_vencimento) < date('now') AND status = 'pendente'
-    ''')
-    valor_atraso_pagar = cursor.fetchone()[0] or 0
-    
-    conn.close()
+    with conexao() as conn:
+        cursor = conn.cursor()
+        
+        # Produtos: totais, valor do estoque e alertas de estoque em uma leitura
+        cursor.execute('''
+            SELECT COUNT(*),
+                   SUM(preco * estoque),
+                   SUM(CASE WHEN estoque <= estoque_minimo THEN 1 ELSE 0 END),
+                   SUM(CASE WHEN estoque <= 0 THEN 1 ELSE 0 END)
+            FROM produtos
+            WHERE ativo = 1
+        ''')
+        total_produtos, valor_estoque, produtos_estoque_baixo, produtos_sem_estoque = cursor.fetchone()
+        
+        # Cadastros e contas em atraso (índices de status/vencimento)
+        cursor.execute('''
+            SELECT (SELECT COUNT(*) FROM clientes),
+                   (SELECT COUNT(*) FROM fornecedores WHERE ativo = 1),
+                   (SELECT SUM(valor) FROM contas_receber WHERE status = 'pendente' AND data_vencimento < ?),
+                   (SELECT SUM(valor) FROM contas_pagar WHERE status = 'pendente' AND data_vencimento < ?)
+        ''', (hoje.isoformat(), hoje.isoformat()))
+        total_clientes, total_fornecedores, valor_atraso_receber, valor_atraso_pagar = cursor.fetchone()
+        
+        # Vendas do mês e do dia (resumo diário: no máximo algumas linhas por dia do mês)
+        cursor.execute('''
+            SELECT SUM(quantidade_vendas), SUM(valor_total),
+                   SUM(CASE WHEN dia = ? THEN quantidade_vendas END),
+                   SUM(CASE WHEN dia = ? THEN valor_total END)
+            FROM vendas_resumo_diario 
+            WHERE dia BETWEEN ? AND ?
+        ''', (hoje.isoformat(), hoje.isoformat(), hoje.replace(day=1).isoformat(), hoje.isoformat()))
+        vendas_mes_quantidade, vendas_mes_valor, vendas_dia_quantidade, vendas_dia_valor = cursor.fetchone()
     
     return {
         'total_produtos': total_produtos,
         'total_clientes': total_clientes,
         'total_fornecedores': total_fornecedores,
-        'valor_estoque': valor_estoque,
-        'produtos_estoque_baixo': produtos_estoque_baixo,
-        'produtos_sem_estoque': produtos_sem_estoque,
-        'vendas_mes_quantidade': vendas_mes[0] or 0,
-        'vendas_mes_valor': vendas_mes[1] or 0,
-        'vendas_dia_quantidade': vendas_dia[0] or 0,
-        'vendas_dia_valor': vendas_dia[1] or 0,
-        'valor_atraso_receber': valor_atraso_receber,
-        'valor_atraso_pagar': valor_atraso_pagar
+        'valor_estoque': valor_estoque or 0,
+        'produtos_estoque_baixo': produtos_estoque_baixo or 0,
+        'produtos_sem_estoque': produtos_sem_estoque or 0,
+        'vendas_mes_quantidade': vendas_mes_quantidade or 0,
+        'vendas_mes_valor': vendas_mes_valor or 0,
+        'vendas_dia_quantidade': vendas_dia_quantidade or 0,
+        'vendas_dia_valor': vendas_dia_valor or 0,
+        'valor_atraso_receber': valor_atraso_receber or 0,
+        'valor_atraso_pagar': valor_atraso_pagar or 0
     }
 
+# Painéis do dashboard carregados individualmente pela página (cada um com seu endpoint JSON)
+PAINEIS_DASHBOARD = {
+    'kpis': lambda: obter_estatisticas_dashboard(),
+    'estoque_baixo': lambda: produtos_estoque_baixo(),
+    'vendas_recentes': lambda: listar_vendas(limit=10),
+    'contas_hoje': lambda: {'pagar': listar_contas_pagar_hoje(), 'receber': listar_contas_receber_hoje()},
+}
+
+def obter_painel_dashboard(painel):
+    """Dados de um painel do dashboard, em cache por processo (invalidado por escritas via registro de alterações)"""
+    if painel not in PAINEIS_DASHBOARD:
+        raise KeyError(painel)
+    return _cache_dashboard.obter((painel, hoje_local()), PAINEIS_DASHBOARD[painel])
+
 def produtos_estoque_baixo():
     """Lista produtos com estoque baixo"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -2260,7 +3135,7 @@ def gerar_numero_orcamento():
 
 def criar_orcamento(itens, cliente_id=None, desconto=0, observacoes="", usuario_id=None):
     """Cria um novo orçamento"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
@@ -2298,36 +3173,38 @@ def criar_orcamento(itens, cliente_id=None, desconto=0, observacoes="", usuario_
     finally:
         conn.close()
 
+COLUNAS_ORCAMENTO = 'o.id, o.numero_orcamento, o.total, o.status, o.created_at, c.nome'
+
+def _orcamento_de_linha(row):
+    """Converte uma linha com COLUNAS_ORCAMENTO em dicionário"""
+    return {
+        'id': row[0],
+        'numero_orcamento': row[1],
+        'total': row[2],
+        'status': row[3],
+        'created_at': row[4],
+        'cliente_nome': row[5] or 'Cliente não informado'
+    }
+
 def listar_orcamentos():
     """Lista todos os orçamentos"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT o.id, o.numero_orcamento, o.total, o.status, o.created_at,
-               c.nome as cliente_nome
+    cursor.execute(f'''
+        SELECT {COLUNAS_ORCAMENTO}
         FROM orcamentos o
         LEFT JOIN clientes c ON o.cliente_id = c.id
         ORDER BY o.created_at DESC
     ''')
-    
-    orcamentos = []
-    for row in cursor.fetchall():
-        orcamentos.append({
-            'id': row[0],
-            'numero_orcamento': row[1],
-            'total': row[2],
-            'status': row[3],
-            'created_at': row[4],
-            'cliente_nome': row[5] or 'Cliente não informado'
-        })
+    orcamentos = [_orcamento_de_linha(row) for row in cursor.fetchall()]
     
     conn.close()
     return orcamentos
 
 def obter_orcamento(orcamento_id):
     """Obtém um orçamento específico com seus itens"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     # Buscar orçamento
@@ -2392,7 +3269,7 @@ def obter_orcamento(orcamento_id):
 
 def atualizar_orcamento(orcamento_id, itens, cliente_id=None, desconto=0, observacoes=""):
     """Atualiza um orçamento existente"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
@@ -2442,7 +3319,7 @@ def atualizar_orcamento(orcamento_id, itens, cliente_id=None, desconto=0, observ
 
 def excluir_orcamento(orcamento_id):
     """Exclui um orçamento e seus itens"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
@@ -2472,49 +3349,51 @@ def excluir_orcamento(orcamento_id):
     finally:
         conn.close()
 
-def converter_orcamento_em_venda(orcamento_id, forma_pagamento):
+def converter_orcamento_em_venda(orcamento_id, forma_pagamento, terminal=TERMINAL_PADRAO):
     """Converte um orçamento aprovado em venda"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
-        # Buscar orçamento
+        cursor.execute("BEGIN IMMEDIATE")
+        # Reserva o orçamento antes de tudo: um segundo envio (clique duplo) não gera outra venda
+        cursor.execute('''
+            UPDATE orcamentos 
+            SET status = 'convertido' 
+            WHERE id = ? AND status <> 'convertido'
+        ''', (orcamento_id,))
+        if cursor.rowcount == 0:
+            cursor.execute("SELECT 1 FROM orcamentos WHERE id = ?", (orcamento_id,))
+            if cursor.fetchone() is None:
+                raise ValueError("Orçamento não encontrado")
+            raise ValueError("Orçamento já foi convertido em venda")
+        
+        # Lido com o lock de escrita: os itens não mudam até o commit
         orcamento = obter_orcamento(orcamento_id)
-        if not orcamento:
-            raise ValueError("Orçamento não encontrado")
+        quantidades = _verificar_estoque_itens(cursor, orcamento['itens'])
         
         # Criar venda
+        data_venda = agora_local()
         cursor.execute('''
-            INSERT INTO vendas (cliente_id, total, forma_pagamento, desconto, observacoes, usuario_id)
-            VALUES (?, ?, ?, ?, ?, ?)
+            INSERT INTO vendas (cliente_id, total, forma_pagamento, desconto, observacoes, data_venda, usuario_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', (orcamento['cliente_id'], orcamento['total'], forma_pagamento, 
-              orcamento['desconto'], orcamento['observacoes'], orcamento['usuario_id']))
+              orcamento['desconto_valor'], orcamento['observacoes'], data_venda, orcamento['usuario_id']))
         
         venda_id = cursor.lastrowid
         
-        # Copiar itens para venda
-        for item in orcamento['itens']:
-            cursor.execute('''
-                INSERT INTO itens_venda (venda_id, produto_id, quantidade, preco_unitario, subtotal)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (venda_id, item['produto_id'], item['quantidade'], 
-                  item['preco_unitario'], item['subtotal']))
-            
-            # Atualizar estoque
-            cursor.execute('''
-                UPDATE produtos 
-                SET estoque = estoque - ? 
-                WHERE id = ?
-            ''', (item['quantidade'], item['produto_id']))
+        # Copiar itens para venda e baixar estoque
+        _inserir_itens_e_baixar_estoque(cursor, venda_id, orcamento['itens'], quantidades)
+        _acumular_resumo_diario(cursor, data_venda, forma_pagamento, orcamento['usuario_id'],
+                                orcamento['total'], orcamento['desconto_valor'], sum(quantidades.values()))
+        _publicar_venda(cursor, venda_id, orcamento['cliente_id'], orcamento['total'], forma_pagamento,
+                        data_venda, sum(quantidades.values()))
         
-        # Atualizar status do orçamento
-        cursor.execute('''
-            UPDATE orcamentos 
-            SET status = 'convertido' 
-            WHERE id = ?
-        ''', (orcamento_id,))
+        if forma_pagamento != 'prazo':
+            _registrar_evento_caixa(cursor, venda_id, terminal)
         
         conn.commit()
+        _cache_catalogo.recarregar(item['produto_id'] for item in orcamento['itens'])
         return venda_id
     except Exception as e:
         conn.rollback()
@@ -2566,160 +3445,359 @@ def mapear_ncm_para_categoria(ncm):
     elif ncm_clean.startswith("84") or ncm_clean.startswith("85"):
         return "Componentes Mecânicos"
     elif ncm_clean.startswith("87"):
-        return "Peças Automotivas"
-    else:
-        return "Geral"
-
-def importar_produtos_de_xml_avancado(conteudo_xml, margem_padrao=100, estoque_minimo=5, usar_preco_nfe=True, acao_existente='atualizar_estoque'):
-    """
-    Importa produtos de um arquivo XML de NFe com configurações avançadas
-    
-    Args:
-        conteudo_xml: Conteúdo do arquivo XML como string
-        margem_padrao: Margem de lucro padrão (%)
-        estoque_minimo: Estoque mínimo padrão
-        usar_preco_nfe: Se deve usar preço da NFe como custo
-        acao_existente: 'atualizar_estoque', 'substituir_dados' ou 'ignorar'
-    """
-    import xml.etree.ElementTree as ET
-    
-    produtos_importados = 0
-    produtos_atualizados = 0
-    produtos_ignorados = 0
-    erros = []
-    
-    try:
-        # Parse do XML
-        root = ET.fromstring(conteudo_xml)
-        
-        # Namespace da NFe
-        ns = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
-        
-        # Buscar todos os produtos (det)
-        produtos_xml = root.findall('.//nfe:det', ns)
-        
-        if not produtos_xml:
-            raise ValueError("Nenhum produto encontrado no XML")
-        
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        for det in produtos_xml:
-            try:
-                # Extrair dados do produto
-                prod = det.find('nfe:prod', ns)
-                if prod is None:
-                    continue
-                
-                # Dados básicos do produto
-                codigo_produto = prod.find('nfe:cProd', ns)
-                codigo_produto = codigo_produto.text if codigo_produto is not None else ''
-                
-                codigo_ean = prod.find('nfe:cEAN', ns)
-                codigo_ean = codigo_ean.text if codigo_ean is not None else ''
-                if codigo_ean in ['SEM GTIN', '']:
-                    codigo_ean = ''
-                
-                nome_produto = prod.find('nfe:xProd', ns)
-                nome_produto = nome_produto.text if nome_produto is not None else ''
-                
-                valor_unitario = prod.find('nfe:vUnCom', ns)
-                valor_unitario = float(valor_unitario.text) if valor_unitario is not None else 0.0
-                
-                quantidade = prod.find('nfe:qCom', ns)
-                quantidade = int(float(quantidade.text)) if quantidade is not None else 0
-                
-                ncm = prod.find('nfe:NCM', ns)
-                ncm = ncm.text if ncm is not None else ''
-                
-                unidade = prod.find('nfe:uCom', ns)
-                unidade = unidade.text if unidade is not None else 'UN'
-                
-                if not nome_produto:
-                    erros.append(f"Produto sem nome encontrado (código: {codigo_produto})")
-                    continue
-                
-                # Calcular preços
-                preco_custo = valor_unitario if usar_preco_nfe else 0.0
-                preco_venda = preco_custo + (preco_custo * margem_padrao / 100) if preco_custo > 0 else 0.0
-                
-                # Determinar categoria baseada no NCM
-                categoria = obter_categoria_por_ncm_avancado(ncm) if ncm else "Geral"
-                
-                # Verificar se produto já existe (por código de barras ou código do produto)
-                produto_existente = None
-                if codigo_ean:
-                    cursor.execute('''
-                        SELECT id, nome, preco, estoque 
-                        FROM produtos 
-                        WHERE codigo_barras = ?
-                    ''', (codigo_ean,))
-                    produto_existente = cursor.fetchone()
-                
-                if not produto_existente and codigo_produto:
-                    cursor.execute('''
-                        SELECT id, nome, preco, estoque 
-                        FROM produtos 
-                        WHERE codigo_fornecedor = ? OR nome LIKE ?
-                    ''', (codigo_produto, f'%{codigo_produto}%'))
-                    produto_existente = cursor.fetchone()
-                
-                if produto_existente:
-                    if acao_existente == 'ignorar':
-                        produtos_ignorados += 1
-                        continue
-                    elif acao_existente == 'atualizar_estoque':
-                        # Atualizar apenas estoque
-                        produto_id = produto_existente[0]
-                        novo_estoque = produto_existente[3] + quantidade
-                        cursor.execute('''
-                            UPDATE produtos 
-                            SET estoque = ?
-                            WHERE id = ?
-                        ''', (novo_estoque, produto_id))
-                        produtos_atualizados += 1
+        return "Peças Automotivas"
+    else:
+        return "Geral"
+
+# IMPORTAÇÃO DE NFe EM FLUXO
+# Os itens (det) são lidos com iterparse direto do arquivo enviado e descartados logo
+# depois de lidos; a gravação é feita em lotes com executemany. A memória usada não
+# depende do tamanho do XML (notas de distribuidor com milhares de itens, arquivos em lote).
+# Os produtos já cadastrados são localizados por um índice em memória carregado uma vez
+# por importação (código de barras e código do fornecedor normalizado), sem SELECT por item.
+NS_NFE = '{http://www.portalfiscal.inf.br/nfe}'
+TAMANHO_LOTE_IMPORTACAO_NFE = 500
+ACOES_PRODUTO_EXISTENTE_NFE = ('atualizar_estoque', 'substituir_dados', 'ignorar')
+
+class _LeitorComHash:
+    """Envolve o arquivo lido pelo iterparse calculando o SHA-256 do conteúdo à medida que é lido"""
+
+    def __init__(self, arquivo):
+        self.arquivo = arquivo
+        self.hash = hashlib.sha256()
+
+    def read(self, tamanho=-1):
+        dados = self.arquivo.read(tamanho)
+        self.hash.update(dados if isinstance(dados, bytes) else dados.encode('utf-8'))
+        return dados
+
+def _chave_acesso_nfe(identificador):
+    """Chave de acesso (44 dígitos) do atributo Id de <infNFe> ('NFe3519...'), ou None"""
+    digitos = re.sub(r'\D', '', identificador or '')
+    return digitos if len(digitos) == 44 else None
+
+def iterar_itens_nfe(origem_xml, cabecalho=None, nota_ja_importada=None):
+    """Gera os campos de <prod> de cada item da NFe ({'cProd': ..., 'xProd': ...}) lendo o XML em fluxo
+
+    origem_xml pode ser um arquivo aberto (binário), o caminho, bytes ou o texto do XML.
+    Se cabecalho for um dicionário, recebe 'cnpj_emitente'/'nome_emitente' assim que <emit> é
+    lido e 'chave_acesso' assim que <infNFe> abre (antes do primeiro item); em 'notas' fica
+    cada nota do arquivo (chave, emitente, itens) e, no fim, 'hash_conteudo' (SHA-256 do XML).
+    nota_ja_importada(chave) é consultada na abertura de cada <infNFe>: se devolver a data da
+    importação anterior, os itens da nota não são lidos (o arquivo de uma nota só é abandonado
+    na hora) e a nota fica com 'importada_em'.
+    """
+    if isinstance(origem_xml, bytes):
+        origem_xml = io.BytesIO(origem_xml)
+    elif isinstance(origem_xml, str):
+        if origem_xml.lstrip().startswith('<'):
+            origem_xml = io.StringIO(origem_xml)
+        else:
+            with open(origem_xml, 'rb') as arquivo:
+                yield from iterar_itens_nfe(arquivo, cabecalho, nota_ja_importada)
+            return
+
+    leitor = _LeitorComHash(origem_xml) if cabecalho is not None else origem_xml
+    tag_det = f'{NS_NFE}det'
+    tag_prod = f'{NS_NFE}prod'
+    tag_emit = f'{NS_NFE}emit'
+    tag_inf_nfe = f'{NS_NFE}infNFe'
+    # nfeProc/NFe na raiz: uma nota por arquivo (enviNFe e outros lotes podem trazer várias)
+    raizes_nota_unica = (f'{NS_NFE}nfeProc', f'{NS_NFE}NFe')
+    abertos = []
+    nota = None
+    for evento, elemento in ET.iterparse(leitor, events=('start', 'end')):
+        if evento == 'start':
+            abertos.append(elemento)
+            if elemento.tag == tag_inf_nfe and cabecalho is not None:
+                chave = _chave_acesso_nfe(elemento.get('Id'))
+                nota = {'chave_acesso': chave, 'emitente_cnpj': None, 'itens': 0,
+                        'importada_em': nota_ja_importada(chave) if chave and nota_ja_importada else None}
+                cabecalho.setdefault('notas', []).append(nota)
+                cabecalho['chave_acesso'] = chave
+                if nota['importada_em'] and abertos[0].tag in raizes_nota_unica:
+                    return
+            continue
+        abertos.pop()
+        if elemento.tag == tag_det:
+            prod = elemento.find(tag_prod)
+            # Itens de nota já importada são descartados sem ler os campos
+            if prod is not None and not (nota and nota['importada_em']):
+                if nota:
+                    nota['itens'] += 1
+                # Uma passada pelos filhos de <prod> em vez de um find() por campo
+                yield {filho.tag.rpartition('}')[2]: (filho.text or '').strip() for filho in prod}
+        elif elemento.tag == tag_emit and cabecalho is not None:
+            cabecalho['cnpj_emitente'] = (elemento.findtext(f'{NS_NFE}CNPJ') or elemento.findtext(f'{NS_NFE}CPF') or '').strip()
+            cabecalho['nome_emitente'] = (elemento.findtext(f'{NS_NFE}xNome') or '').strip()
+            if nota:
+                nota['emitente_cnpj'] = cabecalho['cnpj_emitente']
+            continue
+        elif len(abertos) != 1:
+            continue
+        # Item já lido (ou nota inteira de um arquivo em lote): solta da árvore
+        if abertos:
+            abertos[-1].remove(elemento)
+        elemento.clear()
+    if cabecalho is not None:
+        cabecalho['hash_conteudo'] = leitor.hash.hexdigest()
+
+def _item_nfe(campos, margem_padrao, usar_preco_nfe, cnpj_emitente='', chave_acesso=None):
+    """Converte os campos de <prod> no produto a gravar (preços pela margem e categoria pelo NCM)"""
+    codigo_ean = campos.get('cEAN', '')
+    if codigo_ean in ('SEM GTIN', ''):
+        codigo_ean = ''
+    ncm = campos.get('NCM', '')
+    valor_unitario = float(campos['vUnCom']) if campos.get('vUnCom') else 0.0
+    preco_custo = valor_unitario if usar_preco_nfe else 0.0
+    return {
+        'codigo_produto': campos.get('cProd', ''),
+        'codigo_norm': normalizar_codigo(campos.get('cProd', '')),
+        'cnpj_emitente': cnpj_emitente,
+        'chave_acesso': chave_acesso,
+        'codigo_ean': codigo_ean,
+        'nome': campos.get('xProd', ''),
+        'quantidade': int(float(campos['qCom'])) if campos.get('qCom') else 0,
+        'ncm': ncm,
+        'unidade': campos.get('uCom') or 'UN',
+        'preco_custo': preco_custo,
+        'preco_venda': preco_custo + (preco_custo * margem_padrao / 100) if preco_custo > 0 else 0.0,
+        'categoria': obter_categoria_por_ncm_avancado(ncm) if ncm else "Geral"
+    }
+
+def _chave_item_nfe(item):
+    """Chave que identifica o mesmo produto entre itens ainda não gravados (EAN, código do emitente ou nome)"""
+    if item['codigo_ean']:
+        return item['codigo_ean']
+    if item['codigo_norm']:
+        return (item['cnpj_emitente'], item['codigo_norm'])
+    return item['nome']
+
+class IndiceProdutosNfe:
+    """Mapas em memória para localizar os produtos dos itens de NFe, carregados uma vez por importação
+
+    codigo_barras -> id e (fornecedor_id, código normalizado) -> id: o código do fornecedor só
+    vale dentro do fornecedor que emitiu a nota (o mesmo código em dois fornecedores é outra
+    peça). Produtos sem fornecedor_id (cadastro manual, importações antigas) ficam sob None e
+    servem de segunda opção para qualquer emitente.
+    """
+
+    def __init__(self, cursor):
+        self.por_ean = {}
+        self.por_codigo = {}
+        self.ultimo_id = 0
+        self.fornecedores = {}
+        cursor.execute('SELECT id, cnpj FROM fornecedores WHERE cnpj IS NOT NULL')
+        for fornecedor_id, cnpj in cursor.fetchall():
+            digitos = re.sub(r'\D', '', cnpj)
+            if digitos:
+                self.fornecedores[digitos] = fornecedor_id
+        self.carregar(cursor)
+
+    def carregar(self, cursor):
+        """Lê os produtos cadastrados depois da última carga (todos, na primeira)"""
+        cursor.execute('''
+            SELECT id, codigo_barras, fornecedor_id, codigo_fornecedor_norm
+            FROM produtos WHERE id > ?
+        ''', (self.ultimo_id,))
+        for produto_id, codigo_barras, fornecedor_id, codigo_norm in cursor.fetchall():
+            self.registrar(produto_id, codigo_barras, fornecedor_id, codigo_norm)
+            self.ultimo_id = max(self.ultimo_id, produto_id)
+
+    def registrar(self, produto_id, codigo_barras, fornecedor_id, codigo_norm):
+        """Inclui um produto nos mapas (ou aponta o código de barras para ele)"""
+        if codigo_barras:
+            self.por_ean[codigo_barras] = produto_id
+        if codigo_norm:
+            self.por_codigo.setdefault((fornecedor_id, codigo_norm), produto_id)
+
+    def fornecedor_id(self, cnpj_emitente):
+        """Id do fornecedor cadastrado com o CNPJ do emitente da nota (ou None)"""
+        return self.fornecedores.get(re.sub(r'\D', '', cnpj_emitente or ''))
+
+    def localizar(self, item, fornecedor_id):
+        """Id do produto já cadastrado para o item: código de barras, depois código do fornecedor"""
+        if item['codigo_ean'] and item['codigo_ean'] in self.por_ean:
+            return self.por_ean[item['codigo_ean']]
+        if not item['codigo_norm']:
+            return None
+        if fornecedor_id is not None and (fornecedor_id, item['codigo_norm']) in self.por_codigo:
+            return self.por_codigo[(fornecedor_id, item['codigo_norm'])]
+        return self.por_codigo.get((None, item['codigo_norm']))
+
+def _gravar_lote_nfe(cursor, indice, lote, estoque_minimo, acao_existente, resultado):
+    """Grava um lote de itens: localiza os existentes no índice e aplica inserções/atualizações com executemany"""
+    novos = {}
+    somar_estoque = []
+    substituir = []
+    for item in lote:
+        fornecedor_id = indice.fornecedor_id(item['cnpj_emitente'])
+        # Item repetido dentro do lote: o cadastro ainda não foi gravado, junta no pendente
+        chave = _chave_item_nfe(item)
+        pendente = novos.get(chave)
+        produto_id = None if pendente else indice.localizar(item, fornecedor_id)
+
+        if pendente is None and produto_id is None:
+            novos[chave] = (item, fornecedor_id)
+            resultado['produtos_importados'] += 1
+        elif acao_existente == 'ignorar':
+            resultado['produtos_ignorados'] += 1
+        elif acao_existente == 'atualizar_estoque':
+            if pendente:
+                pendente[0]['quantidade'] += item['quantidade']
+            else:
+                somar_estoque.append((item['quantidade'], produto_id))
+            resultado['produtos_atualizados'] += 1
+        else:
+            if pendente:
+                novos[chave] = (item, fornecedor_id)
+            else:
+                substituir.append((item['nome'], item['codigo_produto'], item['codigo_ean'] or None, item['categoria'],
+                                   item['preco_custo'], item['preco_venda'], item['quantidade'], estoque_minimo,
+                                   item['unidade'], item['ncm'], produto_id))
+                indice.registrar(produto_id, item['codigo_ean'], fornecedor_id, item['codigo_norm'])
+            resultado['produtos_atualizados'] += 1
+
+    if somar_estoque:
+        cursor.executemany('UPDATE produtos SET estoque = estoque + ? WHERE id = ?', somar_estoque)
+    if substituir:
+        cursor.executemany('''
+            UPDATE produtos 
+            SET nome = ?, codigo_fornecedor = ?, codigo_barras = ?, categoria = ?, 
+                preco_custo = ?, preco = ?, estoque = ?, estoque_minimo = ?,
+                unidade = ?, ncm = ?
+            WHERE id = ?
+        ''', substituir)
+    # Sem código de barras grava NULL: codigo_barras é UNIQUE e '' repetido quebraria o lote
+    if novos:
+        cursor.executemany('''
+            INSERT INTO produtos (nome, codigo_fornecedor, codigo_barras, categoria, descricao,
+                                preco_custo, preco, estoque, estoque_minimo, unidade, ncm, fornecedor_id, ativo)
+            VALUES (?, ?, ?, ?, 'Importado via NFe XML', ?, ?, ?, ?, ?, ?, ?, 1)
+        ''', [(item['nome'], item['codigo_produto'], item['codigo_ean'] or None, item['categoria'],
+               item['preco_custo'], item['preco_venda'], item['quantidade'], estoque_minimo,
+               item['unidade'], item['ncm'], fornecedor_id) for item, fornecedor_id in novos.values()])
+        # Os lotes seguintes encontram os produtos recém-cadastrados
+        indice.carregar(cursor)
+
+def _consultar_nota_importada(conn, chave_acesso):
+    """Data em que a NF-e da chave de acesso foi importada (None se nunca foi): uma busca pela chave única"""
+    linha = conn.execute('SELECT importado_em FROM nfe_importadas WHERE chave_acesso = ?', (chave_acesso,)).fetchone()
+    return linha[0] if linha else None
+
+def _consultar_arquivo_sem_chave_importado(conn, hash_conteudo):
+    """Data em que o mesmo XML sem chave de acesso foi importado (None se nunca foi)"""
+    linha = conn.execute('''
+        SELECT importado_em FROM nfe_importadas WHERE chave_acesso IS NULL AND hash_conteudo = ?
+    ''', (hash_conteudo,)).fetchone()
+    return linha[0] if linha else None
+
+def _registrar_notas_nfe(cursor, notas):
+    """Grava no registro as notas importadas (chave, hash, itens, emitente, arquivo), na transação do estoque"""
+    agora = agora_local()
+    cursor.executemany('''
+        INSERT INTO nfe_importadas (chave_acesso, hash_conteudo, itens, emitente_cnpj, arquivo, importado_em)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [nota + (agora,) for nota in notas])
+
+def importar_produtos_de_xml_avancado(origem_xml, margem_padrao=100, estoque_minimo=5, usar_preco_nfe=True, acao_existente='atualizar_estoque',
+                                      nome_arquivo=None):
+    """
+    Importa produtos de um arquivo XML de NFe com configurações avançadas
+    
+    Args:
+        origem_xml: Arquivo enviado (lido em fluxo), caminho, bytes ou texto do XML
+        margem_padrao: Margem de lucro padrão (%)
+        estoque_minimo: Estoque mínimo padrão
+        usar_preco_nfe: Se deve usar preço da NFe como custo
+        acao_existente: 'atualizar_estoque', 'substituir_dados' ou 'ignorar'
+        nome_arquivo: Nome do arquivo guardado no registro de notas importadas
+    
+    Nota já registrada em nfe_importadas (mesma chave de acesso) não é importada de novo.
+    Entrada de biblioteca para um único XML (scripts e console); a tela de produtos e o
+    comando importar-nfes usam a fila e importar_produtos_de_nfes_em_lote.
+    """
+    resultado = {
+        'sucesso': True,
+        'produtos_importados': 0,
+        'produtos_atualizados': 0,
+        'produtos_ignorados': 0,
+        'notas_importadas': 0,
+        'notas_duplicadas': 0,
+        'erros': []
+    }
+    erros = resultado['erros']
+    
+    try:
+        if acao_existente not in ACOES_PRODUTO_EXISTENTE_NFE:
+            raise ValueError(f"Ação inválida para produtos existentes: {acao_existente}")
+        
+        with conexao() as conn:
+            cursor = conn.cursor()
+            # Uma transação para a nota inteira: XML com defeito no meio não deixa importação parcial
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                indice = IndiceProdutosNfe(cursor)
+                cabecalho = {}
+                lote = []
+                itens_lidos = 0
+                for campos in iterar_itens_nfe(origem_xml, cabecalho,
+                                               lambda chave: _consultar_nota_importada(cursor, chave)):
+                    itens_lidos += 1
+                    try:
+                        item = _item_nfe(campos, margem_padrao, usar_preco_nfe, cabecalho.get('cnpj_emitente', ''),
+                                         cabecalho.get('chave_acesso'))
+                    except (TypeError, ValueError) as e:
+                        erros.append(f"Erro ao processar produto {campos.get('cProd', '')}: {str(e)}")
                         continue
-                    elif acao_existente == 'substituir_dados':
-                        # Substituir todos os dados
-                        produto_id = produto_existente[0]
-                        cursor.execute('''
-                            UPDATE produtos 
-                            SET nome = ?, codigo_fornecedor = ?, codigo_barras = ?, categoria = ?, 
-                                preco_custo = ?, preco = ?, estoque = ?, estoque_minimo = ?,
-                                unidade = ?, ncm = ?
-                            WHERE id = ?
-                        ''', (nome_produto, codigo_produto, codigo_ean, categoria, 
-                             preco_custo, preco_venda, quantidade, estoque_minimo, 
-                             unidade, ncm, produto_id))
-                        produtos_atualizados += 1
+                    if not item['nome']:
+                        erros.append(f"Produto sem nome encontrado (código: {item['codigo_produto']})")
                         continue
+                    lote.append(item)
+                    if len(lote) >= TAMANHO_LOTE_IMPORTACAO_NFE:
+                        _gravar_lote_nfe(cursor, indice, lote, estoque_minimo, acao_existente, resultado)
+                        lote = []
                 
-                # Inserir novo produto
-                cursor.execute('''
-                    INSERT INTO produtos (nome, codigo_fornecedor, codigo_barras, categoria, descricao,
-                                        preco_custo, preco, estoque, estoque_minimo, unidade, ncm, ativo)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (nome_produto, codigo_produto, codigo_ean, categoria, 
-                     "Importado via NFe XML", preco_custo, preco_venda, 
-                     quantidade, estoque_minimo, unidade, ncm, 1))
+                notas = cabecalho.get('notas', [])
+                for nota in notas:
+                    if nota['importada_em']:
+                        resultado['notas_duplicadas'] += 1
+                        erros.append(f"NF-e {nota['chave_acesso']} já foi importada em {nota['importada_em']}; itens ignorados")
+                registrar = [(nota['chave_acesso'], cabecalho.get('hash_conteudo', ''), nota['itens'],
+                              nota['emitente_cnpj'], nome_arquivo) for nota in notas
+                             if nota['chave_acesso'] and not nota['importada_em']]
                 
-                produtos_importados += 1
+                if itens_lidos and not any(nota['chave_acesso'] for nota in notas):
+                    # Sem chave de acesso (XML fora do padrão) a nota é reconhecida pelo conteúdo do arquivo
+                    anterior = _consultar_arquivo_sem_chave_importado(cursor, cabecalho['hash_conteudo'])
+                    if anterior:
+                        resultado['notas_duplicadas'] = 1
+                        erros.append(f"Este arquivo XML já foi importado em {anterior}")
+                        itens_lidos = 0
+                    registrar = [(None, cabecalho['hash_conteudo'], itens_lidos,
+                                  cabecalho.get('cnpj_emitente'), nome_arquivo)]
                 
-            except Exception as e:
-                erros.append(f"Erro ao processar produto {codigo_produto}: {str(e)}")
-                continue
-        
-        conn.commit()
-        conn.close()
-        
-        return {
-            'sucesso': True,
-            'produtos_importados': produtos_importados,
-            'produtos_atualizados': produtos_atualizados,
-            'produtos_ignorados': produtos_ignorados,
-            'total_processados': produtos_importados + produtos_atualizados + produtos_ignorados,
-            'erros': erros
-        }
+                if resultado['notas_duplicadas'] and not itens_lidos:
+                    # A nota inteira já tinha sido importada: desfaz o que foi gravado e não conta nada
+                    conn.rollback()
+                    resultado.update(sucesso=False, erro=erros[-1], produtos_importados=0, produtos_atualizados=0,
+                                     produtos_ignorados=0, total_processados=0)
+                    return resultado
+                if not itens_lidos:
+                    raise ValueError("Nenhum produto encontrado no XML")
+                if lote:
+                    _gravar_lote_nfe(cursor, indice, lote, estoque_minimo, acao_existente, resultado)
+                _registrar_notas_nfe(cursor, registrar)
+                resultado['notas_importadas'] = len(registrar)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        
+        _cache_catalogo.invalidar()
+        resultado['total_processados'] = (resultado['produtos_importados'] + resultado['produtos_atualizados']
+                                          + resultado['produtos_ignorados'])
+        return resultado
         
     except ET.ParseError as e:
         return {
@@ -2740,6 +3818,530 @@ def importar_produtos_de_xml_avancado(conteudo_xml, margem_padrao=100, estoque_m
             'erros': [str(e)]
         }
 
+# IMPORTAÇÃO DE NFe EM LOTE (ZIP ou diretório)
+# Cada arquivo é lido em um processo separado (a leitura do XML é o que pesa e não depende
+# do banco); o processo principal junta os itens de todas as notas - o mesmo produto vindo
+# em várias notas vira um só cadastro/atualização - e grava tudo com executemany em uma
+# única transação, sem segurar o banco enquanto os arquivos ainda estão sendo lidos.
+PROCESSOS_IMPORTACAO_NFE = min(4, os.cpu_count() or 1)
+TAMANHO_MAXIMO_XML_NFE = 50 * 1024 * 1024
+
+def _contexto_processos_nfe():
+    """Contexto dos processos de leitura: forkserver (spawn onde não existe), nunca fork
+
+    O worker web tem threads de requisições, da central de eventos, do caixa e da fila de
+    importações; um fork poderia copiar para o filho um lock (pool de conexões, sqlite)
+    preso por uma dessas threads e travar a leitura.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        contexto = multiprocessing.get_context('forkserver')
+        # O servidor de fork já deixa este módulo carregado para os processos de leitura
+        contexto.set_forkserver_preload([__name__])
+        return contexto
+    return multiprocessing.get_context('spawn')
+
+def listar_nfes_do_zip(arquivo_zip):
+    """Gera (nome, bytes) de cada XML dentro do ZIP (arquivo aberto ou caminho), um de cada vez"""
+    with zipfile.ZipFile(arquivo_zip) as pacote:
+        for membro in pacote.infolist():
+            nome = membro.filename
+            if membro.is_dir() or not nome.lower().endswith('.xml') or nome.startswith('__MACOSX/'):
+                continue
+            if membro.file_size > TAMANHO_MAXIMO_XML_NFE:
+                yield nome, ValueError(f"Arquivo maior que {TAMANHO_MAXIMO_XML_NFE // (1024 * 1024)} MB")
+                continue
+            yield nome, pacote.read(membro)
+
+def listar_nfes_do_diretorio(diretorio):
+    """Gera (nome, origem) dos XMLs do diretório (pelo caminho) e dos XMLs de cada ZIP encontrado nele"""
+    for nome in sorted(os.listdir(diretorio)):
+        caminho = os.path.join(diretorio, nome)
+        if not os.path.isfile(caminho):
+            continue
+        if nome.lower().endswith('.xml'):
+            yield nome, caminho
+        elif nome.lower().endswith('.zip'):
+            for nome_membro, dados in listar_nfes_do_zip(caminho):
+                yield f"{nome}/{nome_membro}", dados
+
+def _ler_arquivo_nfe(nome, origem_xml, margem_padrao, usar_preco_nfe, caminho_banco):
+    """Lê uma NFe inteira (executado nos processos do lote): (nome, itens, avisos, erro do arquivo, cabecalho)
+
+    As notas já registradas em nfe_importadas são descartadas pela chave de acesso antes de ler os itens
+    (conexão própria: o processo de leitura não usa o pool de conexões do worker web).
+    """
+    itens = []
+    avisos = []
+    cabecalho = {}
+    conexoes = []
+
+    def nota_ja_importada(chave):
+        if not conexoes:
+            conexoes.append(sqlite3.connect(caminho_banco, timeout=30))
+        return _consultar_nota_importada(conexoes[0], chave)
+
+    try:
+        for campos in iterar_itens_nfe(origem_xml, cabecalho, nota_ja_importada):
+            try:
+                item = _item_nfe(campos, margem_padrao, usar_preco_nfe, cabecalho.get('cnpj_emitente', ''),
+                                 cabecalho.get('chave_acesso'))
+            except (TypeError, ValueError) as e:
+                avisos.append(f"{nome}: erro ao processar produto {campos.get('cProd', '')}: {str(e)}")
+                continue
+            if not item['nome']:
+                avisos.append(f"{nome}: produto sem nome encontrado (código: {item['codigo_produto']})")
+                continue
+            itens.append(item)
+    except ET.ParseError as e:
+        return nome, [], avisos, f"XML inválido: {str(e)}", cabecalho
+    except Exception as e:
+        return nome, [], avisos, f"Erro ao ler arquivo: {str(e)}", cabecalho
+    finally:
+        for conn in conexoes:
+            conn.close()
+    duplicadas = any(nota['importada_em'] for nota in cabecalho.get('notas', []))
+    if not itens and not avisos and not duplicadas:
+        return nome, [], avisos, "Nenhum produto encontrado no XML", cabecalho
+    return nome, itens, avisos, None, cabecalho
+
+def _ler_nfes_em_paralelo(origens, margem_padrao, usar_preco_nfe, processos, caminho_banco):
+    """Gera o resultado de _ler_arquivo_nfe de cada origem, lendo até `processos` arquivos ao mesmo tempo
+
+    No máximo dois arquivos por processo ficam aguardando na fila, então um ZIP grande não é
+    carregado inteiro na memória.
+    """
+    origens = iter(origens)
+    if processos <= 1:
+        for nome, origem_xml in origens:
+            if isinstance(origem_xml, Exception):
+                yield nome, [], [], str(origem_xml), {}
+            else:
+                yield _ler_arquivo_nfe(nome, origem_xml, margem_padrao, usar_preco_nfe, caminho_banco)
+        return
+
+    with ProcessPoolExecutor(max_workers=processos, mp_context=_contexto_processos_nfe()) as executor:
+        pendentes = set()
+        for nome, origem_xml in origens:
+            if isinstance(origem_xml, Exception):
+                yield nome, [], [], str(origem_xml), {}
+                continue
+            pendentes.add(executor.submit(_ler_arquivo_nfe, nome, origem_xml, margem_padrao, usar_preco_nfe,
+                                          caminho_banco))
+            if len(pendentes) >= processos * 2:
+                prontos, pendentes = wait(pendentes, return_when=FIRST_COMPLETED)
+                for futuro in prontos:
+                    yield futuro.result()
+        for futuro in as_completed(pendentes):
+            yield futuro.result()
+
+def importar_produtos_de_nfes_em_lote(origens, margem_padrao=100, estoque_minimo=5, usar_preco_nfe=True,
+                                     acao_existente='atualizar_estoque', processos=None, progresso=None,
+                                     na_transacao=None):
+    """
+    Importa os produtos de várias NFe de uma vez, com um relatório consolidado
+    
+    Args:
+        origens: Pares (nome, origem) - origem é o caminho, os bytes ou o texto do XML
+                 (listar_nfes_do_zip / listar_nfes_do_diretorio)
+        processos: Quantidade de processos de leitura (padrão PROCESSOS_IMPORTACAO_NFE)
+        progresso: Função chamada com (etapa, resultado parcial) a cada arquivo lido
+                   ('leitura') e antes da gravação ('gravacao')
+        na_transacao: Função chamada com o cursor dentro da transação de gravação, antes do commit
+    
+    Os demais argumentos são os de importar_produtos_de_xml_avancado. Arquivo com XML
+    inválido é informado em 'erros' e não impede a importação dos outros. Notas já
+    registradas em nfe_importadas, ou repetidas no próprio lote, não são importadas de novo.
+    """
+    resultado = {
+        'sucesso': True,
+        'arquivos_processados': 0,
+        'arquivos_com_erro': 0,
+        'itens_lidos': 0,
+        'produtos_importados': 0,
+        'produtos_atualizados': 0,
+        'produtos_ignorados': 0,
+        'notas_importadas': 0,
+        'notas_duplicadas': 0,
+        'erros': []
+    }
+    erros = resultado['erros']
+    
+    try:
+        if acao_existente not in ACOES_PRODUTO_EXISTENTE_NFE:
+            raise ValueError(f"Ação inválida para produtos existentes: {acao_existente}")
+        
+        # Produtos de todas as notas, já sem repetição (mesma chave de _gravar_lote_nfe)
+        consolidados = {}
+        # Notas a registrar em nfe_importadas e as já vistas neste lote (chave ou, sem chave, hash)
+        notas_novas = []
+        chaves_lote = set()
+        hashes_lote = set()
+        for nome, itens, avisos, erro_arquivo, cabecalho in _ler_nfes_em_paralelo(
+                origens, margem_padrao, usar_preco_nfe, processos or PROCESSOS_IMPORTACAO_NFE, DB_PATH):
+            erros.extend(avisos)
+            if erro_arquivo:
+                resultado['arquivos_com_erro'] += 1
+                erros.append(f"{nome}: {erro_arquivo}")
+                continue
+            resultado['arquivos_processados'] += 1
+            
+            notas = cabecalho.get('notas', [])
+            hash_conteudo = cabecalho.get('hash_conteudo', '')
+            repetidas = set()
+            for nota in notas:
+                chave = nota['chave_acesso']
+                if nota['importada_em']:
+                    resultado['notas_duplicadas'] += 1
+                    erros.append(f"{nome}: NF-e {chave} já foi importada em {nota['importada_em']}; itens ignorados")
+                elif chave in chaves_lote:
+                    resultado['notas_duplicadas'] += 1
+                    erros.append(f"{nome}: NF-e {chave} repetida neste lote; itens ignorados")
+                    repetidas.add(chave)
+                elif chave:
+                    chaves_lote.add(chave)
+                    notas_novas.append((chave, hash_conteudo, nota['itens'], nota['emitente_cnpj'], nome))
+            if itens and not any(nota['chave_acesso'] for nota in notas):
+                # Sem chave de acesso (XML fora do padrão) a nota é reconhecida pelo conteúdo do arquivo
+                with conexao() as conn:
+                    anterior = _consultar_arquivo_sem_chave_importado(conn, hash_conteudo)
+                if anterior or hash_conteudo in hashes_lote:
+                    resultado['notas_duplicadas'] += 1
+                    erros.append(f"{nome}: arquivo já importado{f' em {anterior}' if anterior else ' neste lote'}; itens ignorados")
+                    continue
+                hashes_lote.add(hash_conteudo)
+                notas_novas.append((None, hash_conteudo, len(itens), cabecalho.get('cnpj_emitente'), nome))
+            if repetidas:
+                itens = [item for item in itens if item['chave_acesso'] not in repetidas]
+            
+            resultado['itens_lidos'] += len(itens)
+            for item in itens:
+                chave = _chave_item_nfe(item)
+                anterior = consolidados.get(chave)
+                if anterior is not None and acao_existente == 'atualizar_estoque':
+                    anterior['quantidade'] += item['quantidade']
+                elif anterior is None or acao_existente == 'substituir_dados':
+                    # Substituição: vale a nota lida por último
+                    consolidados[chave] = item
+            if progresso:
+                progresso('leitura', resultado)
+        
+        if not resultado['arquivos_processados'] and not resultado['arquivos_com_erro']:
+            raise ValueError("Nenhum arquivo XML encontrado")
+        
+        if consolidados or notas_novas:
+            if progresso:
+                progresso('gravacao', resultado)
+            itens = list(consolidados.values())
+            with conexao() as conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                try:
+                    # Outra importação pode ter gravado alguma das notas durante a leitura: com o
+                    # lock de escrita a conferência é definitiva (o estoque nunca soma duas vezes)
+                    chaves = sorted(chaves_lote)
+                    for inicio in range(0, len(chaves), LOTE_PARAMETROS_IN):
+                        parte = chaves[inicio:inicio + LOTE_PARAMETROS_IN]
+                        cursor.execute(f'''
+                            SELECT chave_acesso FROM nfe_importadas
+                            WHERE chave_acesso IN ({','.join('?' * len(parte))}) LIMIT 1
+                        ''', parte)
+                        linha = cursor.fetchone()
+                        if linha:
+                            raise ValueError(f"NF-e {linha[0]} foi importada por outra importação enquanto "
+                                             "este lote era lido; envie os arquivos novamente")
+                    
+                    indice = IndiceProdutosNfe(cursor)
+                    for inicio in range(0, len(itens), TAMANHO_LOTE_IMPORTACAO_NFE):
+                        _gravar_lote_nfe(cursor, indice, itens[inicio:inicio + TAMANHO_LOTE_IMPORTACAO_NFE],
+                                         estoque_minimo, acao_existente, resultado)
+                    _registrar_notas_nfe(cursor, notas_novas)
+                    if na_transacao:
+                        na_transacao(cursor)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            _cache_catalogo.invalidar()
+            resultado['notas_importadas'] = len(notas_novas)
+        
+        resultado['total_processados'] = (resultado['produtos_importados'] + resultado['produtos_atualizados']
+                                          + resultado['produtos_ignorados'])
+        return resultado
+        
+    except zipfile.BadZipFile as e:
+        resultado.update(sucesso=False, erro=f'Arquivo ZIP inválido: {str(e)}')
+        erros.append(resultado['erro'])
+        return resultado
+    except Exception as e:
+        resultado.update(sucesso=False, erro=f'Erro geral: {str(e)}')
+        erros.append(str(e))
+        return resultado
+
+# FILA DE IMPORTAÇÕES DE NFe
+# O envio do arquivo só grava a tarefa (e o arquivo em disco) e volta na hora; uma thread
+# por processo reserva as tarefas pendentes e executa a importação em lote, gravando o
+# andamento na própria linha da tarefa para a tela acompanhar de qualquer worker.
+# A reserva é um UPDATE ... RETURNING dentro de BEGIN IMMEDIATE: com vários workers do
+# gunicorn, cada tarefa é executada por um só.
+FILA_IMPORTACOES_NFE_INTERVALO = 5
+# Tarefa em andamento sem sinal de vida há mais que isso: o processo que a executava morreu
+FILA_IMPORTACOES_NFE_TEMPO_LIMITE = 600
+# Intervalo do sinal de vida (atualizado_em) gravado enquanto a tarefa executa (segundos)
+FILA_IMPORTACOES_NFE_PULSO = 30
+# Intervalo mínimo entre duas gravações de andamento da mesma tarefa (segundos)
+FILA_IMPORTACOES_NFE_ANDAMENTO = 1.0
+FILA_IMPORTACOES_NFE_MAXIMO_ERROS = 50
+
+_fila_importacoes_nfe = {'thread': None, 'parar': None, 'acordar': None,
+                         'intervalo': FILA_IMPORTACOES_NFE_INTERVALO, 'pid': None}
+
+_COLUNAS_IMPORTACAO_NFE = '''
+    id, status, etapa, arquivos, parametros, usuario_id, criado_em, iniciado_em, atualizado_em, concluido_em,
+    arquivos_processados, arquivos_com_erro, itens_lidos, produtos_importados, produtos_atualizados,
+    produtos_ignorados, total_erros, erros, erro, notas_importadas, notas_duplicadas
+'''
+
+def _importacao_nfe_de_linha(row):
+    """Converte a linha de importacoes_nfe lida com _COLUNAS_IMPORTACAO_NFE em dicionário"""
+    return {
+        'id': row[0],
+        'status': row[1],
+        'etapa': row[2],
+        'arquivos': [arquivo['nome'] for arquivo in json.loads(row[3])],
+        'parametros': json.loads(row[4]),
+        'usuario_id': row[5],
+        'criado_em': row[6],
+        'iniciado_em': row[7],
+        'atualizado_em': row[8],
+        'concluido_em': row[9],
+        'arquivos_processados': row[10],
+        'arquivos_com_erro': row[11],
+        'itens_lidos': row[12],
+        'produtos_importados': row[13],
+        'produtos_atualizados': row[14],
+        'produtos_ignorados': row[15],
+        'total_erros': row[16],
+        'erros': json.loads(row[17]) if row[17] else [],
+        'erro': row[18],
+        'notas_importadas': row[19],
+        'notas_duplicadas': row[20],
+        'concluida': row[1] in ('concluida', 'erro')
+    }
+
+def diretorio_importacoes_nfe():
+    """Pasta onde os arquivos enviados aguardam a importação (ao lado do banco)"""
+    diretorio = os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), 'importacoes_nfe')
+    os.makedirs(diretorio, exist_ok=True)
+    return diretorio
+
+def enfileirar_importacao_nfe(arquivos, parametros, usuario_id=None):
+    """Grava a tarefa de importação e acorda a thread deste processo; retorna o id da tarefa
+
+    arquivos é a lista de (nome original, caminho em disco) já salvos em diretorio_importacoes_nfe();
+    parametros são os argumentos de importar_produtos_de_nfes_em_lote (margem_padrao, ...).
+    """
+    if parametros.get('acao_existente', 'atualizar_estoque') not in ACOES_PRODUTO_EXISTENTE_NFE:
+        raise ValueError(f"Ação inválida para produtos existentes: {parametros['acao_existente']}")
+    with conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO importacoes_nfe (arquivos, parametros, usuario_id, criado_em)
+            VALUES (?, ?, ?, ?)
+        ''', (json.dumps([{'nome': nome, 'caminho': caminho} for nome, caminho in arquivos], ensure_ascii=False),
+              json.dumps(parametros), usuario_id, agora_local()))
+        importacao_id = cursor.lastrowid
+        conn.commit()
+    if _fila_importacoes_nfe['acordar'] is not None:
+        _fila_importacoes_nfe['acordar'].set()
+    return importacao_id
+
+def obter_importacao_nfe(importacao_id):
+    """Situação e andamento de uma tarefa de importação (None se não existir)"""
+    with conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {_COLUNAS_IMPORTACAO_NFE} FROM importacoes_nfe WHERE id = ?", (importacao_id,))
+        row = cursor.fetchone()
+    return _importacao_nfe_de_linha(row) if row else None
+
+def _reservar_importacao_nfe():
+    """Marca como em andamento a próxima tarefa pendente e a devolve (None se não houver)"""
+    with conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT 1 FROM importacoes_nfe WHERE status IN ('pendente', 'processando') LIMIT 1
+        ''')
+        if cursor.fetchone() is None:
+            return None
+        
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            agora = datetime.now()
+            limite = (agora - timedelta(seconds=FILA_IMPORTACOES_NFE_TEMPO_LIMITE)).strftime('%Y-%m-%d %H:%M:%S')
+            # Não é reexecutada: a gravação pode ter terminado antes da queda e o estoque seria somado de novo
+            cursor.execute('''
+                UPDATE importacoes_nfe
+                SET status = 'erro', concluido_em = ?,
+                    erro = 'Importação interrompida (o servidor foi reiniciado). Confira o estoque antes de reenviar.'
+                WHERE status = 'processando' AND atualizado_em < ?
+            ''', (agora_local(), limite))
+            cursor.execute(f'''
+                UPDATE importacoes_nfe
+                SET status = 'processando', etapa = 'leitura', iniciado_em = ?, atualizado_em = ?
+                WHERE id = (SELECT id FROM importacoes_nfe WHERE status = 'pendente' ORDER BY id LIMIT 1)
+                RETURNING {_COLUNAS_IMPORTACAO_NFE}
+            ''', (agora_local(), agora_local()))
+            row = cursor.fetchone()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    if row is None:
+        return None
+    importacao = _importacao_nfe_de_linha(row)
+    importacao['caminhos'] = json.loads(row[3])
+    return importacao
+
+def _atualizar_importacao_nfe(importacao_id, resultado, etapa=None, status=None, erro=None):
+    """Grava o andamento (contadores do resultado parcial) ou a conclusão da tarefa"""
+    erros = resultado.get('erros', [])
+    with conexao() as conn:
+        conn.execute('''
+            UPDATE importacoes_nfe
+            SET etapa = COALESCE(?, etapa), status = COALESCE(?, status), atualizado_em = ?,
+                concluido_em = CASE WHEN ? IS NOT NULL THEN ? ELSE concluido_em END,
+                arquivos_processados = ?, arquivos_com_erro = ?, itens_lidos = ?,
+                produtos_importados = ?, produtos_atualizados = ?, produtos_ignorados = ?,
+                notas_importadas = ?, notas_duplicadas = ?, total_erros = ?, erros = ?, erro = ?
+            WHERE id = ?
+        ''', (etapa, status, agora_local(), status, agora_local(),
+              resultado.get('arquivos_processados', 0), resultado.get('arquivos_com_erro', 0),
+              resultado.get('itens_lidos', 0), resultado.get('produtos_importados', 0),
+              resultado.get('produtos_atualizados', 0), resultado.get('produtos_ignorados', 0),
+              resultado.get('notas_importadas', 0), resultado.get('notas_duplicadas', 0),
+              len(erros), json.dumps(erros[:FILA_IMPORTACOES_NFE_MAXIMO_ERROS], ensure_ascii=False),
+              erro, importacao_id))
+        conn.commit()
+
+def _renovar_importacao_nfe(cursor, importacao_id):
+    """Sinal de vida da tarefa em andamento: impede que outro worker a dê como interrompida"""
+    cursor.execute('''
+        UPDATE importacoes_nfe SET atualizado_em = ? WHERE id = ? AND status = 'processando'
+    ''', (agora_local(), importacao_id))
+
+def _pulsar_importacao_nfe(importacao_id, parar):
+    """Thread auxiliar: renova o sinal de vida a cada FILA_IMPORTACOES_NFE_PULSO até a tarefa terminar
+
+    Um XML muito grande pode levar mais que o tempo limite sem concluir nenhum arquivo. Durante a
+    gravação o lock de escrita é da própria importação, que renova o sinal dentro da transação.
+    """
+    while not parar.wait(FILA_IMPORTACOES_NFE_PULSO):
+        try:
+            with conexao() as conn:
+                _renovar_importacao_nfe(conn.cursor(), importacao_id)
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Erro ao renovar a importação de NFe #{importacao_id}: {e}")
+
+def _origens_importacao_nfe(caminhos):
+    """Pares (nome, origem) das NFe de uma tarefa: XMLs pelo caminho e os XMLs de cada ZIP"""
+    for arquivo in caminhos:
+        if arquivo['caminho'].lower().endswith('.zip'):
+            for nome_membro, dados in listar_nfes_do_zip(arquivo['caminho']):
+                yield f"{arquivo['nome']}/{nome_membro}", dados
+        else:
+            yield arquivo['nome'], arquivo['caminho']
+
+def _executar_importacao_nfe(importacao):
+    """Executa uma tarefa reservada: importação em lote com o andamento gravado a cada arquivo lido"""
+    ultima_gravacao = [0.0]
+
+    def progresso(etapa, resultado):
+        # A leitura grava no máximo uma vez por intervalo; a troca de etapa grava sempre
+        agora = time.monotonic()
+        if etapa == 'leitura' and agora - ultima_gravacao[0] < FILA_IMPORTACOES_NFE_ANDAMENTO:
+            return
+        ultima_gravacao[0] = agora
+        _atualizar_importacao_nfe(importacao['id'], resultado, etapa=etapa)
+
+    parar_pulso = threading.Event()
+    pulso = threading.Thread(target=_pulsar_importacao_nfe, args=(importacao['id'], parar_pulso),
+                             name=f"pulso-importacao-nfe-{importacao['id']}", daemon=True)
+    pulso.start()
+    try:
+        resultado = importar_produtos_de_nfes_em_lote(
+            _origens_importacao_nfe(importacao['caminhos']), progresso=progresso,
+            na_transacao=lambda cursor: _renovar_importacao_nfe(cursor, importacao['id']),
+            **importacao['parametros']
+        )
+        if resultado['sucesso']:
+            _atualizar_importacao_nfe(importacao['id'], resultado, etapa='concluida', status='concluida')
+        else:
+            _atualizar_importacao_nfe(importacao['id'], resultado, status='erro', erro=resultado['erro'])
+    except Exception as e:
+        _atualizar_importacao_nfe(importacao['id'], {'erros': [str(e)]}, status='erro', erro=str(e))
+    finally:
+        parar_pulso.set()
+        pulso.join()
+        for arquivo in importacao['caminhos']:
+            try:
+                os.remove(arquivo['caminho'])
+            except OSError:
+                pass
+
+def processar_importacoes_nfe():
+    """Executa as tarefas pendentes, uma de cada vez; retorna quantas foram executadas"""
+    executadas = 0
+    while True:
+        importacao = _reservar_importacao_nfe()
+        if importacao is None:
+            return executadas
+        _executar_importacao_nfe(importacao)
+        executadas += 1
+
+def _executar_fila_importacoes_nfe(parar, acordar, intervalo):
+    """Laço da fila: processa ao ser acordada pelo envio (mesmo processo) ou a cada intervalo"""
+    while not parar.is_set():
+        acordar.wait(intervalo)
+        acordar.clear()
+        if parar.is_set():
+            break
+        try:
+            processar_importacoes_nfe()
+        except Exception as e:
+            print(f"Erro na fila de importações de NFe: {e}")
+
+def iniciar_fila_importacoes_nfe(intervalo=FILA_IMPORTACOES_NFE_INTERVALO):
+    """Inicia (uma vez por processo) a thread que executa as importações de NFe enfileiradas"""
+    atual = _fila_importacoes_nfe['thread']
+    if atual is not None and atual.is_alive() and _fila_importacoes_nfe['pid'] == os.getpid():
+        return False
+    
+    parar = threading.Event()
+    acordar = threading.Event()
+    # Começa acordada: tarefas deixadas pendentes antes de o processo subir
+    acordar.set()
+    thread = threading.Thread(target=_executar_fila_importacoes_nfe, args=(parar, acordar, intervalo),
+                              name='fila-importacoes-nfe', daemon=True)
+    _fila_importacoes_nfe.update(thread=thread, parar=parar, acordar=acordar, intervalo=intervalo, pid=os.getpid())
+    thread.start()
+    return True
+
+def parar_fila_importacoes_nfe():
+    """Interrompe a thread da fila de importações de NFe"""
+    if _fila_importacoes_nfe['parar'] is not None:
+        _fila_importacoes_nfe['parar'].set()
+        _fila_importacoes_nfe['acordar'].set()
+    _fila_importacoes_nfe['thread'] = None
+
+def _reiniciar_fila_importacoes_apos_fork():
+    """Threads não sobrevivem ao fork: o processo filho (worker) inicia a sua própria fila"""
+    if _fila_importacoes_nfe['thread'] is not None:
+        _fila_importacoes_nfe['thread'] = None
+        iniciar_fila_importacoes_nfe(_fila_importacoes_nfe['intervalo'])
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reiniciar_fila_importacoes_apos_fork)
+
 def obter_categoria_por_ncm_avancado(ncm):
     """
     Determina a categoria do produto baseada no código NCM (versão avançada)
@@ -2823,7 +4425,7 @@ def importar_produtos_de_xml(conteudo_xml):
         if not produtos_xml:
             raise ValueError("Nenhum produto encontrado no XML")
         
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_db_connection()
         cursor = conn.cursor()
         
         for det in produtos_xml:
@@ -2924,6 +4526,7 @@ def importar_produtos_de_xml(conteudo_xml):
         
         conn.commit()
         conn.close()
+        _cache_catalogo.invalidar()
         
         return {
             'sucesso': True,
@@ -2954,7 +4557,7 @@ def importar_produtos_de_xml(conteudo_xml):
 
 def gerar_relatorio_vendas(data_inicio=None, data_fim=None, cliente_id=None):
     """Gera relatório de vendas por período e/ou cliente"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
@@ -2979,10 +4582,10 @@ def gerar_relatorio_vendas(data_inicio=None, data_fim=None, cliente_id=None):
         
         # Filtros por data
         if data_inicio:
-            query += " AND DATE(v.data_venda) >= ?"
+            query += " AND v.dia_venda >= ?"
             params.append(data_inicio)
         if data_fim:
-            query += " AND DATE(v.data_venda) <= ?"
+            query += " AND v.dia_venda <= ?"
             params.append(data_fim)
         if cliente_id:
             query += " AND v.cliente_id = ?"
@@ -3010,20 +4613,34 @@ def gerar_relatorio_vendas(data_inicio=None, data_fim=None, cliente_id=None):
             vendas.append(venda)
             total_geral += row[3]
         
-        # Estatísticas resumidas
-        cursor.execute('''
-            SELECT 
-                COUNT(*) as total_vendas,
-                SUM(total) as valor_total,
-                AVG(total) as ticket_medio,
-                forma_pagamento,
-                COUNT(*) as quantidade_por_forma
-            FROM vendas v
-            WHERE 1=1
-        ''' + (" AND DATE(v.data_venda) >= ?" if data_inicio else "") +
-              (" AND DATE(v.data_venda) <= ?" if data_fim else "") +
-              (" AND v.cliente_id = ?" if cliente_id else "") +
-              " GROUP BY forma_pagamento", params)
+        # Estatísticas resumidas (sem filtro de cliente saem do resumo diário)
+        if not cliente_id:
+            cursor.execute('''
+                SELECT 
+                    SUM(quantidade_vendas) as total_vendas,
+                    SUM(valor_total) as valor_total,
+                    SUM(valor_total) / SUM(quantidade_vendas) as ticket_medio,
+                    forma_pagamento,
+                    SUM(quantidade_vendas) as quantidade_por_forma
+                FROM vendas_resumo_diario
+                WHERE 1=1
+            ''' + (" AND dia >= ?" if data_inicio else "") +
+                  (" AND dia <= ?" if data_fim else "") +
+                  " GROUP BY forma_pagamento", params)
+        else:
+            cursor.execute('''
+                SELECT 
+                    COUNT(*) as total_vendas,
+                    SUM(total) as valor_total,
+                    AVG(total) as ticket_medio,
+                    forma_pagamento,
+                    COUNT(*) as quantidade_por_forma
+                FROM vendas v
+                WHERE 1=1
+            ''' + (" AND v.dia_venda >= ?" if data_inicio else "") +
+                  (" AND v.dia_venda <= ?" if data_fim else "") +
+                  " AND v.cliente_id = ?" +
+                  " GROUP BY forma_pagamento", params)
         
         formas_pagamento = cursor.fetchall()
         
@@ -3043,7 +4660,7 @@ def gerar_relatorio_vendas(data_inicio=None, data_fim=None, cliente_id=None):
 
 def gerar_relatorio_produtos_mais_vendidos(data_inicio=None, data_fim=None, limit=10):
     """Gera relatório dos produtos mais vendidos"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
@@ -3064,10 +4681,10 @@ def gerar_relatorio_produtos_mais_vendidos(data_inicio=None, data_fim=None, limi
         params = []
         
         if data_inicio:
-            query += " AND DATE(v.data_venda) >= ?"
+            query += " AND v.dia_venda >= ?"
             params.append(data_inicio)
         if data_fim:
-            query += " AND DATE(v.data_venda) <= ?"
+            query += " AND v.dia_venda <= ?"
             params.append(data_fim)
         
         query += '''
@@ -3100,7 +4717,7 @@ def gerar_relatorio_produtos_mais_vendidos(data_inicio=None, data_fim=None, limi
 
 def gerar_relatorio_estoque():
     """Gera relatório completo do estoque"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
@@ -3190,27 +4807,27 @@ def gerar_relatorio_estoque():
 
 def gerar_relatorio_financeiro(data_inicio=None, data_fim=None):
     """Gera relatório financeiro completo"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
-        # Vendas por forma de pagamento
+        # Vendas por forma de pagamento (resumo diário)
         query_vendas = '''
             SELECT 
                 forma_pagamento,
-                COUNT(*) as quantidade,
-                SUM(total) as valor_total
-            FROM vendas
+                SUM(quantidade_vendas) as quantidade,
+                SUM(valor_total) as valor_total
+            FROM vendas_resumo_diario
             WHERE 1=1
         '''
         
         params = []
         
         if data_inicio:
-            query_vendas += " AND DATE(data_venda) >= ?"
+            query_vendas += " AND dia >= ?"
             params.append(data_inicio)
         if data_fim:
-            query_vendas += " AND DATE(data_venda) <= ?"
+            query_vendas += " AND dia <= ?"
             params.append(data_fim)
         
         query_vendas += " GROUP BY forma_pagamento"
@@ -3239,9 +4856,9 @@ def gerar_relatorio_financeiro(data_inicio=None, data_fim=None):
         '''
         
         if data_inicio:
-            query_receber += " AND DATE(data_vencimento) >= ?"
+            query_receber += " AND data_vencimento >= ?"
         if data_fim:
-            query_receber += " AND DATE(data_vencimento) <= ?"
+            query_receber += " AND data_vencimento <= ?"
         
         query_receber += " GROUP BY status"
         
@@ -3285,9 +4902,9 @@ def gerar_relatorio_financeiro(data_inicio=None, data_fim=None):
         '''
         
         if data_inicio:
-            query_caixa += " AND DATE(cm.data_movimentacao) >= ?"
+            query_caixa += " AND cm.dia_movimentacao >= ?"
         if data_fim:
-            query_caixa += " AND DATE(cm.data_movimentacao) <= ?"
+            query_caixa += " AND cm.dia_movimentacao <= ?"
         
         query_caixa += " GROUP BY tipo"
         
@@ -3325,40 +4942,40 @@ def gerar_relatorio_financeiro(data_inicio=None, data_fim=None):
 # FUNÇÕES DE FORNECEDORES
 # ========================
 
+COLUNAS_FORNECEDOR = '''id, nome, cnpj, telefone, email, endereco, cidade, estado, 
+                   cep, contato_pessoa, observacoes, ativo, created_at'''
+
+def _fornecedor_de_linha(row):
+    """Converte uma linha com COLUNAS_FORNECEDOR em dicionário"""
+    return {
+        'id': row[0],
+        'nome': row[1],
+        'cnpj': row[2],
+        'telefone': row[3],
+        'email': row[4],
+        'endereco': row[5],
+        'cidade': row[6],
+        'estado': row[7],
+        'cep': row[8],
+        'contato_pessoa': row[9],
+        'observacoes': row[10],
+        'ativo': row[11],
+        'created_at': row[12]
+    }
+
 def listar_fornecedores():
     """Lista todos os fornecedores ativos"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
-        cursor.execute('''
-            SELECT id, nome, cnpj, telefone, email, endereco, cidade, estado, 
-                   cep, contato_pessoa, observacoes, ativo, created_at
+        cursor.execute(f'''
+            SELECT {COLUNAS_FORNECEDOR}
             FROM fornecedores 
             WHERE ativo = 1
             ORDER BY nome
         ''')
-        
-        fornecedores = []
-        for row in cursor.fetchall():
-            fornecedor = {
-                'id': row[0],
-                'nome': row[1],
-                'cnpj': row[2],
-                'telefone': row[3],
-                'email': row[4],
-                'endereco': row[5],
-                'cidade': row[6],
-                'estado': row[7],
-                'cep': row[8],
-                'contato_pessoa': row[9],
-                'observacoes': row[10],
-                'ativo': row[11],
-                'created_at': row[12]
-            }
-            fornecedores.append(fornecedor)
-        
-        return fornecedores
+        return [_fornecedor_de_linha(row) for row in cursor.fetchall()]
     except Exception as e:
         print(f"Erro ao listar fornecedores: {e}")
         return []
@@ -3549,7 +5166,7 @@ def listar_produtos_por_fornecedor(fornecedor_id):
 
 def sincronizar_lancamentos_com_contas(usuario_id):
     """Sincroniza lançamentos financeiros existentes criando as contas correspondentes"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     resultado = {"despesas": 0, "receitas": 0, "erros": []}
@@ -3648,8 +5265,12 @@ def sincronizar_lancamentos_com_contas(usuario_id):
 
 # FUNÇÕES DE CONFIGURAÇÕES DA EMPRESA
 def obter_configuracoes_empresa():
-    """Obtém as configurações da empresa"""
-    conn = sqlite3.connect(DB_PATH)
+    """Obtém as configurações da empresa (em cache até serem alteradas)"""
+    return _cache_configuracoes.obter('empresa', _carregar_configuracoes_empresa)
+
+def _carregar_configuracoes_empresa():
+    """Lê as configurações da empresa do banco"""
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
@@ -3718,7 +5339,7 @@ def obter_configuracoes_padrao():
 
 def atualizar_configuracoes_empresa(dados):
     """Atualiza as configurações da empresa"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
@@ -3755,6 +5376,7 @@ def atualizar_configuracoes_empresa(dados):
             ))
         
         conn.commit()
+        _cache_configuracoes.invalidar()
         return True
         
     except Exception as e:
@@ -3767,7 +5389,7 @@ def atualizar_configuracoes_empresa(dados):
 # Inicialização automática
 def editar_lancamento_financeiro_db(lancamento_id, categoria, descricao, valor, data_vencimento=None, fornecedor_cliente="", numero_documento="", observacoes=""):
     """Edita um lançamento financeiro existente"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
@@ -3800,7 +5422,7 @@ def editar_lancamento_financeiro_db(lancamento_id, categoria, descricao, valor,
 
 def alterar_status_lancamento_financeiro(lancamento_id, novo_status, forma_pagamento="", data_pagamento=None):
     """Altera o status de um lançamento financeiro (pago/recebido/cancelado)"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
@@ -3840,23 +5462,19 @@ def alterar_status_lancamento_financeiro(lancamento_id, novo_status, forma_pagam
 
 def listar_vendas_por_periodo(data_inicio, data_fim):
     """Lista vendas por período específico com estatísticas"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
-        # Ajustar datas para incluir o dia completo
-        data_inicio_completa = f"{data_inicio} 00:00:00"
-        data_fim_completa = f"{data_fim} 23:59:59"
-        
         # Buscar vendas do período
         cursor.execute('''
             SELECT v.id, c.nome, v.total, v.forma_pagamento, v.data_venda, v.desconto,
                    (SELECT COUNT(*) FROM itens_venda iv WHERE iv.venda_id = v.id) as total_itens
             FROM vendas v
             LEFT JOIN clientes c ON v.cliente_id = c.id
-            WHERE v.data_venda BETWEEN ? AND ?
+            WHERE v.dia_venda BETWEEN ? AND ?
             ORDER BY v.data_venda DESC
-        ''', (data_inicio_completa, data_fim_completa))
+        ''', (data_inicio[:10], data_fim[:10]))
         
         vendas = []
         for row in cursor.fetchall():
@@ -3878,9 +5496,52 @@ def listar_vendas_por_periodo(data_inicio, data_fim):
     finally:
         conn.close()
 
+# Colunas da exportação de vendas (uma linha por item vendido)
+CABECALHO_EXPORTACAO_VENDAS = (
+    'Venda', 'Data', 'Cliente', 'CPF/CNPJ', 'Vendedor', 'Forma de Pagamento', 'Desconto', 'Total da Venda',
+    'Produto ID', 'Produto', 'Código de Barras', 'Cód. Fornecedor', 'Quantidade', 'Preço Unitário', 'Subtotal'
+)
+
+def iterar_itens_vendas(data_inicio=None, data_fim=None, cliente_id=None, tamanho_lote=500):
+    """Gera as linhas de CABECALHO_EXPORTACAO_VENDAS lendo o cursor em lotes (memória constante para qualquer período)"""
+    filtros = []
+    params = []
+    if data_inicio:
+        filtros.append('v.dia_venda >= ?')
+        params.append(data_inicio[:10])
+    if data_fim:
+        filtros.append('v.dia_venda <= ?')
+        params.append(data_fim[:10])
+    if cliente_id:
+        filtros.append('v.cliente_id = ?')
+        params.append(cliente_id)
+    where = f"WHERE {' AND '.join(filtros)}" if filtros else ''
+
+    with conexao() as conn:
+        cursor = conn.cursor()
+        # Ordem dos índices (idx_vendas_dia e, dentro da venda, idx_itens_venda_venda): nada é ordenado em memória
+        cursor.execute(f'''
+            SELECT v.id, v.data_venda, COALESCE(c.nome, 'Cliente Avulso'), c.cpf_cnpj,
+                   COALESCE(u.nome_completo, u.username), v.forma_pagamento, COALESCE(v.desconto, 0), v.total,
+                   iv.produto_id, p.nome, p.codigo_barras, p.codigo_fornecedor,
+                   iv.quantidade, iv.preco_unitario, iv.subtotal
+            FROM vendas v
+            LEFT JOIN clientes c ON c.id = v.cliente_id
+            LEFT JOIN usuarios u ON u.id = v.usuario_id
+            LEFT JOIN itens_venda iv ON iv.venda_id = v.id
+            LEFT JOIN produtos p ON p.id = iv.produto_id
+            {where}
+            ORDER BY v.dia_venda, v.id
+        ''', params)
+        while True:
+            lote = cursor.fetchmany(tamanho_lote)
+            if not lote:
+                break
+            yield from lote
+
 def deletar_lancamento_financeiro_db(lancamento_id):
     """Deleta um lançamento financeiro e suas contas associadas"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
@@ -3945,7 +5606,11 @@ def deletar_venda(venda_id, restaurar_estoque=True):
         }
         
         # Verificar se a venda existe
-        cursor.execute('SELECT id, total, forma_pagamento FROM vendas WHERE id = ?', (venda_id,))
+        cursor.execute('''
+            SELECT id, total, forma_pagamento, data_venda, usuario_id, desconto,
+                   (SELECT COALESCE(SUM(quantidade), 0) FROM itens_venda WHERE venda_id = vendas.id)
+            FROM vendas WHERE id = ?
+        ''', (venda_id,))
         venda = cursor.fetchone()
         
         if not venda:
@@ -3987,14 +5652,22 @@ def deletar_venda(venda_id, restaurar_estoque=True):
         resultado['contas_receber_deletadas'] = cursor.fetchone()[0]
         cursor.execute('DELETE FROM contas_receber WHERE venda_id = ?', (venda_id,))
         
+        # Um reenvio com a chave desta venda não pode devolver uma venda que não existe mais
+        cursor.execute('DELETE FROM vendas_idempotencia WHERE venda_id = ?', (venda_id,))
+        
         # Deletar a venda
         cursor.execute('DELETE FROM vendas WHERE id = ?', (venda_id,))
         
         if cursor.rowcount > 0:
             resultado['venda_deletada'] = True
             resultado['success'] = True
+            _, total, forma_pagamento, data_venda, usuario_id, desconto, itens_vendidos = venda
+            _acumular_resumo_diario(cursor, data_venda, forma_pagamento, usuario_id, total, desconto,
+                                    itens_vendidos, sinal=-1)
         
         conn.commit()
+        if restaurar_estoque:
+            _cache_catalogo.recarregar(produto_id for produto_id, _, _ in itens_venda)
         return resultado
         
     except Exception as e:
@@ -4067,11 +5740,16 @@ def deletar_todas_vendas(restaurar_estoque=True):
         
         # Deletar vendas
         cursor.execute('DELETE FROM vendas')
+        cursor.execute('DELETE FROM vendas_resumo_diario')
+        # Os IDs recomeçam do 1: uma chave antiga apontaria para uma venda nova
+        cursor.execute('DELETE FROM vendas_idempotencia')
         
         # Reset dos IDs auto-increment
         cursor.execute("DELETE FROM sqlite_sequence WHERE name IN ('vendas', 'itens_venda')")
         
         conn.commit()
+        if restaurar_estoque:
+            _cache_catalogo.invalidar()
         return resultado
         
     except Exception as e:
@@ -4086,6 +5764,252 @@ def deletar_todas_vendas(restaurar_estoque=True):
     finally:
         conn.close()
 
+# ========================
+# GRADE DE DADOS NO SERVIDOR
+# ========================
+# Protocolo das listagens paginadas: ordenação e filtros aplicados no SQL e paginação por
+# chave (keyset) - cada página continua depois da chave de ordenação + id da última linha
+# da anterior, sem OFFSET, então a página 500 custa o mesmo que a primeira. O total é
+# contado só na primeira página e com teto (acima dele a contagem vira estimativa).
+GRADE_LIMITE_PADRAO = 20
+GRADE_LIMITE_MAXIMO = 200
+GRADE_TETO_CONTAGEM = 10000
+
+def _filtro_busca_like(*colunas):
+    """Filtro de busca por trecho (LIKE) em qualquer das colunas"""
+    def filtro(termo):
+        padrao = f"%{termo}%"
+        return f"({' OR '.join(f'{coluna} LIKE ?' for coluna in colunas)})", [padrao] * len(colunas)
+    return filtro
+
+def _filtro_busca_produtos(termo):
+    """Busca de produtos pelo índice FTS5 (mesma consulta de prefixos de pesquisar_produtos)"""
+    consulta = _montar_consulta_fts(termo)
+    if not consulta:
+        return None, []
+    if termo.strip().isdecimal():
+        return ('(p.id = ? OR p.id IN (SELECT rowid FROM produtos_fts WHERE produtos_fts MATCH ?))',
+                [int(termo), consulta])
+    return 'p.id IN (SELECT rowid FROM produtos_fts WHERE produtos_fts MATCH ?)', [consulta]
+
+# Cada grade: origem (FROM), colunas e conversor de linha compartilhados com a função listar_*,
+# colunas de ordenação permitidas (expressões sem NULL, para a comparação da chave funcionar),
+# filtros por valor e a busca textual
+GRADES = {
+    'produtos': {
+        'colunas': COLUNAS_PRODUTO,
+        'origem': 'produtos p',
+        'condicao': 'p.ativo = 1',
+        'id': 'p.id',
+        'converter': _produto_de_linha,
+        'ordenacoes': {
+            'nome': 'p.nome',
+            'id': 'p.id',
+            'preco': 'p.preco',
+            'estoque': 'COALESCE(p.estoque, 0)',
+            'marca': "COALESCE(p.marca, '')",
+            'categoria': "COALESCE(p.categoria, '')",
+        },
+        'ordenacao_padrao': 'nome',
+        'filtros': {
+            'categoria': 'p.categoria = ?',
+            'status': {
+                'disponivel': 'p.estoque > p.estoque_minimo',
+                'estoque_baixo': 'p.estoque > 0 AND p.estoque <= p.estoque_minimo',
+                'indisponivel': 'p.estoque <= 0',
+            },
+        },
+        'busca': _filtro_busca_produtos,
+    },
+    'clientes': {
+        'colunas': COLUNAS_CLIENTE,
+        'origem': 'clientes',
+        'id': 'id',
+        'converter': _cliente_de_linha,
+        'ordenacoes': {
+            'nome': 'nome',
+            'id': 'id',
+            'email': "COALESCE(email, '')",
+        },
+        'ordenacao_padrao': 'nome',
+        'filtros': {},
+        'busca': _filtro_busca_like('nome', 'telefone', 'email', 'cpf_cnpj'),
+    },
+    'fornecedores': {
+        'colunas': COLUNAS_FORNECEDOR,
+        'origem': 'fornecedores',
+        'condicao': 'ativo = 1',
+        'id': 'id',
+        'converter': _fornecedor_de_linha,
+        'ordenacoes': {
+            'nome': 'nome',
+            'id': 'id',
+            'cidade': "COALESCE(cidade, '')",
+        },
+        'ordenacao_padrao': 'nome',
+        'filtros': {
+            'estado': 'estado = ?',
+        },
+        'busca': _filtro_busca_like('nome', 'cnpj', 'telefone', 'email', 'cidade', 'contato_pessoa'),
+    },
+    'orcamentos': {
+        'colunas': COLUNAS_ORCAMENTO,
+        'origem': 'orcamentos o LEFT JOIN clientes c ON o.cliente_id = c.id',
+        'id': 'o.id',
+        'converter': _orcamento_de_linha,
+        'ordenacoes': {
+            'created_at': "COALESCE(o.created_at, '')",
+            'id': 'o.id',
+            'total': 'COALESCE(o.total, 0)',
+            'numero_orcamento': "COALESCE(o.numero_orcamento, '')",
+        },
+        'ordenacao_padrao': 'created_at',
+        'direcao_padrao': 'desc',
+        'filtros': {
+            'status': 'o.status = ?',
+        },
+        'busca': _filtro_busca_like('o.numero_orcamento', 'c.nome'),
+    },
+    'usuarios': {
+        'colunas': COLUNAS_USUARIO,
+        'origem': 'usuarios',
+        'id': 'id',
+        'converter': _usuario_de_linha,
+        'ordenacoes': {
+            'nome_completo': "COALESCE(nome_completo, '')",
+            'username': 'username',
+            'id': 'id',
+        },
+        'ordenacao_padrao': 'nome_completo',
+        'filtros': {
+            'ativo': {'1': 'ativo = 1', '0': 'ativo = 0'},
+        },
+        'busca': _filtro_busca_like('nome_completo', 'username', 'email'),
+    },
+}
+
+def _codificar_cursor_grade(chave, id_linha):
+    """Cursor opaco da próxima página: chave de ordenação e id da última linha"""
+    dados = json.dumps([chave, id_linha], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(dados).decode('ascii').rstrip('=')
+
+def _decodificar_cursor_grade(cursor_grade):
+    """Lê o cursor gerado por _codificar_cursor_grade (ValueError se estiver corrompido)"""
+    try:
+        dados = base64.urlsafe_b64decode(cursor_grade + '=' * (-len(cursor_grade) % 4))
+        chave, id_linha = json.loads(dados)
+    except Exception:
+        raise ValueError("Cursor de paginação inválido")
+    if not isinstance(id_linha, int) or not isinstance(chave, (str, int, float)):
+        raise ValueError("Cursor de paginação inválido")
+    return chave, id_linha
+
+def consultar_grade(nome, ordenar=None, direcao=None, filtros=None, busca=None, apos=None,
+                    limite=GRADE_LIMITE_PADRAO):
+    """Página de uma grade: linhas, cursor da próxima página e total (só na primeira página)
+
+    ordenar/direcao escolhem uma das ordenações da grade; filtros é um dicionário
+    {filtro: valor} com os filtros aceitos pela grade; apos é o cursor devolvido
+    pela página anterior. Parâmetros desconhecidos geram ValueError.
+    """
+    grade = GRADES.get(nome)
+    if grade is None:
+        raise ValueError(f"Grade inválida: {nome}")
+
+    ordenar = ordenar or grade['ordenacao_padrao']
+    if ordenar not in grade['ordenacoes']:
+        raise ValueError(f"Ordenação inválida: {ordenar}")
+    direcao = (direcao or grade.get('direcao_padrao', 'asc')).lower()
+    if direcao not in ('asc', 'desc'):
+        raise ValueError(f"Direção inválida: {direcao}")
+    limite = max(1, min(int(limite or GRADE_LIMITE_PADRAO), GRADE_LIMITE_MAXIMO))
+
+    chave = grade['ordenacoes'][ordenar]
+    coluna_id = grade['id']
+
+    condicoes = [grade['condicao']] if grade.get('condicao') else []
+    params = []
+    for filtro, valor in (filtros or {}).items():
+        if valor in (None, ''):
+            continue
+        regra = grade['filtros'].get(filtro)
+        if regra is None:
+            raise ValueError(f"Filtro inválido: {filtro}")
+        if isinstance(regra, dict):
+            if valor not in regra:
+                raise ValueError(f"Valor inválido para o filtro {filtro}: {valor}")
+            condicoes.append(regra[valor])
+        else:
+            condicoes.append(regra)
+            params.append(valor)
+
+    busca = (busca or '').strip()
+    if busca:
+        condicao_busca, params_busca = grade['busca'](busca)
+        if condicao_busca:
+            condicoes.append(condicao_busca)
+            params.extend(params_busca)
+
+    # Filtros sem a posição da página: servem à contagem e à consulta
+    condicoes_contagem = list(condicoes)
+    params_contagem = list(params)
+
+    if apos:
+        valor_chave, ultimo_id = _decodificar_cursor_grade(apos)
+        operador = '>' if direcao == 'asc' else '<'
+        if chave == coluna_id:
+            condicoes.append(f"{coluna_id} {operador} ?")
+            params.append(ultimo_id)
+        else:
+            # Comparação de row values: o SQLite a resolve como faixa no índice da ordenação
+            condicoes.append(f"({chave}, {coluna_id}) {operador} (?, ?)")
+            params.extend([valor_chave, ultimo_id])
+
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ''
+    ordem = direcao.upper()
+
+    with conexao() as conn:
+        cursor = conn.cursor()
+        # Uma linha a mais informa se há próxima página sem precisar contar
+        cursor.execute(f'''
+            SELECT {grade['colunas']}, {chave}, {coluna_id}
+            FROM {grade['origem']}
+            {where}
+            ORDER BY {chave} {ordem}, {coluna_id} {ordem}
+            LIMIT ?
+        ''', params + [limite + 1])
+        linhas = cursor.fetchall()
+
+        total = None
+        total_estimado = False
+        if not apos:
+            where_contagem = f"WHERE {' AND '.join(condicoes_contagem)}" if condicoes_contagem else ''
+            cursor.execute(f'''
+                SELECT COUNT(*) FROM (
+                    SELECT 1 FROM {grade['origem']} {where_contagem} LIMIT ?
+                )
+            ''', params_contagem + [GRADE_TETO_CONTAGEM + 1])
+            total = cursor.fetchone()[0]
+            if total > GRADE_TETO_CONTAGEM:
+                total = GRADE_TETO_CONTAGEM
+                total_estimado = True
+
+    tem_proxima = len(linhas) > limite
+    linhas = linhas[:limite]
+    proximo = None
+    if tem_proxima:
+        proximo = _codificar_cursor_grade(linhas[-1][-2], linhas[-1][-1])
+
+    return {
+        'linhas': [grade['converter'](linha[:-2]) for linha in linhas],
+        'proximo': proximo,
+        'total': total,
+        'total_estimado': total_estimado,
+        'ordenar': ordenar,
+        'direcao': direcao,
+        'limite': limite
+    }
+
 if __name__ == "__main__":
     init_db()
     criar_usuario_admin()
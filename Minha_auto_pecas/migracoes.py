@@ -0,0 +1,894 @@
+# MIGRAÇÕES DE ESQUEMA - SISTEMA DE AUTOPEÇAS FAMÍLIA
+#
+# Cada migração é aplicada uma única vez e registrada em schema_version.
+# Para alterar o esquema, adicione uma nova função ao final de MIGRACOES
+# (nunca edite uma migração que já foi publicada).
+from datetime import datetime
+
+
+def _colunas_da_tabela(cursor, tabela):
+    """Retorna o conjunto de colunas existentes em uma tabela"""
+    cursor.execute(f"PRAGMA table_xinfo({tabela})")
+    return {linha[1] for linha in cursor.fetchall()}
+
+
+def _garantir_colunas(cursor, tabela, colunas):
+    """Adiciona as colunas que ainda não existem (bancos criados por versões antigas)"""
+    existentes = _colunas_da_tabela(cursor, tabela)
+    for nome, definicao in colunas:
+        if nome not in existentes:
+            cursor.execute(f"ALTER TABLE {tabela} ADD COLUMN {nome} {definicao}")
+
+
+def _migracao_001_esquema_base(cursor):
+    """Esquema base: todas as tabelas do sistema e colunas adicionadas ao longo do tempo"""
+    # Tabela de usuários com permissões
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            nome_completo TEXT NOT NULL,
+            email TEXT NOT NULL,
+            ativo BOOLEAN DEFAULT 1,
+            permissao_vendas BOOLEAN DEFAULT 1,
+            permissao_estoque BOOLEAN DEFAULT 1,
+            permissao_clientes BOOLEAN DEFAULT 1,
+            permissao_financeiro BOOLEAN DEFAULT 0,
+            permissao_caixa BOOLEAN DEFAULT 0,
+            permissao_relatorios BOOLEAN DEFAULT 0,
+            permissao_admin BOOLEAN DEFAULT 0,
+            permissao_contas_pagar BOOLEAN DEFAULT 0,
+            permissao_contas_receber BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_by INTEGER,
+            FOREIGN KEY (created_by) REFERENCES usuarios (id)
+        )
+    ''')
+    _garantir_colunas(cursor, 'usuarios', [
+        ('nome_completo', "TEXT DEFAULT ''"),
+        ('ativo', 'BOOLEAN DEFAULT 1'),
+        ('permissao_vendas', 'BOOLEAN DEFAULT 1'),
+        ('permissao_estoque', 'BOOLEAN DEFAULT 1'),
+        ('permissao_clientes', 'BOOLEAN DEFAULT 1'),
+        ('permissao_financeiro', 'BOOLEAN DEFAULT 0'),
+        ('permissao_caixa', 'BOOLEAN DEFAULT 0'),
+        ('permissao_relatorios', 'BOOLEAN DEFAULT 0'),
+        ('permissao_admin', 'BOOLEAN DEFAULT 0'),
+        ('created_by', 'INTEGER'),
+        ('permissao_contas_pagar', 'BOOLEAN DEFAULT 0'),
+        ('permissao_contas_receber', 'BOOLEAN DEFAULT 0'),
+    ])
+
+    # Tabela de clientes
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS clientes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT NOT NULL,
+            telefone TEXT,
+            email TEXT,
+            cpf_cnpj TEXT,
+            endereco TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Tabela de produtos (inclui dados da NFe e de gestão comercial)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS produtos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT NOT NULL,
+            preco REAL NOT NULL,
+            estoque INTEGER DEFAULT 0,
+            estoque_minimo INTEGER DEFAULT 5,
+            codigo_barras TEXT UNIQUE,
+            descricao TEXT,
+            categoria TEXT,
+            ativo BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            ncm TEXT,
+            unidade TEXT DEFAULT 'UN',
+            codigo_fornecedor TEXT,
+            preco_custo REAL DEFAULT 0,
+            margem_lucro REAL DEFAULT 0,
+            fornecedor_id INTEGER,
+            foto_url TEXT,
+            marca TEXT
+        )
+    ''')
+    _garantir_colunas(cursor, 'produtos', [
+        ('ncm', 'TEXT'),
+        ('unidade', "TEXT DEFAULT 'UN'"),
+        ('codigo_fornecedor', 'TEXT'),
+        ('preco_custo', 'REAL DEFAULT 0'),
+        ('margem_lucro', 'REAL DEFAULT 0'),
+        ('fornecedor_id', 'INTEGER'),
+        ('foto_url', 'TEXT'),
+        ('marca', 'TEXT'),
+    ])
+
+    # Tabela de vendas
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS vendas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cliente_id INTEGER,
+            total REAL NOT NULL,
+            forma_pagamento TEXT NOT NULL,
+            desconto REAL DEFAULT 0,
+            observacoes TEXT,
+            data_venda TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            usuario_id INTEGER,
+            FOREIGN KEY (cliente_id) REFERENCES clientes (id),
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+        )
+    ''')
+
+    # Tabela de itens de venda
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS itens_venda (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            venda_id INTEGER NOT NULL,
+            produto_id INTEGER NOT NULL,
+            quantidade INTEGER NOT NULL,
+            preco_unitario REAL NOT NULL,
+            subtotal REAL NOT NULL,
+            FOREIGN KEY (venda_id) REFERENCES vendas (id),
+            FOREIGN KEY (produto_id) REFERENCES produtos (id)
+        )
+    ''')
+
+    # Tabela de contas a pagar
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS contas_pagar (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            descricao TEXT NOT NULL,
+            valor REAL NOT NULL,
+            data_vencimento DATE NOT NULL,
+            data_pagamento DATE,
+            status TEXT DEFAULT 'pendente',
+            categoria TEXT,
+            observacoes TEXT,
+            fornecedor_id INTEGER,
+            lancamento_financeiro_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (fornecedor_id) REFERENCES fornecedores (id),
+            FOREIGN KEY (lancamento_financeiro_id) REFERENCES lancamentos_financeiros (id)
+        )
+    ''')
+    _garantir_colunas(cursor, 'contas_pagar', [
+        ('fornecedor_id', 'INTEGER'),
+        ('lancamento_financeiro_id', 'INTEGER'),
+    ])
+
+    # Tabela de contas a receber
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS contas_receber (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            descricao TEXT NOT NULL,
+            valor REAL NOT NULL,
+            data_vencimento DATE NOT NULL,
+            data_recebimento DATE,
+            status TEXT DEFAULT 'pendente',
+            cliente_id INTEGER,
+            venda_id INTEGER,
+            observacoes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (cliente_id) REFERENCES clientes (id),
+            FOREIGN KEY (venda_id) REFERENCES vendas (id)
+        )
+    ''')
+
+    # Tabela de orçamentos
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS orcamentos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            numero_orcamento TEXT UNIQUE NOT NULL,
+            cliente_id INTEGER,
+            total REAL NOT NULL DEFAULT 0,
+            desconto REAL DEFAULT 0,
+            observacoes TEXT,
+            status TEXT DEFAULT 'pendente',
+            data_validade DATE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            usuario_id INTEGER,
+            FOREIGN KEY (cliente_id) REFERENCES clientes (id),
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+        )
+    ''')
+
+    # Tabela de itens de orçamento
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS itens_orcamento (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            orcamento_id INTEGER NOT NULL,
+            produto_id INTEGER NOT NULL,
+            quantidade INTEGER NOT NULL,
+            preco_unitario REAL NOT NULL,
+            subtotal REAL NOT NULL,
+            FOREIGN KEY (orcamento_id) REFERENCES orcamentos (id),
+            FOREIGN KEY (produto_id) REFERENCES produtos (id)
+        )
+    ''')
+
+    # Tabela de caixa - movimentações financeiras
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS caixa_movimentacoes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo TEXT NOT NULL, -- 'entrada', 'saida'
+            categoria TEXT NOT NULL, -- 'venda', 'conta_paga', 'conta_recebida', 'despesa', 'receita'
+            descricao TEXT NOT NULL,
+            valor REAL NOT NULL,
+            data_movimentacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            usuario_id INTEGER NOT NULL,
+            venda_id INTEGER, -- Link com venda se aplicável
+            conta_pagar_id INTEGER, -- Link com conta a pagar se aplicável
+            conta_receber_id INTEGER, -- Link com conta a receber se aplicável
+            observacoes TEXT,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id),
+            FOREIGN KEY (venda_id) REFERENCES vendas (id),
+            FOREIGN KEY (conta_pagar_id) REFERENCES contas_pagar (id),
+            FOREIGN KEY (conta_receber_id) REFERENCES contas_receber (id)
+        )
+    ''')
+
+    # Tabela de abertura/fechamento de caixa
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS caixa_sessoes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            data_abertura TIMESTAMP NOT NULL,
+            data_fechamento TIMESTAMP,
+            saldo_inicial REAL NOT NULL DEFAULT 0,
+            saldo_final REAL,
+            total_entradas REAL DEFAULT 0,
+            total_saidas REAL DEFAULT 0,
+            usuario_abertura INTEGER NOT NULL,
+            usuario_fechamento INTEGER,
+            status TEXT DEFAULT 'aberto', -- 'aberto', 'fechado'
+            observacoes_abertura TEXT,
+            observacoes_fechamento TEXT,
+            FOREIGN KEY (usuario_abertura) REFERENCES usuarios (id),
+            FOREIGN KEY (usuario_fechamento) REFERENCES usuarios (id)
+        )
+    ''')
+
+    # Tabela de lançamentos financeiros
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS lancamentos_financeiros (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo TEXT NOT NULL, -- 'receita', 'despesa'
+            categoria TEXT NOT NULL, -- 'combustivel', 'energia', 'telefone', 'aluguel', etc
+            descricao TEXT NOT NULL,
+            valor REAL NOT NULL,
+            data_lancamento DATE NOT NULL,
+            data_vencimento DATE,
+            data_pagamento DATE,
+            status TEXT DEFAULT 'pendente', -- 'pendente', 'pago', 'cancelado'
+            forma_pagamento TEXT,
+            numero_documento TEXT,
+            fornecedor_cliente TEXT,
+            usuario_id INTEGER NOT NULL,
+            observacoes TEXT,
+            conta_pagar_id INTEGER,
+            conta_receber_id INTEGER,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id),
+            FOREIGN KEY (conta_pagar_id) REFERENCES contas_pagar (id),
+            FOREIGN KEY (conta_receber_id) REFERENCES contas_receber (id)
+        )
+    ''')
+    _garantir_colunas(cursor, 'lancamentos_financeiros', [
+        ('conta_pagar_id', 'INTEGER'),
+        ('conta_receber_id', 'INTEGER'),
+    ])
+
+    # Tabela de fornecedores
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fornecedores (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT NOT NULL,
+            cnpj TEXT UNIQUE,
+            telefone TEXT,
+            email TEXT,
+            endereco TEXT,
+            cidade TEXT,
+            estado TEXT,
+            cep TEXT,
+            contato_pessoa TEXT,
+            observacoes TEXT,
+            ativo BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Tabela de configurações da empresa
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS configuracoes_empresa (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome_empresa TEXT NOT NULL DEFAULT 'FG AUTO PEÇAS',
+            cnpj TEXT,
+            endereco TEXT DEFAULT 'Rua Exemplo, 123 - Centro',
+            cidade TEXT,
+            estado TEXT,
+            cep TEXT,
+            telefone TEXT DEFAULT '(00) 0000-0000',
+            email TEXT DEFAULT 'contato@fgautopecas.com.br',
+            website TEXT,
+            logo_path TEXT DEFAULT 'logo.jpg',
+            observacoes TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Inserir configuração padrão se não existir
+    cursor.execute("SELECT COUNT(*) FROM configuracoes_empresa")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute('''
+            INSERT INTO configuracoes_empresa (nome_empresa, endereco, telefone, email)
+            VALUES (?, ?, ?, ?)
+        ''', ('FG AUTO PEÇAS', 'Rua Exemplo, 123 - Centro', '(00) 0000-0000', 'contato@fgautopecas.com.br'))
+
+
+def _migracao_002_indices(cursor):
+    """Índices secundários para as consultas mais frequentes"""
+    indices = [
+        # Vendas e itens
+        "CREATE INDEX IF NOT EXISTS idx_itens_venda_venda ON itens_venda (venda_id)",
+        "CREATE INDEX IF NOT EXISTS idx_itens_venda_produto ON itens_venda (produto_id)",
+        "CREATE INDEX IF NOT EXISTS idx_vendas_data ON vendas (data_venda)",
+        "CREATE INDEX IF NOT EXISTS idx_vendas_cliente ON vendas (cliente_id)",
+        # Caixa
+        "CREATE INDEX IF NOT EXISTS idx_caixa_mov_venda ON caixa_movimentacoes (venda_id)",
+        "CREATE INDEX IF NOT EXISTS idx_caixa_mov_data ON caixa_movimentacoes (data_movimentacao)",
+        "CREATE INDEX IF NOT EXISTS idx_caixa_sessoes_status ON caixa_sessoes (status)",
+        # Contas e lançamentos
+        "CREATE INDEX IF NOT EXISTS idx_contas_pagar_status_venc ON contas_pagar (status, data_vencimento)",
+        "CREATE INDEX IF NOT EXISTS idx_contas_receber_status_venc ON contas_receber (status, data_vencimento)",
+        "CREATE INDEX IF NOT EXISTS idx_contas_receber_venda ON contas_receber (venda_id)",
+        "CREATE INDEX IF NOT EXISTS idx_lancamentos_data ON lancamentos_financeiros (data_lancamento)",
+        "CREATE INDEX IF NOT EXISTS idx_lancamentos_status_venc ON lancamentos_financeiros (status, data_vencimento)",
+        # Produtos e fornecedores (listagens só mostram registros ativos)
+        "CREATE INDEX IF NOT EXISTS idx_produtos_codigo_fornecedor ON produtos (codigo_fornecedor)",
+        "CREATE INDEX IF NOT EXISTS idx_produtos_fornecedor ON produtos (fornecedor_id)",
+        "CREATE INDEX IF NOT EXISTS idx_produtos_ativos_nome ON produtos (nome) WHERE ativo = 1",
+        "CREATE INDEX IF NOT EXISTS idx_fornecedores_ativos_nome ON fornecedores (nome) WHERE ativo = 1",
+        # Orçamentos
+        "CREATE INDEX IF NOT EXISTS idx_itens_orcamento_orcamento ON itens_orcamento (orcamento_id)",
+        "CREATE INDEX IF NOT EXISTS idx_orcamentos_created ON orcamentos (created_at)",
+        # Cadastros
+        "CREATE INDEX IF NOT EXISTS idx_usuarios_email ON usuarios (email)",
+        "CREATE INDEX IF NOT EXISTS idx_clientes_nome ON clientes (nome)",
+    ]
+    for sql in indices:
+        cursor.execute(sql)
+
+
+def _migracao_003_dia_comercial(cursor):
+    """Datas no horário local e colunas de dia comercial indexadas para filtros por período"""
+    # Registros gravados pelo DEFAULT CURRENT_TIMESTAMP estão em UTC e sem fração de
+    # segundos; os gravados pelo Python (datetime.now()) já estão no horário local
+    cursor.execute('''
+        UPDATE vendas SET data_venda = datetime(data_venda, 'localtime')
+        WHERE length(data_venda) = 19
+    ''')
+    cursor.execute('''
+        UPDATE caixa_movimentacoes SET data_movimentacao = datetime(data_movimentacao, 'localtime')
+        WHERE length(data_movimentacao) = 19
+    ''')
+
+    # Colunas de data pura guardam somente 'YYYY-MM-DD' para serem comparadas diretamente
+    colunas_data = [
+        ('contas_pagar', 'data_vencimento'),
+        ('contas_pagar', 'data_pagamento'),
+        ('contas_receber', 'data_vencimento'),
+        ('contas_receber', 'data_recebimento'),
+        ('lancamentos_financeiros', 'data_lancamento'),
+        ('lancamentos_financeiros', 'data_vencimento'),
+        ('lancamentos_financeiros', 'data_pagamento'),
+    ]
+    for tabela, coluna in colunas_data:
+        cursor.execute(f'''
+            UPDATE {tabela} SET {coluna} = date({coluna})
+            WHERE length({coluna}) > 10 AND date({coluna}) IS NOT NULL
+        ''')
+
+    # Dia comercial derivado da data local (coluna virtual, só ocupa espaço no índice)
+    if 'dia_venda' not in _colunas_da_tabela(cursor, 'vendas'):
+        cursor.execute(
+            "ALTER TABLE vendas ADD COLUMN dia_venda TEXT "
+            "GENERATED ALWAYS AS (substr(data_venda, 1, 10)) VIRTUAL"
+        )
+    if 'dia_movimentacao' not in _colunas_da_tabela(cursor, 'caixa_movimentacoes'):
+        cursor.execute(
+            "ALTER TABLE caixa_movimentacoes ADD COLUMN dia_movimentacao TEXT "
+            "GENERATED ALWAYS AS (substr(data_movimentacao, 1, 10)) VIRTUAL"
+        )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_vendas_dia ON vendas (dia_venda)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_caixa_mov_dia ON caixa_movimentacoes (dia_movimentacao)")
+
+
+def _migracao_004_busca_produtos(cursor):
+    """Índice FTS5 de produtos (sem acentos, com prefixos) sincronizado por triggers"""
+    colunas = 'nome, descricao, marca, codigo_barras, codigo_fornecedor, categoria'
+    try:
+        cursor.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS produtos_fts USING fts5(
+                {colunas},
+                content='produtos',
+                content_rowid='id',
+                tokenize="unicode61 remove_diacritics 2",
+                prefix='2 3'
+            )
+        ''')
+    except Exception as e:
+        # SQLite compilado sem FTS5: a busca de produtos cai no LIKE
+        print(f"Aviso: FTS5 indisponível, índice de busca de produtos não criado: {e}")
+        return
+
+    valores_novos = ', '.join(f'new.{c.strip()}' for c in colunas.split(','))
+    valores_antigos = ', '.join(f'old.{c.strip()}' for c in colunas.split(','))
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_produtos_fts_insert AFTER INSERT ON produtos BEGIN
+            INSERT INTO produtos_fts (rowid, {colunas}) VALUES (new.id, {valores_novos});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_produtos_fts_delete AFTER DELETE ON produtos BEGIN
+            INSERT INTO produtos_fts (produtos_fts, rowid, {colunas}) VALUES ('delete', old.id, {valores_antigos});
+        END
+    ''')
+    # Só dispara quando colunas indexadas mudam (baixas de estoque não tocam no índice)
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_produtos_fts_update AFTER UPDATE OF {colunas} ON produtos BEGIN
+            INSERT INTO produtos_fts (produtos_fts, rowid, {colunas}) VALUES ('delete', old.id, {valores_antigos});
+            INSERT INTO produtos_fts (rowid, {colunas}) VALUES (new.id, {valores_novos});
+        END
+    ''')
+    cursor.execute("INSERT INTO produtos_fts (produtos_fts) VALUES ('rebuild')")
+
+
+def _migracao_005_codigo_fornecedor_normalizado(cursor):
+    """Código do fornecedor normalizado (maiúsculo, sem espaços/pontuação) indexado para leitura por scanner"""
+    if 'codigo_fornecedor_norm' not in _colunas_da_tabela(cursor, 'produtos'):
+        # Mesma regra de logica_banco.normalizar_codigo
+        cursor.execute('''
+            ALTER TABLE produtos ADD COLUMN codigo_fornecedor_norm TEXT
+            GENERATED ALWAYS AS (
+                upper(replace(replace(replace(replace(replace(
+                    codigo_fornecedor, ' ', ''), '-', ''), '.', ''), '/', ''), '_', ''))
+            ) VIRTUAL
+        ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_produtos_codigo_fornecedor_norm
+        ON produtos (codigo_fornecedor_norm) WHERE codigo_fornecedor_norm IS NOT NULL
+    ''')
+
+
+def _criar_triggers_alteracoes(cursor, tabela):
+    """Registra em alteracoes cada INSERT/UPDATE/DELETE da tabela (coerência dos caches entre workers)"""
+    for evento, registro in (('INSERT', 'new.id'), ('UPDATE', 'new.id'), ('DELETE', 'old.id')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{tabela}_alteracoes_{evento.lower()}
+            AFTER {evento} ON {tabela} BEGIN
+                INSERT INTO alteracoes (tabela, registro_id) VALUES ('{tabela}', {registro});
+            END
+        ''')
+
+
+def _migracao_006_registro_alteracoes(cursor):
+    """Registro de alterações lido pelos workers para manter os caches em memória coerentes"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS alteracoes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tabela TEXT NOT NULL,
+            registro_id INTEGER
+        )
+    ''')
+    # Poda automática: a cada 1000 alterações mantém apenas as 10000 mais recentes
+    # (um worker que ficar mais atrás que isso descarta os caches inteiros)
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_alteracoes_poda
+        AFTER INSERT ON alteracoes WHEN new.seq % 1000 = 0 BEGIN
+            DELETE FROM alteracoes WHERE seq <= new.seq - 10000;
+        END
+    ''')
+    for tabela in ('produtos', 'usuarios', 'configuracoes_empresa'):
+        _criar_triggers_alteracoes(cursor, tabela)
+
+
+
+def _migracao_007_idempotencia_vendas(cursor):
+    """Chaves de idempotência enviadas pelo PDV: reenvios da mesma venda devolvem a venda original"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS vendas_idempotencia (
+            chave TEXT PRIMARY KEY,
+            venda_id INTEGER NOT NULL,
+            usuario_id INTEGER,
+            criada_em TIMESTAMP NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    # Usado pela limpeza das chaves vencidas
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_vendas_idempotencia_criada_em ON vendas_idempotencia (criada_em)"
+    )
+
+
+def _migracao_008_eventos_caixa(cursor):
+    """Outbox do caixa: cada venda à vista grava um evento na mesma transação; o reconciliador lança os pendentes"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS caixa_eventos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            venda_id INTEGER NOT NULL,
+            criado_em TIMESTAMP NOT NULL,
+            processado_em TIMESTAMP,
+            resultado TEXT
+        )
+    ''')
+    # Índice parcial: o reconciliador só lê os eventos pendentes
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_caixa_eventos_pendentes
+        ON caixa_eventos (id) WHERE processado_em IS NULL
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_caixa_eventos_venda ON caixa_eventos (venda_id)")
+
+
+# Recalcula o resumo diário a partir de vendas/itens_venda (quem usa acrescenta WHERE e o GROUP BY)
+SQL_RECONSTRUIR_RESUMO_VENDAS = '''
+    INSERT INTO vendas_resumo_diario (
+        dia, forma_pagamento, usuario_id, quantidade_vendas,
+        valor_bruto, valor_desconto, valor_total, itens_vendidos
+    )
+    SELECT v.dia_venda, COALESCE(v.forma_pagamento, ''), COALESCE(v.usuario_id, 0), COUNT(*),
+           SUM(COALESCE(v.total, 0) + COALESCE(v.desconto, 0)), SUM(COALESCE(v.desconto, 0)),
+           SUM(COALESCE(v.total, 0)),
+           SUM((SELECT COALESCE(SUM(iv.quantidade), 0) FROM itens_venda iv WHERE iv.venda_id = v.id))
+    FROM vendas v
+    WHERE v.dia_venda IS NOT NULL
+'''
+
+
+def _migracao_009_resumo_diario_vendas(cursor):
+    """Resumo diário de vendas por (dia, forma de pagamento, vendedor), mantido junto com cada venda"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS vendas_resumo_diario (
+            dia TEXT NOT NULL,
+            forma_pagamento TEXT NOT NULL,
+            usuario_id INTEGER NOT NULL,
+            quantidade_vendas INTEGER NOT NULL DEFAULT 0,
+            valor_bruto REAL NOT NULL DEFAULT 0,
+            valor_desconto REAL NOT NULL DEFAULT 0,
+            valor_total REAL NOT NULL DEFAULT 0,
+            itens_vendidos INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (dia, forma_pagamento, usuario_id)
+        ) WITHOUT ROWID
+    ''')
+    # Carga inicial a partir das vendas existentes
+    cursor.execute("DELETE FROM vendas_resumo_diario")
+    cursor.execute(SQL_RECONSTRUIR_RESUMO_VENDAS + " GROUP BY 1, 2, 3")
+
+
+def _migracao_010_alteracoes_dashboard(cursor):
+    """Registra também as alterações das tabelas resumidas pelo dashboard (invalidação do cache do painel)"""
+    for tabela in ('clientes', 'fornecedores', 'vendas', 'contas_pagar', 'contas_receber'):
+        _criar_triggers_alteracoes(cursor, tabela)
+
+
+def _migracao_011_eventos_tempo_real(cursor):
+    """Eventos de venda/caixa gravados na transação de escrita e repassados aos navegadores via SSE"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS eventos_tempo_real (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo TEXT NOT NULL,
+            dados TEXT NOT NULL,
+            criado_em TIMESTAMP NOT NULL
+        )
+    ''')
+    # Poda automática: a cada 500 eventos mantém os 2000 mais recentes (reconexões só precisam do final)
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_eventos_tempo_real_poda
+        AFTER INSERT ON eventos_tempo_real WHEN new.seq % 500 = 0 BEGIN
+            DELETE FROM eventos_tempo_real WHERE seq <= new.seq - 2000;
+        END
+    ''')
+
+
+def _migracao_012_totais_sessao_caixa(cursor):
+    """Movimentações ligadas à sessão do caixa e totais correntes mantidos na própria sessão"""
+    _garantir_colunas(cursor, 'caixa_movimentacoes', [
+        ('sessao_id', 'INTEGER REFERENCES caixa_sessoes (id)'),
+    ])
+    _garantir_colunas(cursor, 'caixa_sessoes', [
+        ('total_movimentacoes', 'INTEGER DEFAULT 0'),
+        ('saldo_atual', 'REAL'),
+    ])
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_caixa_mov_sessao ON caixa_movimentacoes (sessao_id)")
+
+    # Movimentações antigas: pertencem à sessão aberta no momento em que foram feitas
+    cursor.execute('''
+        UPDATE caixa_movimentacoes SET sessao_id = (
+            SELECT s.id FROM caixa_sessoes s
+            WHERE caixa_movimentacoes.data_movimentacao >= s.data_abertura
+            AND (s.data_fechamento IS NULL OR caixa_movimentacoes.data_movimentacao <= s.data_fechamento)
+            ORDER BY s.data_abertura DESC
+            LIMIT 1
+        )
+        WHERE sessao_id IS NULL
+    ''')
+
+    # Totais correntes: recalculados para as sessões abertas, contagem preenchida para as fechadas
+    cursor.execute('''
+        UPDATE caixa_sessoes SET
+            total_entradas = CASE WHEN status = 'aberto' THEN (
+                SELECT COALESCE(SUM(valor), 0) FROM caixa_movimentacoes
+                WHERE sessao_id = caixa_sessoes.id AND tipo = 'entrada'
+            ) ELSE COALESCE(total_entradas, 0) END,
+            total_saidas = CASE WHEN status = 'aberto' THEN (
+                SELECT COALESCE(SUM(valor), 0) FROM caixa_movimentacoes
+                WHERE sessao_id = caixa_sessoes.id AND tipo = 'saida'
+            ) ELSE COALESCE(total_saidas, 0) END,
+            total_movimentacoes = (SELECT COUNT(*) FROM caixa_movimentacoes WHERE sessao_id = caixa_sessoes.id)
+    ''')
+    cursor.execute('''
+        UPDATE caixa_sessoes
+        SET saldo_atual = COALESCE(saldo_final, saldo_inicial + total_entradas - total_saidas)
+    ''')
+
+    # Cada movimentação atualiza os totais da sessão aberta no mesmo comando (fechadas ficam congeladas)
+    for evento, linha, sinal in (('INSERT', 'new', '+'), ('DELETE', 'old', '-')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_caixa_mov_totais_{evento.lower()}
+            AFTER {evento} ON caixa_movimentacoes
+            WHEN {linha}.sessao_id IS NOT NULL BEGIN
+                UPDATE caixa_sessoes SET
+                    total_entradas = total_entradas {sinal} CASE WHEN {linha}.tipo = 'entrada' THEN {linha}.valor ELSE 0 END,
+                    total_saidas = total_saidas {sinal} CASE WHEN {linha}.tipo = 'saida' THEN {linha}.valor ELSE 0 END,
+                    total_movimentacoes = total_movimentacoes {sinal} 1,
+                    saldo_atual = saldo_atual {sinal} CASE
+                        WHEN {linha}.tipo = 'entrada' THEN {linha}.valor
+                        WHEN {linha}.tipo = 'saida' THEN -{linha}.valor
+                        ELSE 0
+                    END
+                WHERE id = {linha}.sessao_id AND status = 'aberto';
+            END
+        ''')
+
+
+def _migracao_013_caixa_por_terminal(cursor):
+    """Uma sessão de caixa aberta por terminal (PDV); vendas e movimentações vão para a sessão do seu terminal"""
+    # 'principal' é o terminal padrão (logica_banco.TERMINAL_PADRAO)
+    _garantir_colunas(cursor, 'caixa_sessoes', [
+        ('terminal', "TEXT NOT NULL DEFAULT 'principal'"),
+    ])
+    _garantir_colunas(cursor, 'caixa_eventos', [
+        ('terminal', 'TEXT'),
+    ])
+    # Bancos antigos não deveriam ter mais de uma sessão aberta; se tiverem, cada extra vira um terminal próprio
+    cursor.execute('''
+        UPDATE caixa_sessoes SET terminal = terminal || '-' || id
+        WHERE status = 'aberto'
+        AND id NOT IN (SELECT MAX(id) FROM caixa_sessoes WHERE status = 'aberto' GROUP BY terminal)
+    ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_caixa_sessoes_terminal_aberto
+        ON caixa_sessoes (terminal) WHERE status = 'aberto'
+    ''')
+
+
+def _migracao_014_fechamentos_caixa(cursor):
+    """Retrato imutável de cada sessão de caixa fechada (totais agrupados e movimentações serializadas)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS caixa_fechamentos (
+            sessao_id INTEGER PRIMARY KEY REFERENCES caixa_sessoes (id),
+            terminal TEXT NOT NULL,
+            data_abertura TIMESTAMP NOT NULL,
+            data_fechamento TIMESTAMP NOT NULL,
+            dia_fechamento TEXT GENERATED ALWAYS AS (substr(data_fechamento, 1, 10)) VIRTUAL,
+            usuario_abertura INTEGER,
+            usuario_fechamento INTEGER,
+            saldo_inicial REAL NOT NULL,
+            saldo_final REAL NOT NULL,
+            total_entradas REAL NOT NULL,
+            total_saidas REAL NOT NULL,
+            total_movimentacoes INTEGER NOT NULL,
+            totais_categoria TEXT NOT NULL,
+            totais_forma_pagamento TEXT NOT NULL,
+            totais_usuario TEXT NOT NULL,
+            movimentacoes TEXT NOT NULL,
+            gerado_em TIMESTAMP NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_caixa_fechamentos_dia ON caixa_fechamentos (dia_fechamento)")
+    # O retrato é gravado uma vez, na transação do fechamento, e nunca mais muda
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_caixa_fechamentos_imutavel_update
+        BEFORE UPDATE ON caixa_fechamentos BEGIN
+            SELECT RAISE(ABORT, 'Fechamento de caixa não pode ser alterado');
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_caixa_fechamentos_imutavel_delete
+        BEFORE DELETE ON caixa_fechamentos BEGIN
+            SELECT RAISE(ABORT, 'Fechamento de caixa não pode ser excluído');
+        END
+    ''')
+
+
+def _migracao_015_indices_grade(cursor):
+    """Índices das ordenações da grade paginada por chave (a chave ordenada + id vira busca no índice)"""
+    indices = [
+        "CREATE INDEX IF NOT EXISTS idx_produtos_ativos_preco ON produtos (preco) WHERE ativo = 1",
+        "CREATE INDEX IF NOT EXISTS idx_produtos_ativos_estoque ON produtos (estoque) WHERE ativo = 1",
+        # A grade ordena orçamentos pela data sem NULL (mesma expressão da consulta)
+        "CREATE INDEX IF NOT EXISTS idx_orcamentos_created_chave ON orcamentos (COALESCE(created_at, ''))",
+    ]
+    for sql in indices:
+        cursor.execute(sql)
+
+
+def _migracao_016_busca_clientes(cursor):
+    """Índices de prefixo para o seletor de clientes: nome sem distinção de maiúsculas, CPF/CNPJ e telefone só com dígitos"""
+    colunas = _colunas_da_tabela(cursor, 'clientes')
+    if 'documento_digitos' not in colunas:
+        cursor.execute('''
+            ALTER TABLE clientes ADD COLUMN documento_digitos TEXT
+            GENERATED ALWAYS AS (
+                replace(replace(replace(replace(cpf_cnpj, '.', ''), '-', ''), '/', ''), ' ', '')
+            ) VIRTUAL
+        ''')
+    if 'telefone_digitos' not in colunas:
+        cursor.execute('''
+            ALTER TABLE clientes ADD COLUMN telefone_digitos TEXT
+            GENERATED ALWAYS AS (
+                replace(replace(replace(replace(replace(replace(
+                    telefone, '(', ''), ')', ''), '-', ''), ' ', ''), '.', ''), '+', '')
+            ) VIRTUAL
+        ''')
+    # NOCASE: o LIKE 'prefixo%' (sem distinção de maiúsculas) só usa índice com essa collation
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_clientes_nome_nocase ON clientes (nome COLLATE NOCASE)")
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_clientes_documento_digitos
+        ON clientes (documento_digitos) WHERE documento_digitos IS NOT NULL
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_clientes_telefone_digitos
+        ON clientes (telefone_digitos) WHERE telefone_digitos IS NOT NULL
+    ''')
+
+
+def _migracao_017_importacoes_nfe(cursor):
+    """Fila de importações de NFe: o envio grava a tarefa e a thread de importação processa e informa o andamento"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS importacoes_nfe (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT NOT NULL DEFAULT 'pendente',
+            etapa TEXT,
+            arquivos TEXT NOT NULL,
+            parametros TEXT NOT NULL,
+            usuario_id INTEGER,
+            criado_em TIMESTAMP NOT NULL,
+            iniciado_em TIMESTAMP,
+            atualizado_em TIMESTAMP,
+            concluido_em TIMESTAMP,
+            arquivos_processados INTEGER NOT NULL DEFAULT 0,
+            arquivos_com_erro INTEGER NOT NULL DEFAULT 0,
+            itens_lidos INTEGER NOT NULL DEFAULT 0,
+            produtos_importados INTEGER NOT NULL DEFAULT 0,
+            produtos_atualizados INTEGER NOT NULL DEFAULT 0,
+            produtos_ignorados INTEGER NOT NULL DEFAULT 0,
+            total_erros INTEGER NOT NULL DEFAULT 0,
+            erros TEXT,
+            erro TEXT
+        )
+    ''')
+    # A thread de importação procura as tarefas pela situação, na ordem de chegada
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_importacoes_nfe_status ON importacoes_nfe (status, id)")
+
+
+def _migracao_018_notas_importadas(cursor):
+    """Registro das NF-e já importadas (chave de acesso, itens e hash do arquivo): a mesma nota não soma estoque duas vezes"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS nfe_importadas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chave_acesso TEXT UNIQUE,
+            hash_conteudo TEXT NOT NULL,
+            itens INTEGER NOT NULL,
+            emitente_cnpj TEXT,
+            arquivo TEXT,
+            importado_em TIMESTAMP NOT NULL
+        )
+    ''')
+    # Notas sem chave de acesso (XML fora do padrão) são reconhecidas pelo hash do arquivo;
+    # as duas colunas no índice para a busca (hash, chave IS NULL) não cair no índice da chave
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_nfe_importadas_hash
+        ON nfe_importadas (hash_conteudo, chave_acesso)
+    ''')
+    _garantir_colunas(cursor, 'importacoes_nfe', [
+        ('notas_importadas', 'INTEGER NOT NULL DEFAULT 0'),
+        ('notas_duplicadas', 'INTEGER NOT NULL DEFAULT 0'),
+    ])
+
+
+
+def _migracao_019_indice_estoque_grade(cursor):
+    """Grade ordena produtos por estoque sem NULL: o índice passa a ser da mesma expressão da consulta"""
+    cursor.execute("DROP INDEX IF EXISTS idx_produtos_ativos_estoque")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_produtos_ativos_estoque ON produtos (COALESCE(estoque, 0)) WHERE ativo = 1"
+    )
+
+
+# Lista ordenada de migrações: (versão, nome, função)
+MIGRACOES = [
+    (1, 'esquema_base', _migracao_001_esquema_base),
+    (2, 'indices_consultas', _migracao_002_indices),
+    (3, 'dia_comercial', _migracao_003_dia_comercial),
+    (4, 'busca_produtos_fts', _migracao_004_busca_produtos),
+    (5, 'codigo_fornecedor_normalizado', _migracao_005_codigo_fornecedor_normalizado),
+    (6, 'registro_alteracoes', _migracao_006_registro_alteracoes),
+    (7, 'idempotencia_vendas', _migracao_007_idempotencia_vendas),
+    (8, 'eventos_caixa', _migracao_008_eventos_caixa),
+    (9, 'resumo_diario_vendas', _migracao_009_resumo_diario_vendas),
+    (10, 'alteracoes_dashboard', _migracao_010_alteracoes_dashboard),
+    (11, 'eventos_tempo_real', _migracao_011_eventos_tempo_real),
+    (12, 'totais_sessao_caixa', _migracao_012_totais_sessao_caixa),
+    (13, 'caixa_por_terminal', _migracao_013_caixa_por_terminal),
+    (14, 'fechamentos_caixa', _migracao_014_fechamentos_caixa),
+    (15, 'indices_grade', _migracao_015_indices_grade),
+    (16, 'busca_clientes', _migracao_016_busca_clientes),
+    (17, 'importacoes_nfe', _migracao_017_importacoes_nfe),
+    (18, 'notas_importadas', _migracao_018_notas_importadas),
+    (19, 'indice_estoque_grade', _migracao_019_indice_estoque_grade),
+]
+
+VERSAO_ATUAL = MIGRACOES[-1][0]
+
+
+def obter_versao_esquema(conn):
+    """Retorna a versão do esquema do banco (0 se nunca migrado)"""
+    try:
+        linha = conn.execute("SELECT MAX(versao) FROM schema_version").fetchone()
+        return linha[0] or 0
+    except Exception:
+        return 0
+
+
+def aplicar_migracoes(conn):
+    """Leva o banco até a versão mais recente; retorna a lista de migrações aplicadas"""
+    if obter_versao_esquema(conn) >= VERSAO_ATUAL:
+        return []
+
+    cursor = conn.cursor()
+    aplicadas = []
+    # BEGIN IMMEDIATE serializa workers que sobem ao mesmo tempo; a versão é
+    # relida depois de obter o lock para não aplicar a mesma migração duas vezes
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                versao INTEGER PRIMARY KEY,
+                nome TEXT NOT NULL,
+                aplicada_em TIMESTAMP NOT NULL
+            )
+        ''')
+        versao = obter_versao_esquema(conn)
+        for numero, nome, migracao in MIGRACOES:
+            if numero <= versao:
+                continue
+            migracao(cursor)
+            cursor.execute(
+                "INSERT INTO schema_version (versao, nome, aplicada_em) VALUES (?, ?, ?)",
+                (numero, nome, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            )
+            aplicadas.append(nome)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    if aplicadas:
+        # Atualiza as estatísticas do planejador para os índices novos
+        # (analysis_limit mantém o ANALYZE rápido mesmo em bancos grandes)
+        conn.execute("PRAGMA analysis_limit=1000")
+        conn.execute("ANALYZE")
+        conn.commit()
+        print(f"Migrações aplicadas: {', '.join(aplicadas)}")
+    return aplicadas
@@ -1,5 +1,6 @@
 # SISTEMA DE AUTO PEÇAS
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, make_response
+import click
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, make_response, Response, stream_with_context
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from datetime import datetime, date
 import json
@@ -23,28 +24,34 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from Minha_auto_pecas.logica_banco import (
     init_db, criar_usuario_admin, verificar_usuario, buscar_usuario_por_id,
     buscar_usuario_por_email, atualizar_senha_usuario,
-    criar_usuario, listar_usuarios, editar_usuario, deletar_usuario, verificar_permissao,
-    listar_clientes, adicionar_cliente, editar_cliente, deletar_cliente,
-    listar_produtos, buscar_produto, adicionar_produto, editar_produto, deletar_produto, obter_produto_por_id,
+    criar_usuario, buscar_usuarios, editar_usuario, deletar_usuario, verificar_permissao,
+    listar_clientes, buscar_clientes, adicionar_cliente, editar_cliente, deletar_cliente,
+    listar_produtos, buscar_produto, pesquisar_produtos, buscar_produto_por_codigo, buscar_produtos_por_codigos,
+    adicionar_produto, editar_produto, deletar_produto, obter_produto_por_id,
     deletar_todos_os_produtos, limpar_completamente_produtos,
-    registrar_venda, listar_vendas, obter_vendas_do_dia, sincronizar_vendas_com_caixa, obter_venda_por_id, deletar_venda,
+    registrar_venda, buscar_venda_por_chave_idempotencia, obter_vendas_do_dia, sincronizar_vendas_com_caixa, obter_venda_por_id, deletar_venda,
     obter_configuracoes_empresa, atualizar_configuracoes_empresa,
-    listar_contas_pagar_hoje, adicionar_conta_pagar, pagar_conta,
-    listar_contas_receber_hoje, receber_conta, adicionar_conta_receber,
+    adicionar_conta_pagar, pagar_conta,
+    receber_conta, adicionar_conta_receber,
     listar_contas_pagar_por_periodo, listar_contas_receber_por_periodo,
-    obter_estatisticas_dashboard, produtos_estoque_baixo,
-    criar_orcamento, listar_orcamentos, obter_orcamento, converter_orcamento_em_venda, atualizar_orcamento, excluir_orcamento,
+    obter_painel_dashboard, PAINEIS_DASHBOARD,
+    consultar_grade, GRADES,
+    iterar_itens_vendas, CABECALHO_EXPORTACAO_VENDAS,
+    criar_orcamento, obter_orcamento, converter_orcamento_em_venda, atualizar_orcamento, excluir_orcamento,
     popular_dados_exemplo,
     # Novas funções do caixa
     abrir_caixa, fechar_caixa, registrar_movimentacao_caixa, obter_status_caixa,
-    listar_movimentacoes_caixa, criar_lancamento_financeiro, listar_lancamentos_financeiros,
+    listar_movimentacoes_caixa, obter_resumo_caixas, TERMINAL_PADRAO,
+    listar_fechamentos_caixa, obter_fechamento_caixa, obter_conciliacao_caixa_mes, criar_lancamento_financeiro, listar_lancamentos_financeiros,
     # Função de importação XML
     importar_produtos_de_xml,
+    importar_produtos_de_nfes_em_lote, listar_nfes_do_zip, listar_nfes_do_diretorio,
+    diretorio_importacoes_nfe, enfileirar_importacao_nfe, obter_importacao_nfe, iniciar_fila_importacoes_nfe,
     # Funções de relatórios
     gerar_relatorio_vendas, gerar_relatorio_produtos_mais_vendidos,
     gerar_relatorio_estoque, gerar_relatorio_financeiro,
     # Funções de fornecedores
-    listar_fornecedores, buscar_fornecedor, adicionar_fornecedor, editar_fornecedor, 
+    buscar_fornecedor, adicionar_fornecedor, editar_fornecedor, 
     deletar_fornecedor, obter_fornecedores_para_select, contar_fornecedores, listar_produtos_por_fornecedor,
     # Funções de sincronização financeira
     sincronizar_lancamentos_com_contas,
@@ -53,12 +60,30 @@ from Minha_auto_pecas.logica_banco import (
     # Nova função para vendas por período
     listar_vendas_por_periodo,
     # Função para limpar sincronizações incorretas
-    limpar_sincronizacoes_incorretas
+    limpar_sincronizacoes_incorretas, iniciar_reconciliador_caixa,
+    # Pool de conexões e caches em memória
+    obter_estatisticas_pool, obter_estatisticas_caches, validar_caches,
+    # Eventos em tempo real (SSE)
+    acompanhar_eventos, obter_estatisticas_eventos,
+    # Resumo diário de vendas
+    reconstruir_resumo_vendas
 )
+from Minha_auto_pecas.exportacao import gerar_csv, gerar_xlsx
 
 app = Flask(__name__)
 app.secret_key = 'sua_chave_secreta_aqui_mude_em_producao'
 
+# Os processos de leitura de NFe (forkserver/spawn) reimportam o script principal como
+# __mp_main__ quando o app roda com `python app.py`: neles não há banco a migrar nem threads
+if __name__ != '__mp_main__':
+    # Aplica migrações pendentes também quando servido pelo gunicorn
+    # (em um banco já atualizado é apenas uma consulta de versão)
+    init_db()
+    # Lança no caixa, em segundo plano, as vendas cujo evento ficou pendente
+    iniciar_reconciliador_caixa()
+    # Executa, em segundo plano, as importações de NFe enfileiradas pela tela de produtos
+    iniciar_fila_importacoes_nfe()
+
 # Configuração para upload de arquivos
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'images', 'produtos')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
@@ -160,6 +185,13 @@ def utility_processor():
         return False
     return dict(has_permission=has_permission)
 
+# Atualiza os caches em memória com o que outros workers alteraram no banco
+@app.before_request
+def validar_caches_da_requisicao():
+    """Confere o registro de alterações (uma consulta pequena) antes de cada requisição"""
+    if request.endpoint != 'static':
+        validar_caches()
+
 # Verificação de usuário ativo antes de cada requisição
 @app.before_request
 def check_user_active():
@@ -294,8 +326,8 @@ def usuarios():
         flash('Acesso negado. Você não tem permissão para gerenciar usuários.', 'error')
         return redirect(url_for('dashboard'))
     
-    usuarios_lista = listar_usuarios()
-    return render_template('usuarios.html', usuarios=usuarios_lista)
+    grade = consultar_grade('usuarios')
+    return render_template('usuarios.html', grade=grade)
 
 @app.route('/usuarios/editar/<int:user_id>', methods=['POST'])
 @login_required
@@ -398,18 +430,73 @@ def atualizar_configuracoes_empresa_route():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    estatisticas = obter_estatisticas_dashboard()
-    produtos_baixo_estoque = produtos_estoque_baixo()
-    vendas_recentes = listar_vendas(limit=10)
-    contas_pagar_hoje = listar_contas_pagar_hoje()
-    contas_receber_hoje = listar_contas_receber_hoje()
-    
-    return render_template('dashboard.html',
-                         estatisticas=estatisticas,
-                         produtos_baixo_estoque=produtos_baixo_estoque,
-                         vendas_recentes=vendas_recentes,
-                         contas_pagar_hoje=contas_pagar_hoje,
-                         contas_receber_hoje=contas_receber_hoje)
+    # A página é renderizada sem consultas; cada painel é carregado de /api/dashboard/<painel>
+    return render_template('dashboard.html', paineis=list(PAINEIS_DASHBOARD))
+
+@app.route('/api/dashboard/<painel>')
+@login_required
+def api_dashboard_painel(painel):
+    """Dados de um painel do dashboard com ETag (o navegador só recebe o corpo quando algo mudou)"""
+    if painel not in PAINEIS_DASHBOARD:
+        return jsonify({'error': 'Painel não encontrado'}), 404
+    
+    resposta = jsonify(obter_painel_dashboard(painel))
+    resposta.add_etag()
+    resposta.cache_control.private = True
+    resposta.cache_control.no_cache = True
+    return resposta.make_conditional(request)
+
+# =====================================================
+# GRADES DE DADOS (listagens paginadas no servidor)
+# =====================================================
+
+# Modelo das linhas de cada visão de grade; o mesmo partial renderiza a primeira página junto
+# com a tela e as páginas seguintes pedidas por static/js/pagination.js (GradeServidor)
+MODELOS_LINHAS_GRADE = {
+    'produtos': ('produtos', 'grade/produtos.html'),
+    'produtos_orcamento': ('produtos', 'grade/produtos_orcamento.html'),
+    'clientes': ('clientes', 'grade/clientes.html'),
+    'fornecedores': ('fornecedores', 'grade/fornecedores.html'),
+    'orcamentos': ('orcamentos', 'grade/orcamentos.html'),
+    'usuarios': ('usuarios', 'grade/usuarios.html'),
+}
+
+# Grades restritas a uma permissão (as demais seguem o acesso das próprias páginas)
+PERMISSOES_GRADE = {
+    'usuarios': 'admin',
+}
+
+def parametros_grade(nome):
+    """Lê da query string a ordenação, os filtros, a busca e o cursor de uma grade"""
+    return {
+        'ordenar': request.args.get('ordenar') or None,
+        'direcao': request.args.get('direcao') or None,
+        'busca': request.args.get('busca', ''),
+        'apos': request.args.get('apos') or None,
+        'limite': request.args.get('limite', type=int),
+        'filtros': {filtro: request.args.get(filtro) for filtro in GRADES[nome]['filtros']},
+    }
+
+@app.route('/api/grade/<visao>')
+@login_required
+def api_grade(visao):
+    """Página de uma grade (linhas em JSON e já renderizadas em HTML para a tabela da tela)"""
+    if visao not in MODELOS_LINHAS_GRADE:
+        return jsonify({'error': 'Grade não encontrada'}), 404
+    nome, modelo = MODELOS_LINHAS_GRADE[visao]
+    permissao = PERMISSOES_GRADE.get(nome)
+    if permissao and not verificar_permissao(current_user.id, permissao):
+        return jsonify({'error': 'Acesso negado'}), 403
+    
+    try:
+        pagina = consultar_grade(nome, **parametros_grade(nome))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    pagina['html'] = render_template(modelo, linhas=pagina['linhas'])
+    if request.args.get('somente_html'):
+        del pagina['linhas']
+    return jsonify(pagina)
 
 # DEMONSTRAÇÃO DO TEMA
 @app.route('/demo-theme')
@@ -421,49 +508,63 @@ def demo_theme():
 # ROTAS DO CAIXA FINANCEIRO
 # =====================================================
 
+# Cada navegador opera um terminal (PDV), guardado em cookie ao abrir o caixa
+COOKIE_TERMINAL_CAIXA = 'terminal_caixa'
+
+def nome_terminal_valido(nome):
+    """Limpa o nome de terminal informado (letras, números, espaço, - e _; até 40 caracteres)"""
+    nome = ''.join(c for c in (nome or '') if c.isalnum() or c in ' -_').strip()[:40]
+    return nome or TERMINAL_PADRAO
+
+def terminal_atual():
+    """Terminal de caixa deste navegador"""
+    return nome_terminal_valido(request.cookies.get(COOKIE_TERMINAL_CAIXA))
+
 @app.route('/caixa')
 @login_required
 @required_permission('caixa')
 def caixa():
     """Página principal do caixa"""
-    status_caixa = obter_status_caixa()
-    movimentacoes = listar_movimentacoes_caixa(20)
+    terminal = terminal_atual()
+    status_caixa = obter_status_caixa(terminal)
+    movimentacoes = listar_movimentacoes_caixa(20, terminal)
+    resumo_caixas = obter_resumo_caixas()
     
     # Usar a função específica para buscar vendas do dia
     dados_vendas = obter_vendas_do_dia()
     
-    # Debug: Imprimir dados das vendas
-    print(f"DEBUG CAIXA: dados_vendas = {dados_vendas}")
-    
     resumo_vendas = {
         'total_vendas': dados_vendas['total_vendas'],
         'valor_vendas': dados_vendas['valor_total'],
         'itens_vendidos': dados_vendas['itens_vendidos']
     }
     
-    print(f"DEBUG CAIXA: resumo_vendas = {resumo_vendas}")
-    
     return render_template('caixa.html', 
                          status_caixa=status_caixa, 
                          movimentacoes=movimentacoes,
-                         resumo_vendas=resumo_vendas)
+                         resumo_vendas=resumo_vendas,
+                         terminal=terminal,
+                         resumo_caixas=resumo_caixas)
 
 @app.route('/caixa/abrir', methods=['POST'])
 @login_required
 @required_permission('caixa')
 def abrir_caixa_route():
-    """Abrir nova sessão de caixa"""
+    """Abrir nova sessão de caixa no terminal informado"""
     saldo_inicial = float(request.form.get('saldo_inicial', 0))
     observacoes = request.form.get('observacoes', '')
+    terminal = nome_terminal_valido(request.form.get('terminal') or terminal_atual())
     
-    sucesso, mensagem = abrir_caixa(current_user.id, saldo_inicial, observacoes)
+    sucesso, mensagem = abrir_caixa(current_user.id, saldo_inicial, observacoes, terminal)
     
     if sucesso:
         flash(mensagem, 'success')
     else:
         flash(mensagem, 'error')
     
-    return redirect(url_for('caixa'))
+    resposta = redirect(url_for('caixa'))
+    resposta.set_cookie(COOKIE_TERMINAL_CAIXA, terminal, max_age=365 * 24 * 3600, httponly=True, samesite='Lax')
+    return resposta
 
 @app.route('/caixa/fechar', methods=['POST'])
 @login_required
@@ -472,7 +573,7 @@ def fechar_caixa_route():
     """Fechar sessão de caixa atual"""
     observacoes = request.form.get('observacoes', '')
     
-    sucesso, mensagem = fechar_caixa(current_user.id, observacoes)
+    sucesso, mensagem = fechar_caixa(current_user.id, observacoes, terminal_atual())
     
     if sucesso:
         flash(mensagem, 'success')
@@ -493,7 +594,7 @@ def nova_movimentacao_caixa():
     observacoes = request.form.get('observacoes', '')
     
     sucesso, mensagem = registrar_movimentacao_caixa(
-        tipo, categoria, descricao, valor, current_user.id, observacoes=observacoes
+        tipo, categoria, descricao, valor, current_user.id, observacoes=observacoes, terminal=terminal_atual()
     )
     
     if sucesso:
@@ -503,6 +604,36 @@ def nova_movimentacao_caixa():
     
     return redirect(url_for('caixa'))
 
+@app.route('/api/caixa/fechamentos')
+@login_required
+@required_permission('caixa')
+def api_fechamentos_caixa():
+    """Sessões de caixa fechadas no período (totais de cada retrato)"""
+    fechamentos = listar_fechamentos_caixa(
+        request.args.get('inicio'), request.args.get('fim'), request.args.get('terminal'),
+        min(request.args.get('limit', 100, type=int), 500)
+    )
+    return jsonify(fechamentos)
+
+@app.route('/api/caixa/fechamentos/<int:sessao_id>')
+@login_required
+@required_permission('caixa')
+def api_fechamento_caixa(sessao_id):
+    """Relatório completo de uma sessão fechada, com as movimentações"""
+    fechamento = obter_fechamento_caixa(sessao_id)
+    if not fechamento:
+        return jsonify({'error': 'Sessão fechada não encontrada'}), 404
+    return jsonify(fechamento)
+
+@app.route('/api/caixa/conciliacao/<int:ano>/<int:mes>')
+@login_required
+@required_permission('caixa')
+def api_conciliacao_caixa(ano, mes):
+    """Conciliação mensal do caixa montada a partir dos retratos das sessões"""
+    if not 1 <= mes <= 12:
+        return jsonify({'error': 'Mês inválido'}), 400
+    return jsonify(obter_conciliacao_caixa_mes(ano, mes))
+
 @app.route('/financeiro')
 @login_required
 @required_permission('caixa')
@@ -623,7 +754,7 @@ def sincronizar_lancamentos_com_contas_route():
 @required_permission('caixa')
 def sincronizar_vendas_caixa():
     """Sincronizar vendas do dia com o caixa"""
-    sucesso, mensagem = sincronizar_vendas_com_caixa()
+    sucesso, mensagem = sincronizar_vendas_com_caixa(terminal_atual())
     
     if sucesso:
         flash(mensagem, 'success')
@@ -684,8 +815,8 @@ def debug_vendas():
 @app.route('/clientes')
 @login_required
 def clientes():
-    clientes_lista = listar_clientes()
-    return render_template('clientes.html', clientes=clientes_lista)
+    grade = consultar_grade('clientes')
+    return render_template('clientes.html', grade=grade)
 
 @app.route('/clientes/adicionar', methods=['POST'], endpoint='adicionar_cliente')
 @login_required
@@ -736,8 +867,8 @@ def deletar_cliente_route(id):
 @app.route('/fornecedores')
 @login_required
 def fornecedores():
-    fornecedores_lista = listar_fornecedores()
-    return render_template('fornecedores.html', fornecedores=fornecedores_lista)
+    grade = consultar_grade('fornecedores')
+    return render_template('fornecedores.html', grade=grade)
 
 @app.route('/fornecedores/adicionar', methods=['POST'], endpoint='adicionar_fornecedor')
 @login_required
@@ -813,12 +944,14 @@ def produtos_fornecedor(id):
 def produtos():
     """Exibe a página de gerenciamento de produtos"""
     try:
-        produtos_lista = listar_produtos()
+        grade = consultar_grade('produtos')
+        estatisticas = obter_painel_dashboard('kpis')
         fornecedores_lista = obter_fornecedores_para_select()
-        return render_template('produtos.html', produtos=produtos_lista, fornecedores=fornecedores_lista)
+        return render_template('produtos.html', grade=grade, estatisticas=estatisticas, fornecedores=fornecedores_lista)
     except Exception as e:
         flash(f'Erro ao carregar produtos: {str(e)}', 'error')
-        return render_template('produtos.html', produtos=[], fornecedores=[])
+        return render_template('produtos.html', grade={'linhas': [], 'proximo': None, 'total': 0},
+                               estatisticas={}, fornecedores=[])
 
 @app.route('/produtos/buscar')
 @login_required
@@ -839,29 +972,11 @@ def buscar_produto_route():
 def api_buscar_produtos():
     """API avançada para buscar produtos com filtros"""
     try:
-        termo = request.args.get('q', '').strip().lower()
+        termo = request.args.get('q', '').strip()
         categoria = request.args.get('categoria', '')
         
-        produtos = listar_produtos()
-        
-        # Filtrar por categoria se especificada
-        if categoria and categoria != 'todas':
-            produtos = [p for p in produtos if p.get('categoria') == categoria]
-        
-        # Filtrar por termo de busca se especificado
-        if termo:
-            produtos_filtrados = []
-            for produto in produtos:
-                if (termo in produto['nome'].lower() or 
-                    termo in str(produto['id']) or
-                    (produto.get('codigo_barras') and termo in produto['codigo_barras'].lower()) or
-                    (produto.get('codigo_fornecedor') and termo in produto['codigo_fornecedor'].lower()) or
-                    (produto.get('categoria') and termo in produto['categoria'].lower()) or
-                    (produto.get('descricao') and termo in produto['descricao'].lower())):
-                    produtos_filtrados.append(produto)
-            produtos = produtos_filtrados
-        
-        return jsonify(produtos[:50])  # Limitar a 50 resultados
+        produtos = pesquisar_produtos(termo, categoria=categoria or None, limite=50)
+        return jsonify(produtos)
     except Exception as e:
         return jsonify({'error': str(e)})
 
@@ -870,37 +985,64 @@ def api_buscar_produtos():
 def api_buscar_produto_unico(termo):
     """Busca um produto específico pelo termo"""
     try:
-        produtos = listar_produtos()
+        # Busca exata por ID, código de barras ou código do fornecedor
+        produto = buscar_produto_por_codigo(termo)
+        if produto:
+            return jsonify(produto)
         
-        # Primeiro tenta encontrar por ID exato
-        try:
-            produto_id = int(termo)
-            for produto in produtos:
-                if produto['id'] == produto_id:
-                    return jsonify(produto)
-        except ValueError:
-            pass
-        
-        # Depois busca por código de barras exato
-        for produto in produtos:
-            if produto.get('codigo_barras') and produto['codigo_barras'].lower() == termo.lower():
-                return jsonify(produto)
-        
-        # Depois busca por código de fornecedor exato
-        for produto in produtos:
-            if produto.get('codigo_fornecedor') and produto['codigo_fornecedor'].lower() == termo.lower():
-                return jsonify(produto)
-        
-        # Por último, busca por nome (primeiro que contenha o termo)
-        termo_lower = termo.lower()
-        for produto in produtos:
-            if termo_lower in produto['nome'].lower():
-                return jsonify(produto)
+        # Por último, o resultado mais relevante da busca por nome
+        produtos = pesquisar_produtos(termo, limite=1)
+        if produtos:
+            return jsonify(produtos[0])
         
         return jsonify({'error': 'Produto não encontrado'})
     except Exception as e:
         return jsonify({'error': str(e)})
 
+@app.route('/api/clientes/buscar')
+@login_required
+def api_buscar_clientes():
+    """Seletor de clientes: busca por prefixo do nome, CPF/CNPJ ou telefone"""
+    try:
+        termo = request.args.get('q', '').strip()
+        limite = min(request.args.get('limite', 10, type=int) or 10, 50)
+        return jsonify(buscar_clientes(termo, limite=limite))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/usuarios/buscar')
+@login_required
+def api_buscar_usuarios():
+    """Seletor de vendedores: usuários ativos pelo prefixo do nome ou login"""
+    try:
+        termo = request.args.get('q', '').strip()
+        limite = min(request.args.get('limite', 10, type=int) or 10, 50)
+        usuarios = buscar_usuarios(termo, limite=limite)
+        return jsonify([
+            {'id': u['id'], 'nome': u['nome_completo'] or u['username'], 'username': u['username']}
+            for u in usuarios
+        ])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/produtos/scan', methods=['POST'])
+@login_required
+def api_scan_produtos():
+    """Busca exata em lote de vários códigos lidos pelo scanner"""
+    try:
+        dados = request.get_json(silent=True) or {}
+        codigos = dados.get('codigos') or request.form.getlist('codigos')
+        if not isinstance(codigos, list):
+            return jsonify({'error': 'Informe uma lista de códigos'}), 400
+        
+        encontrados = buscar_produtos_por_codigos(codigos)
+        return jsonify({
+            'produtos': {codigo: produto for codigo, produto in encontrados.items() if produto},
+            'nao_encontrados': [codigo for codigo, produto in encontrados.items() if not produto]
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/produtos/adicionar', methods=['POST'])
 @login_required
 def adicionar_produto_route():
@@ -1162,6 +1304,49 @@ def teste_direto():
 def api_test():
     return jsonify({"status": "ok", "message": "API funcionando"})
 
+@app.route('/api/admin/pool-conexoes')
+@required_permission('admin')
+def api_pool_conexoes():
+    """Estatísticas do pool de conexões SQLite deste worker"""
+    return jsonify(obter_estatisticas_pool())
+
+@app.route('/api/admin/caches')
+@required_permission('admin')
+def api_caches():
+    """Estatísticas dos caches em memória deste worker"""
+    return jsonify(obter_estatisticas_caches())
+
+@app.route('/api/eventos/stream')
+@login_required
+def api_eventos_stream():
+    """Stream SSE com as vendas e movimentações de caixa novas (dashboard e caixa se atualizam sem recarregar)"""
+    ultimo_id = request.headers.get('Last-Event-ID') or request.args.get('ultimo_id')
+    try:
+        ultimo_id = int(ultimo_id) if ultimo_id else None
+    except ValueError:
+        ultimo_id = None
+    
+    def gerar():
+        # O navegador reconecta sozinho após o fim do stream (retry em ms)
+        yield 'retry: 3000\n\n'
+        for evento in acompanhar_eventos(ultimo_id):
+            if evento is None:
+                yield ': pulso\n\n'
+                continue
+            seq, tipo, dados = evento
+            yield f"id: {seq}\nevent: {tipo}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+    
+    return Response(stream_with_context(gerar()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/admin/eventos')
+@required_permission('admin')
+def api_eventos_estatisticas():
+    """Estatísticas da central de eventos em tempo real deste worker"""
+    return jsonify(obter_estatisticas_eventos())
+
 
 
 
@@ -1178,96 +1363,72 @@ def api_test():
 @app.route('/produtos/importar-xml', methods=['POST'], endpoint='importar_produtos_xml')
 @login_required
 def importar_produtos_xml_route():
-    """Rota para importar produtos via arquivo XML de NFe com configurações avançadas"""
-    from Minha_autopecas_web.logica_banco import importar_produtos_de_xml_avancado
-    
+    """Recebe os XMLs de NFe (ou um ZIP de notas) e enfileira a importação, que roda em segundo plano"""
     try:
         # Verificar se arquivo foi enviado
-        if 'arquivo_xml' not in request.files:
+        arquivos = [arquivo for arquivo in request.files.getlist('arquivo_xml') if arquivo.filename]
+        if not arquivos:
             flash('Nenhum arquivo foi selecionado!', 'error')
             return redirect(url_for('produtos'))
         
-        arquivo = request.files['arquivo_xml']
-        
-        if arquivo.filename == '':
-            flash('Nenhum arquivo foi selecionado!', 'error')
+        if not all(arquivo.filename.lower().endswith(('.xml', '.zip')) for arquivo in arquivos):
+            flash('Envie arquivos XML de NFe ou um ZIP com os XMLs!', 'error')
             return redirect(url_for('produtos'))
         
-        if arquivo and arquivo.filename.lower().endswith('.xml'):
-            try:
-                # Obter configurações do formulário
-                margem_padrao = float(request.form.get('margem_padrao', 100))
-                estoque_minimo_padrao = int(request.form.get('estoque_minimo_padrao', 5))
-                usar_preco_nfe = request.form.get('usar_preco_nfe') == 'on'
-                acao_existente = request.form.get('acao_existente', 'atualizar_estoque')
-                
-                # Ler conteúdo do arquivo
-                conteudo_xml = arquivo.read().decode('utf-8')
-                
-                # Processar XML com configurações avançadas
-                resultado = importar_produtos_de_xml_avancado(
-                    conteudo_xml=conteudo_xml,
-                    margem_padrao=margem_padrao,
-                    estoque_minimo=estoque_minimo_padrao,
-                    usar_preco_nfe=usar_preco_nfe,
-                    acao_existente=acao_existente
-                )
-                
-                if resultado['sucesso']:
-                    # Montar mensagem de sucesso detalhada
-                    mensagem_partes = []
-                    
-                    if resultado['produtos_importados'] > 0:
-                        mensagem_partes.append(f"{resultado['produtos_importados']} novo(s) produto(s) importado(s)")
-                    
-                    if resultado['produtos_atualizados'] > 0:
-                        mensagem_partes.append(f"{resultado['produtos_atualizados']} produto(s) atualizado(s)")
-                    
-                    if resultado['produtos_ignorados'] > 0:
-                        mensagem_partes.append(f"{resultado['produtos_ignorados']} produto(s) ignorado(s)")
-                    
-                    if mensagem_partes:
-                        flash(f"Importação concluída! {', '.join(mensagem_partes)}.", 'success')
-                    else:
-                        flash('Nenhum produto foi processado.', 'warning')
-                    
-                    # Mostrar configurações utilizadas
-                    flash(f"Configurações: Margem {margem_padrao}%, Estoque mín. {estoque_minimo_padrao}, Ação: {acao_existente}", 'info')
-                    
-                    # Mostrar erros se houver
-                    if resultado['erros']:
-                        for erro in resultado['erros'][:5]:  # Mostrar apenas os 5 primeiros erros
-                            flash(f"Aviso: {erro}", 'warning')
-                        
-                        if len(resultado['erros']) > 5:
-                            flash(f"... e mais {len(resultado['erros']) - 5} erro(s)", 'warning')
-                
-                else:
-                    flash(f"Erro ao processar XML: {resultado['erro']}", 'error')
-                    
-            except UnicodeDecodeError:
-                flash('Erro: Arquivo XML com codificação inválida. Certifique-se de que o arquivo está em UTF-8.', 'error')
-            except Exception as e:
-                flash(f'Erro ao processar arquivo XML: {str(e)}', 'error')
-        else:
-            flash('Arquivo deve ser um XML válido!', 'error')
+        # Obter configurações do formulário
+        parametros = {
+            'margem_padrao': float(request.form.get('margem_padrao', 100)),
+            'estoque_minimo': int(request.form.get('estoque_minimo_padrao', 5)),
+            'usar_preco_nfe': request.form.get('usar_preco_nfe') == 'on',
+            'acao_existente': request.form.get('acao_existente', 'atualizar_estoque')
+        }
+        
+        # Os arquivos ficam em disco até a fila processar (nome único, extensão original)
+        diretorio = diretorio_importacoes_nfe()
+        salvos = []
+        try:
+            for arquivo in arquivos:
+                extensao = os.path.splitext(arquivo.filename)[1].lower()
+                caminho = os.path.join(diretorio, f"{uuid.uuid4().hex}{extensao}")
+                salvos.append((arquivo.filename, caminho))
+                arquivo.save(caminho)
+            importacao_id = enfileirar_importacao_nfe(salvos, parametros, current_user.id)
+        except Exception:
+            # Sem tarefa na fila ninguém apagaria os arquivos
+            for _, caminho in salvos:
+                if os.path.exists(caminho):
+                    os.remove(caminho)
+            raise
+        flash(f'Importação #{importacao_id} enviada. O andamento aparece abaixo; você pode continuar usando o sistema.', 'info')
+        return redirect(url_for('produtos', importacao=importacao_id))
             
     except Exception as e:
         flash(f'Erro ao processar arquivo XML: {str(e)}', 'error')
     
     return redirect(url_for('produtos'))
 
+@app.route('/api/importacoes-nfe/<int:importacao_id>')
+@login_required
+def api_importacao_nfe(importacao_id):
+    """Andamento de uma importação de NFe enfileirada (consultado pela tela de produtos)"""
+    importacao = obter_importacao_nfe(importacao_id)
+    if importacao is None:
+        return jsonify({'erro': 'Importação não encontrada'}), 404
+    return jsonify(importacao)
+
 # VENDAS
+# Atalhos de produtos na barra lateral do PDV
+QUANTIDADE_PRODUTOS_RAPIDOS = 12
+
 @app.route('/vendas')
 @login_required
 def vendas():
     from datetime import datetime
-    clientes_lista = listar_clientes()
-    # Buscar vendas do dia para exibir na lista
+    # Clientes e vendedores são buscados sob demanda (/api/clientes/buscar, /api/usuarios/buscar);
+    # dos produtos só vão os atalhos da barra lateral
     vendas_dados = obter_vendas_do_dia()
     vendas_hoje = vendas_dados.get('vendas', [])
-    produtos_lista = listar_produtos()
-    usuarios_lista = listar_usuarios()
+    produtos_rapidos = consultar_grade('produtos', limite=QUANTIDADE_PRODUTOS_RAPIDOS)['linhas']
     
     # Calcular estatísticas
     total_vendas_hoje = sum(venda.get('total', 0) for venda in vendas_hoje)
@@ -1278,14 +1439,12 @@ def vendas():
     data_hoje = datetime.now().strftime('%Y-%m-%d')
     
     return render_template('vendas.html', 
-                         clientes=clientes_lista, 
                          vendas_hoje=vendas_hoje,
                          total_vendas_hoje=total_vendas_hoje,
                          total_itens_vendidos=total_itens_vendidos,
                          ticket_medio=ticket_medio,
                          data_hoje=data_hoje,
-                         produtos=produtos_lista,
-                         usuarios=usuarios_lista)
+                         produtos_rapidos=produtos_rapidos)
 
 # API para filtros de vendas por período
 @app.route('/api/vendas/periodo')
@@ -1341,26 +1500,49 @@ def api_venda_detalhes(venda_id):
         return jsonify({'error': f'Erro interno: {str(e)}'}), 500
 
 # APIs para exportação de vendas
+# Planilhas geradas em fluxo: (gerador, mimetype, extensão) por formato
+FORMATOS_EXPORTACAO_VENDAS = {
+    'csv': (gerar_csv, 'text/csv; charset=utf-8', 'csv'),
+    'xlsx': (gerar_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+
 @app.route('/api/vendas/exportar/<formato>')
 @login_required
 def api_exportar_vendas(formato):
-    """API para exportar vendas em diferentes formatos"""
+    """Exporta as vendas do período item a item, em fluxo (CSV ou XLSX; PDF usa o relatório existente)"""
     try:
-        data_inicio = request.args.get('inicio')
-        data_fim = request.args.get('fim')
+        data_inicio = request.args.get('inicio') or None
+        data_fim = request.args.get('fim') or None
+        cliente_id = request.args.get('cliente_id', type=int)
+        
+        if formato == 'excel':
+            formato = 'xlsx'
+        if formato == 'pdf':
+            return redirect(url_for('exportar_vendas_pdf', data_inicio=data_inicio, data_fim=data_fim,
+                                    cliente_id=cliente_id))
+        if formato not in FORMATOS_EXPORTACAO_VENDAS:
+            return jsonify({'error': 'Formato não suportado'}), 400
         
-        if not data_inicio or not data_fim:
-            return jsonify({'error': 'Parâmetros de data são obrigatórios'}), 400
+        for data in (data_inicio, data_fim):
+            if data:
+                datetime.strptime(data[:10], '%Y-%m-%d')
         
-        if formato not in ['excel', 'pdf']:
-            return jsonify({'error': 'Formato não suportado'}), 400
+        gerador, mimetype, extensao = FORMATOS_EXPORTACAO_VENDAS[formato]
+        linhas = iterar_itens_vendas(data_inicio, data_fim, cliente_id)
+        if formato == 'xlsx':
+            arquivo = gerador(CABECALHO_EXPORTACAO_VENDAS, linhas, nome_planilha='Vendas')
+        else:
+            arquivo = gerador(CABECALHO_EXPORTACAO_VENDAS, linhas)
         
-        # Por enquanto, retornar um placeholder - implementar exportação real posteriormente
-        return jsonify({
-            'message': f'Exportação em {formato} será implementada em breve',
-            'periodo': f'{data_inicio} a {data_fim}'
+        periodo = '_'.join(data[:10] for data in (data_inicio, data_fim) if data) or 'completo'
+        return Response(stream_with_context(arquivo), mimetype=mimetype, headers={
+            'Content-Disposition': f'attachment; filename=vendas_{periodo}.{extensao}',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
         })
         
+    except ValueError:
+        return jsonify({'error': 'Data inválida (use AAAA-MM-DD)'}), 400
     except Exception as e:
         print(f"Erro na API exportar vendas: {str(e)}")
         return jsonify({'error': f'Erro interno: {str(e)}'}), 500
@@ -1451,10 +1633,34 @@ def api_configuracoes_empresa():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+def _resposta_venda_registrada(venda_id):
+    """Resposta de sucesso de /vendas/registrar (a mesma para a venda nova e para o reenvio)"""
+    # Se a requisição é AJAX, retorna JSON com o ID da venda
+    if request.headers.get('Content-Type') == 'application/json' or request.args.get('ajax') == '1':
+        return jsonify({
+            'success': True,
+            'venda_id': venda_id,
+            'message': f'Venda #{venda_id} registrada com sucesso!'
+        })
+    
+    flash(f'Venda #{venda_id} registrada com sucesso!', 'success')
+    
+    # Verificar se deve imprimir o recibo
+    if request.form.get('imprimir_recibo') == 'on':
+        # Redireciona para o recibo em uma nova aba
+        return render_template('venda_sucesso.html', venda_id=venda_id, imprimir=True)
+    return redirect(url_for('vendas'))
+
 @app.route('/vendas/registrar', methods=['POST'], endpoint='registrar_venda')
 @login_required
 def registrar_venda_route():
     try:
+        # Chave gerada pelo PDV a cada venda: reenvios (Wi-Fi instável, duplo clique) devolvem a venda original
+        chave_idempotencia = (request.form.get('chave_idempotencia') or request.headers.get('Idempotency-Key') or '').strip()[:100] or None
+        venda_id = buscar_venda_por_chave_idempotencia(chave_idempotencia)
+        if venda_id is not None:
+            return _resposta_venda_registrada(venda_id)
+        
         cliente_id = request.form.get('cliente_id')
         if cliente_id:
             cliente_id = int(cliente_id)
@@ -1489,25 +1695,9 @@ def registrar_venda_route():
                 flash(f'Item {i+1}: preco_unitario ausente', 'error')
                 return redirect(url_for('vendas'))
         
-        venda_id = registrar_venda(cliente_id, itens, forma_pagamento, desconto, observacoes, current_user.id)
-        
-        # Se a requisição é AJAX, retorna JSON com o ID da venda
-        if request.headers.get('Content-Type') == 'application/json' or request.args.get('ajax') == '1':
-            return jsonify({
-                'success': True,
-                'venda_id': venda_id,
-                'message': f'Venda #{venda_id} registrada com sucesso!'
-            })
-        
-        # Verificar se deve imprimir o recibo
-        imprimir_recibo = request.form.get('imprimir_recibo') == 'on'
-        
-        if imprimir_recibo:
-            flash(f'Venda #{venda_id} registrada com sucesso!', 'success')
-            # Redireciona para o recibo em uma nova aba
-            return render_template('venda_sucesso.html', venda_id=venda_id, imprimir=True)
-        else:
-            flash(f'Venda #{venda_id} registrada com sucesso!', 'success')
+        venda_id = registrar_venda(cliente_id, itens, forma_pagamento, desconto, observacoes, current_user.id,
+                                   chave_idempotencia=chave_idempotencia, terminal=terminal_atual())
+        return _resposta_venda_registrada(venda_id)
         
     except Exception as e:
         # Se a requisição é AJAX, retorna erro em JSON
@@ -1735,12 +1925,12 @@ def adicionar_conta_receber_route():
 @app.route('/orcamentos')
 @login_required
 def orcamentos():
-    orcamentos_lista = listar_orcamentos()
-    produtos = listar_produtos()
+    grade_orcamentos = consultar_grade('orcamentos')
+    grade_produtos = consultar_grade('produtos')
     clientes = listar_clientes()
     return render_template('orcamentos.html', 
-                         orcamentos=orcamentos_lista, 
-                         produtos=produtos, 
+                         grade_orcamentos=grade_orcamentos, 
+                         grade_produtos=grade_produtos, 
                          clientes=clientes)
 
 @app.route('/orcamentos/criar', methods=['POST'], endpoint='criar_orcamento_route')
@@ -1873,7 +2063,7 @@ def converter_orcamento_route(id):
             flash('Forma de pagamento é obrigatória', 'error')
             return redirect(url_for('visualizar_orcamento', id=id))
         
-        venda_id = converter_orcamento_em_venda(id, forma_pagamento)
+        venda_id = converter_orcamento_em_venda(id, forma_pagamento, terminal_atual())
         flash('Orçamento convertido em venda com sucesso!', 'success')
         return redirect(url_for('vendas'))
         
@@ -2671,6 +2861,43 @@ def inject_globals():
         'today': date.today()
     }
 
+# COMANDOS DE MANUTENÇÃO (flask --app app <comando>)
+@app.cli.command('reconstruir-resumo-vendas')
+@click.option('--inicio', default=None, help='Primeiro dia (AAAA-MM-DD); padrão: desde a primeira venda')
+@click.option('--fim', default=None, help='Último dia (AAAA-MM-DD); padrão: até hoje')
+def reconstruir_resumo_vendas_comando(inicio, fim):
+    """Recalcula o resumo diário de vendas a partir das vendas registradas"""
+    sucesso, mensagem = reconstruir_resumo_vendas(inicio, fim)
+    click.echo(mensagem)
+    if not sucesso:
+        raise SystemExit(1)
+
+@app.cli.command('importar-nfes')
+@click.argument('caminho', type=click.Path(exists=True))
+@click.option('--margem', default=100.0, show_default=True, help='Margem de lucro padrão (%)')
+@click.option('--estoque-minimo', default=5, show_default=True, help='Estoque mínimo dos produtos novos')
+@click.option('--acao', default='atualizar_estoque', show_default=True,
+              type=click.Choice(['atualizar_estoque', 'substituir_dados', 'ignorar']),
+              help='O que fazer com produtos já cadastrados')
+@click.option('--sem-preco-nfe', is_flag=True, help='Não usar o preço da NFe como custo')
+@click.option('--processos', default=None, type=int, help='Processos de leitura dos XMLs')
+def importar_nfes_comando(caminho, margem, estoque_minimo, acao, sem_preco_nfe, processos):
+    """Importa os produtos de todas as NFe de um diretório (XMLs e ZIPs) ou de um arquivo ZIP"""
+    origens = listar_nfes_do_diretorio(caminho) if os.path.isdir(caminho) else listar_nfes_do_zip(caminho)
+    resultado = importar_produtos_de_nfes_em_lote(
+        origens, margem_padrao=margem, estoque_minimo=estoque_minimo,
+        usar_preco_nfe=not sem_preco_nfe, acao_existente=acao, processos=processos
+    )
+    for erro in resultado['erros']:
+        click.echo(f"Aviso: {erro}", err=True)
+    if not resultado['sucesso']:
+        click.echo(resultado['erro'], err=True)
+        raise SystemExit(1)
+    click.echo(f"{resultado['arquivos_processados']} arquivo(s) lido(s), {resultado['arquivos_com_erro']} com erro, "
+               f"{resultado['notas_importadas']} nota(s) importada(s), {resultado['notas_duplicadas']} já importada(s), "
+               f"{resultado['itens_lidos']} item(ns): {resultado['produtos_importados']} produto(s) novo(s), "
+               f"{resultado['produtos_atualizados']} atualizado(s), {resultado['produtos_ignorados']} ignorado(s)")
+
 if __name__ == '__main__':
     # Inicializar o banco de dados
     init_db()
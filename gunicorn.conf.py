@@ -0,0 +1,19 @@
+# Configuração do Gunicorn (carregada automaticamente ao rodar `gunicorn app:app` nesta pasta)
+#
+# O stream de eventos (/api/eventos/stream) deixa cada conexão aberta por até 5 minutos.
+# Com o worker `sync` padrão, cada aba do dashboard ou do caixa ocuparia um processo
+# inteiro e o arbiter mataria o worker após `timeout` segundos. O worker `gthread`
+# atende cada conexão numa thread e mantém o heartbeat pelo laço principal, então
+# streams longos não bloqueiam as demais requisições nem derrubam o processo.
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+worker_class = 'gthread'
+workers = int(os.environ.get('GUNICORN_WORKERS', '2'))
+# Cada aba aberta no dashboard/caixa consome uma thread enquanto o stream durar
+threads = int(os.environ.get('GUNICORN_THREADS', '32'))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = 30
+keepalive = 5
@@ -224,6 +224,7 @@ function createPaginationControls(containerId, options = {}) {
     const defaultOptions = {
         showSearch: true,
         showItemsPerPage: true,
+        showAllOption: true,
         searchPlaceholder: 'Buscar...',
         ...options
     };
@@ -241,7 +242,7 @@ function createPaginationControls(containerId, options = {}) {
                         <option value="20" selected>20</option>
                         <option value="50">50</option>
                         <option value="100">100</option>
-                        <option value="all">Todos</option>
+                        ${defaultOptions.showAllOption ? '<option value="all">Todos</option>' : ''}
                     </select>
                     <span class="ms-2 text-muted">itens por página</span>
                 </div>
@@ -291,6 +292,227 @@ function createPaginationControls(containerId, options = {}) {
     $(`#${containerId}`).html(html);
 }
 
+/**
+ * Grade paginada no servidor (/api/grade/<visao>)
+ * Busca, filtros e ordenação vão na query string; a navegação usa os cursores
+ * devolvidos pelo servidor (paginação por chave), guardando os das páginas já
+ * visitadas para o botão "Anterior". A primeira página vem renderizada com a tela.
+ */
+class GradeServidor {
+    constructor(options = {}) {
+        this.tableId = options.tableId || 'tabelaPrincipal';
+        this.visao = options.visao;
+        this.itemsPerPageId = options.itemsPerPageId || 'itensPorPagina';
+        this.searchId = options.searchId || 'buscaPrincipal';
+        this.visibleCountId = options.visibleCountId || 'itensVisiveis';
+        this.totalCountId = options.totalCountId || 'totalItens';
+        this.prevBtnId = options.prevBtnId || 'btnAnterior';
+        this.nextBtnId = options.nextBtnId || 'btnProximo';
+        this.paginationControlsId = options.paginationControlsId || 'controlesNavegacao';
+        this.pageInfoId = options.pageInfoId || 'infoPaginacao';
+        // {filtro da grade: id do <select>/<input>}
+        this.filtros = options.filtros || {};
+        this.aoRenderizar = options.aoRenderizar || null;
+        
+        this.itemsPerPage = parseInt(options.defaultItemsPerPage) || 20;
+        this.ordenar = options.ordenar || null;
+        this.direcao = options.direcao || null;
+        this.cursores = [null];
+        this.paginaAtual = 0;
+        this.requisicao = null;
+        this.timeoutBusca = null;
+        
+        this.init();
+    }
+    
+    init() {
+        this.$table = document.getElementById(this.tableId);
+        this.$tbody = this.$table.querySelector('tbody');
+        this.$itemsPerPage = document.getElementById(this.itemsPerPageId);
+        this.$search = document.getElementById(this.searchId);
+        this.$prevBtn = document.getElementById(this.prevBtnId);
+        this.$nextBtn = document.getElementById(this.nextBtnId);
+        
+        // Estado da primeira página, renderizada pelo servidor junto com a tela
+        const dados = this.$table.dataset;
+        this.proximo = dados.proximo || null;
+        this.total = parseInt(dados.total) || 0;
+        this.totalEstimado = dados.totalEstimado === '1';
+        if (this.$itemsPerPage) {
+            this.$itemsPerPage.value = String(this.itemsPerPage);
+        }
+        
+        this.bindEvents();
+        this.atualizarControles();
+    }
+    
+    bindEvents() {
+        if (this.$itemsPerPage) {
+            this.$itemsPerPage.addEventListener('change', () => {
+                this.itemsPerPage = parseInt(this.$itemsPerPage.value) || 20;
+                this.recarregar();
+            });
+        }
+        
+        if (this.$search) {
+            this.$search.addEventListener('input', () => {
+                clearTimeout(this.timeoutBusca);
+                this.timeoutBusca = setTimeout(() => this.recarregar(), 300);
+            });
+        }
+        
+        Object.values(this.filtros).forEach(id => {
+            const campo = document.getElementById(id);
+            if (campo) {
+                campo.addEventListener('change', () => this.recarregar());
+            }
+        });
+        
+        // Cabeçalhos com data-ordenar alternam a ordenação no servidor
+        this.$table.querySelectorAll('th[data-ordenar]').forEach(th => {
+            th.style.cursor = 'pointer';
+            th.addEventListener('click', () => {
+                const coluna = th.dataset.ordenar;
+                this.direcao = this.ordenar === coluna && this.direcao === 'asc' ? 'desc' : 'asc';
+                this.ordenar = coluna;
+                this.recarregar();
+            });
+        });
+        
+        if (this.$prevBtn) {
+            this.$prevBtn.addEventListener('click', () => this.paginaAnterior());
+        }
+        if (this.$nextBtn) {
+            this.$nextBtn.addEventListener('click', () => this.proximaPagina());
+        }
+        
+        document.addEventListener('keydown', (e) => {
+            if (e.target.tagName === 'INPUT' || e.target.tagName === 'TEXTAREA' || e.target.tagName === 'SELECT') return;
+            if (e.key === 'ArrowLeft') {
+                this.paginaAnterior();
+            } else if (e.key === 'ArrowRight') {
+                this.proximaPagina();
+            }
+        });
+    }
+    
+    parametros(apos) {
+        const params = new URLSearchParams({limite: this.itemsPerPage, somente_html: 1});
+        if (this.$search && this.$search.value.trim()) {
+            params.set('busca', this.$search.value.trim());
+        }
+        Object.entries(this.filtros).forEach(([filtro, id]) => {
+            const campo = document.getElementById(id);
+            if (campo && campo.value) {
+                params.set(filtro, campo.value);
+            }
+        });
+        if (this.ordenar) {
+            params.set('ordenar', this.ordenar);
+        }
+        if (this.direcao) {
+            params.set('direcao', this.direcao);
+        }
+        if (apos) {
+            params.set('apos', apos);
+        }
+        return params;
+    }
+    
+    async carregar(pagina) {
+        // Só a última requisição vale (busca digitada rapidamente gera várias)
+        if (this.requisicao) {
+            this.requisicao.abort();
+        }
+        this.requisicao = new AbortController();
+        
+        try {
+            const resposta = await fetch(`/api/grade/${this.visao}?${this.parametros(this.cursores[pagina])}`, {
+                signal: this.requisicao.signal
+            });
+            const dados = await resposta.json();
+            if (!resposta.ok) {
+                throw new Error(dados.error || `HTTP ${resposta.status}`);
+            }
+            
+            this.paginaAtual = pagina;
+            this.proximo = dados.proximo;
+            this.cursores[pagina + 1] = dados.proximo;
+            if (dados.total !== null && dados.total !== undefined) {
+                this.total = dados.total;
+                this.totalEstimado = dados.total_estimado;
+            }
+            this.$tbody.innerHTML = dados.html;
+            this.atualizarControles();
+            if (this.aoRenderizar) {
+                this.aoRenderizar(this.$tbody);
+            }
+        } catch (erro) {
+            if (erro.name !== 'AbortError') {
+                console.error('Erro ao carregar a grade:', erro);
+            }
+        }
+    }
+    
+    // Volta para a primeira página (busca, filtro, ordenação ou tamanho de página mudou)
+    recarregar() {
+        this.cursores = [null];
+        return this.carregar(0);
+    }
+    
+    proximaPagina() {
+        if (this.proximo) {
+            this.carregar(this.paginaAtual + 1);
+        }
+    }
+    
+    paginaAnterior() {
+        if (this.paginaAtual > 0) {
+            this.carregar(this.paginaAtual - 1);
+        }
+    }
+    
+    atualizarControles() {
+        const visiveis = this.$tbody.querySelectorAll('tr:not(.no-results-row)').length;
+        const totalTexto = this.totalEstimado ? `${this.total}+` : this.total;
+        const $visible = document.getElementById(this.visibleCountId);
+        const $total = document.getElementById(this.totalCountId);
+        if ($visible) $visible.textContent = visiveis;
+        if ($total) $total.textContent = totalTexto;
+        
+        if (this.$prevBtn) {
+            this.$prevBtn.disabled = this.paginaAtual === 0;
+            this.$prevBtn.innerHTML = `<i class="fas fa-chevron-left"></i> Anterior${this.paginaAtual > 0 ? ` (${this.paginaAtual})` : ''}`;
+        }
+        if (this.$nextBtn) {
+            this.$nextBtn.disabled = !this.proximo;
+            this.$nextBtn.innerHTML = `Próximo${this.proximo ? ` (${this.paginaAtual + 2})` : ''} <i class="fas fa-chevron-right"></i>`;
+        }
+        
+        const $controles = document.getElementById(this.paginationControlsId);
+        if ($controles) {
+            $controles.style.display = this.paginaAtual === 0 && !this.proximo ? 'none' : '';
+        }
+        
+        const $pageInfo = document.getElementById(this.pageInfoId);
+        if ($pageInfo) {
+            const totalPaginas = Math.ceil(this.total / this.itemsPerPage);
+            if (this.paginaAtual > 0 || this.proximo) {
+                $pageInfo.innerHTML = `<small class="text-muted">Página ${this.paginaAtual + 1} de ${totalPaginas}${this.totalEstimado ? '+' : ''}</small>`;
+                $pageInfo.style.display = '';
+            } else {
+                $pageInfo.style.display = 'none';
+            }
+        }
+        
+        this.$table.querySelectorAll('th[data-ordenar]').forEach(th => {
+            th.classList.toggle('ordenado-asc', th.dataset.ordenar === this.ordenar && this.direcao === 'asc');
+            th.classList.toggle('ordenado-desc', th.dataset.ordenar === this.ordenar && this.direcao === 'desc');
+        });
+    }
+}
+
 // Exportar para uso global
 window.TablePagination = TablePagination;
+window.GradeServidor = GradeServidor;
 window.createPaginationControls = createPaginationControls;
\ No newline at end of file